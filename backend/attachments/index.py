@@ -0,0 +1,729 @@
+import base64
+import binascii
+import hashlib
+import io
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from typing import Dict, Any, Optional, Tuple
+from urllib.parse import quote
+
+# >>> shared/db_connection.py (копия, правится в shared/ и переносится scripts/sync_shared_blocks.py)
+# Соединения живут в модуле и переиспользуются тёплыми вызовами функции.
+# psycopg2 импортируется только при первом запросе, которому нужна БД,
+# поэтому CORS preflight и холодный старт не платят за загрузку драйвера.
+_conn = None
+
+# Чтения без требований к свежести функция берёт через get_read_connection:
+# они уходят на реплику (REPLICA_DATABASE_URL), пока её отставание не
+# превышает REPLICA_MAX_LAG_SECONDS. Отставание проверяется не чаще раза в
+# REPLICA_LAG_CHECK_INTERVAL секунд.
+REPLICA_MAX_LAG_SECONDS = float(os.environ.get('REPLICA_MAX_LAG_SECONDS', '5'))
+REPLICA_LAG_CHECK_INTERVAL = 2.0
+_replica_conn = None
+_replica_checked_at = 0.0
+_replica_usable = False
+
+def get_connection(database_url: str):
+    '''Возвращает открытое соединение с основной БД, подключаясь только при необходимости'''
+    global _conn
+    if _conn is None or _conn.closed:
+        import psycopg2
+        _conn = psycopg2.connect(database_url, connect_timeout=3,
+                                 options=f'-c statement_timeout={STATEMENT_TIMEOUT_MS}',
+                                 connection_factory=tracked_connection_class())
+        note_db_success()
+    apply_statement_timeout(_conn)
+    return _conn
+
+def get_read_connection(database_url: str):
+    '''Возвращает соединение для чтения: реплику, если она успевает за основной БД'''
+    global _replica_conn, _replica_checked_at, _replica_usable
+    replica_url = os.environ.get('REPLICA_DATABASE_URL')
+    if not replica_url:
+        return get_connection(database_url)
+    
+    now = time.monotonic()
+    if now - _replica_checked_at >= REPLICA_LAG_CHECK_INTERVAL:
+        _replica_checked_at = now
+        try:
+            if _replica_conn is None or _replica_conn.closed:
+                import psycopg2
+                _replica_conn = psycopg2.connect(replica_url, connect_timeout=2,
+                                                 options=f'-c statement_timeout={STATEMENT_TIMEOUT_MS}',
+                                                 connection_factory=tracked_connection_class())
+            cur = _replica_conn.cursor()
+            # Простаивающая основная БД не двигает replay timestamp, поэтому
+            # полностью проигранный WAL считается нулевым отставанием
+            cur.execute("""
+                SELECT CASE
+                    WHEN NOT pg_is_in_recovery() THEN 0
+                    WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                    ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+                END
+            """)
+            lag = float(cur.fetchone()[0])
+            _replica_conn.rollback()
+            _replica_usable = lag <= REPLICA_MAX_LAG_SECONDS
+        except Exception:
+            _replica_usable = False
+            if _replica_conn is not None:
+                _replica_conn.close()
+                _replica_conn = None
+    
+    if _replica_usable and _replica_conn is not None:
+        apply_statement_timeout(_replica_conn)
+        return _replica_conn
+    return get_connection(database_url)
+
+def release_connection(conn) -> None:
+    '''Завершает транзакцию запроса, оставляя соединение открытым для следующего вызова'''
+    global _conn, _replica_conn
+    try:
+        import psycopg2.extensions
+        in_transaction = conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE
+        conn.rollback()
+        if in_transaction:
+            note_db_success()
+    except Exception:
+        conn.close()
+        if conn is _conn:
+            _conn = None
+        if conn is _replica_conn:
+            _replica_conn = None
+# <<< shared/db_connection.py
+
+# Пределы по умолчанию для эндпоинтов, не указанных в ENDPOINT_BUDGETS
+STATEMENT_TIMEOUT_MS = int(os.environ.get('STATEMENT_TIMEOUT_MS', '3000'))
+MAX_CONCURRENT_REQUESTS = int(os.environ.get('MAX_CONCURRENT_REQUESTS', '10'))
+
+# Бюджеты эндпоинтов: (statement_timeout в мс, одновременных запросов на
+# экземпляр). Загрузка держит тело файла в памяти и ограничена узким пулом,
+# чтобы не вытеснять отдачу файлов.
+ENDPOINT_BUDGETS: Dict[str, Tuple[int, int]] = {
+    'download': (STATEMENT_TIMEOUT_MS, MAX_CONCURRENT_REQUESTS),
+    'upload': (STATEMENT_TIMEOUT_MS, max(1, MAX_CONCURRENT_REQUESTS // 2)),
+}
+
+def endpoint_of(event: Dict[str, Any]) -> str:
+    '''Эндпоинт запроса для выбора бюджета'''
+    return 'download' if event.get('httpMethod') == 'GET' else 'upload'
+
+# >>> shared/db_resilience.py (копия, правится в shared/ и переносится scripts/sync_shared_blocks.py)
+# Устойчивость к деградации БД. У каждого эндпоинта функции свой бюджет из
+# ENDPOINT_BUDGETS (функция определяет его вместе с endpoint_of):
+# statement_timeout его SQL-запросов и число одновременных запросов на
+# экземпляр. Запросы сверх предела эндпоинта отклоняются с 503 и
+# Retry-After; после BREAKER_FAILURE_THRESHOLD подряд сбоев соединения или
+# запроса автомат отключения отвечает 503 без обращения к БД и через
+# BREAKER_RESET_SECONDS пропускает один пробный запрос.
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get('BREAKER_FAILURE_THRESHOLD', '5'))
+BREAKER_RESET_SECONDS = float(os.environ.get('BREAKER_RESET_SECONDS', '10'))
+
+class CircuitBreaker:
+    '''Автомат отключения: closed -> open после серии сбоев -> half_open для пробы'''
+
+    def __init__(self, threshold: int, reset_seconds: float) -> None:
+        self.threshold = threshold
+        self.reset_seconds = reset_seconds
+        self.state = 'closed'
+        self.consecutive_failures = 0
+        self.failures_total = 0
+        self.opened_at = 0.0
+        self.trips = 0
+        self.lock = threading.Lock()
+
+    def allow(self) -> bool:
+        '''Разрешает запрос; в half_open пропускает только одну пробу'''
+        with self.lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and time.monotonic() - self.opened_at >= self.reset_seconds:
+                self.state = 'half_open'
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self.lock:
+            self.state = 'closed'
+            self.consecutive_failures = 0
+
+    def release_probe(self) -> None:
+        '''Возвращает в open пробу, не дошедшую до БД: следующий запрос пробует снова'''
+        with self.lock:
+            if self.state == 'half_open':
+                self.state = 'open'
+                self.opened_at = time.monotonic() - self.reset_seconds
+
+    def record_failure(self) -> None:
+        with self.lock:
+            self.failures_total += 1
+            self.consecutive_failures += 1
+            if self.state == 'half_open' or self.consecutive_failures >= self.threshold:
+                if self.state != 'open':
+                    self.trips += 1
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+
+    def retry_after(self) -> int:
+        return max(1, int(self.reset_seconds - (time.monotonic() - self.opened_at)) + 1)
+
+_breaker = CircuitBreaker(BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_SECONDS)
+_in_flight: Dict[str, threading.BoundedSemaphore] = {}
+_in_flight_lock = threading.Lock()
+_resilience_metrics = {'shed': 0, 'breaker_rejected': 0}
+_shed_by_endpoint: Dict[str, int] = {}
+# Дополнительные счётчики функции для ответа ?metrics=1
+_metrics_sources: Dict[str, Any] = {}
+
+# Исход текущего запроса для автомата: успехом считается только реальный
+# обмен с БД (подключение, COMMIT, откат начатой транзакции), а не ответ
+# из кэша или отказ в валидации до первого запроса
+_request_state = threading.local()
+
+def note_db_success() -> None:
+    '''Отмечает, что запрос успешно обменялся данными с БД'''
+    _request_state.db_ok = True
+
+_tracked_connection_class = None
+
+def tracked_connection_class():
+    '''Класс соединения psycopg2, который отмечает успешный COMMIT'''
+    global _tracked_connection_class
+    if _tracked_connection_class is None:
+        import psycopg2.extensions
+
+        class TrackedConnection(psycopg2.extensions.connection):
+            def commit(self) -> None:
+                super().commit()
+                note_db_success()
+
+        _tracked_connection_class = TrackedConnection
+    return _tracked_connection_class
+
+def endpoint_budget(endpoint: str) -> Tuple[int, int]:
+    '''(statement_timeout в мс, одновременных запросов) для эндпоинта'''
+    return ENDPOINT_BUDGETS.get(endpoint, (STATEMENT_TIMEOUT_MS, MAX_CONCURRENT_REQUESTS))
+
+def endpoint_semaphore(endpoint: str) -> threading.BoundedSemaphore:
+    '''Семафор параллельности эндпоинта, создаётся при первом запросе'''
+    with _in_flight_lock:
+        if endpoint not in _in_flight:
+            _in_flight[endpoint] = threading.BoundedSemaphore(endpoint_budget(endpoint)[1])
+        return _in_flight[endpoint]
+
+def apply_statement_timeout(conn) -> None:
+    '''Переключает statement_timeout сессии на бюджет эндпоинта текущего запроса'''
+    import psycopg2.extensions
+    timeout_ms = endpoint_budget(getattr(_request_state, 'endpoint', ''))[0]
+    if getattr(conn, 'statement_timeout_ms', STATEMENT_TIMEOUT_MS) == timeout_ms:
+        return
+    if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+        return
+    # SET вне транзакции запроса: COMMIT сохраняет значение в сессии, и
+    # запросы того же эндпоинта на тёплом соединении его не повторяют
+    cur = conn.cursor()
+    cur.execute('SET statement_timeout = %s', (timeout_ms,))
+    cur.close()
+    conn.commit()
+    conn.statement_timeout_ms = timeout_ms
+
+def unavailable(retry_after: int, reason: str) -> Dict[str, Any]:
+    '''Ответ 503 с подсказкой, когда повторить запрос'''
+    return {
+        'statusCode': 503,
+        'headers': {'Access-Control-Allow-Origin': '*', 'Retry-After': str(retry_after)},
+        'body': json.dumps({'error': reason})
+    }
+
+def record_db_failure(error: Exception) -> None:
+    '''Учитывает в автомате отключения сбои соединения и таймауты запросов'''
+    import psycopg2
+    if isinstance(error, (psycopg2.OperationalError, psycopg2.InterfaceError)):
+        _request_state.db_failed = True
+        _breaker.record_failure()
+
+def resilient(handler_func):
+    '''Оборачивает handler ограничением параллельности и автоматом отключения'''
+    def wrapper(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+        if event.get('httpMethod') == 'OPTIONS':
+            return handler_func(event, context)
+        
+        # Счётчики сброса нагрузки и срабатываний автомата: ?metrics=1
+        if (event.get('queryStringParameters') or {}).get('metrics') == '1':
+            return {
+                'statusCode': 200,
+                'headers': {'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({
+                    'shed': _resilience_metrics['shed'],
+                    'shed_by_endpoint': _shed_by_endpoint,
+                    'breaker_rejected': _resilience_metrics['breaker_rejected'],
+                    'breaker_trips': _breaker.trips,
+                    'breaker_state': _breaker.state,
+                    'db_failures': _breaker.failures_total,
+                    **_metrics_sources
+                })
+            }
+        
+        endpoint = endpoint_of(event)
+        in_flight = endpoint_semaphore(endpoint)
+        if not in_flight.acquire(blocking=False):
+            _resilience_metrics['shed'] += 1
+            _shed_by_endpoint[endpoint] = _shed_by_endpoint.get(endpoint, 0) + 1
+            return unavailable(1, 'Too many concurrent requests')
+        if not _breaker.allow():
+            in_flight.release()
+            _resilience_metrics['breaker_rejected'] += 1
+            return unavailable(_breaker.retry_after(), 'Database temporarily unavailable')
+        
+        _request_state.endpoint = endpoint
+        _request_state.db_ok = False
+        _request_state.db_failed = False
+        try:
+            return handler_func(event, context)
+        finally:
+            in_flight.release()
+            if _request_state.db_ok and not _request_state.db_failed:
+                _breaker.record_success()
+            elif not _request_state.db_failed:
+                _breaker.release_probe()
+    return wrapper
+# <<< shared/db_resilience.py
+
+
+# Загрузка и выдача вложений. Файл приходит телом POST (base64 от платформы),
+# декодируется и пишется в хранилище кусками по UPLOAD_CHUNK_BYTES, хэш SHA-256
+# считается по ходу записи. Одинаковые файлы хранятся один раз под ключом хэша.
+ATTACHMENT_MAX_BYTES = int(os.environ.get('ATTACHMENT_MAX_BYTES', str(5 * 1024 * 1024)))
+UPLOAD_CHUNK_BYTES = 48 * 1024
+ATTACHMENTS_STORE = os.environ.get('ATTACHMENTS_STORE', 'local')
+# Локальное хранилище видно только экземпляру, который записал файл: по
+# умолчанию это временный каталог экземпляра, и GET на другом экземпляре
+# вернёт 404. Поэтому store=local годится для разработки и развёртывания в
+# один экземпляр либо с общим каталогом (сетевой том) в ATTACHMENTS_DIR.
+ATTACHMENTS_DIR = os.environ.get('ATTACHMENTS_DIR', os.path.join(tempfile.gettempdir(), 'attachments'))
+# Необязательный публичный адрес функции для абсолютных ссылок на вложения
+ATTACHMENTS_PUBLIC_URL = os.environ.get('ATTACHMENTS_PUBLIC_URL', '')
+# Миниатюры строит Pillow в пуле потоков; без Pillow они не создаются
+THUMBNAIL_SIZE = int(os.environ.get('THUMBNAIL_SIZE', '320'))
+THUMBNAIL_WORKERS = int(os.environ.get('THUMBNAIL_WORKERS', '2'))
+THUMBNAIL_WAIT_SECONDS = float(os.environ.get('THUMBNAIL_WAIT_SECONDS', '2'))
+THUMBNAIL_MAX_PIXELS = 40_000_000
+
+HASH_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+BASE64_WHITESPACE = re.compile(r'\s+')
+# Символы имени файла, которые нельзя отдавать в заголовке ответа
+FILENAME_UNSAFE = re.compile(r'[\x00-\x1f\x7f"\\]')
+RANGE_PATTERN = re.compile(r'^bytes=(\d*)-(\d*)$')
+IMAGE_SIGNATURES = [
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+]
+
+class LocalObjectWriter:
+    '''Запись объекта во временный файл; объект появляется в хранилище только после commit'''
+
+    def __init__(self, store: 'LocalObjectStore') -> None:
+        self.store = store
+        fd, self.tmp_path = tempfile.mkstemp(dir=store.staging_dir)
+        self.file = os.fdopen(fd, 'wb')
+
+    def write(self, chunk: bytes) -> None:
+        self.file.write(chunk)
+
+    def commit(self, key: str) -> None:
+        self.file.close()
+        path = self.store.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Переименование атомарно: читатели видят либо весь файл, либо ничего
+        os.replace(self.tmp_path, path)
+
+    def abort(self) -> None:
+        if not self.file.closed:
+            self.file.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+class LocalObjectStore:
+    '''Хранилище объектов в локальной файловой системе для работы без облака'''
+
+    def __init__(self, root: str) -> None:
+        self.root = root
+        self.staging_dir = os.path.join(root, '.staging')
+        os.makedirs(self.staging_dir, exist_ok=True)
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.root, *key.split('/'))
+
+    def writer(self) -> LocalObjectWriter:
+        return LocalObjectWriter(self)
+
+    def exists(self, key: str) -> bool:
+        return os.path.exists(self.path(key))
+
+    def size(self, key: str) -> int:
+        return os.path.getsize(self.path(key))
+
+    def open(self, key: str):
+        return open(self.path(key), 'rb')
+
+# Другие хранилища (S3-совместимые и т.п.) подключаются сюда с тем же
+# интерфейсом: writer(), exists(), size(), open()
+OBJECT_STORES = {
+    'local': lambda: LocalObjectStore(ATTACHMENTS_DIR),
+}
+
+_store = None
+_thumbnail_pool = None
+
+def get_object_store():
+    '''Хранилище вложений, создаётся один раз на экземпляр функции'''
+    global _store
+    if _store is None:
+        _store = OBJECT_STORES[ATTACHMENTS_STORE]()
+    return _store
+
+def get_thumbnail_pool():
+    '''Пул потоков для миниатюр; concurrent.futures грузится только при загрузке изображения'''
+    global _thumbnail_pool
+    if _thumbnail_pool is None:
+        from concurrent.futures import ThreadPoolExecutor
+        _thumbnail_pool = ThreadPoolExecutor(max_workers=THUMBNAIL_WORKERS, thread_name_prefix='thumbnail')
+    return _thumbnail_pool
+
+def object_key(content_hash: str) -> str:
+    return f'objects/{content_hash[:2]}/{content_hash}'
+
+def thumbnail_key(content_hash: str) -> str:
+    return f'thumbnails/{content_hash[:2]}/{content_hash}'
+
+def detect_image_type(head: bytes) -> Optional[str]:
+    '''MIME-тип изображения по сигнатуре первых байтов; заголовку клиента не доверяем'''
+    for signature, mime_type in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return mime_type
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp'
+    return None
+
+def strip_base64_whitespace(body: str) -> str:
+    '''Убирает переносы строк и пробелы из base64; тело без них не копируется'''
+    if not BASE64_WHITESPACE.search(body):
+        return body
+    return BASE64_WHITESPACE.sub('', body)
+
+def decoded_size(body: str, is_base64: bool) -> int:
+    '''Размер файла без декодирования тела'''
+    if not is_base64:
+        return len(body.encode('utf-8'))
+    return len(body) * 3 // 4 - body[-2:].count('=')
+
+def iter_body_chunks(body: str, is_base64: bool):
+    '''Отдаёт тело запроса кусками, не создавая копию всего файла'''
+    if not is_base64:
+        for start in range(0, len(body), UPLOAD_CHUNK_BYTES):
+            yield body[start:start + UPLOAD_CHUNK_BYTES].encode('utf-8')
+        return
+    # 4 символа base64 = 3 байта, поэтому границы кусков кратны 4
+    step = UPLOAD_CHUNK_BYTES // 3 * 4
+    for start in range(0, len(body), step):
+        yield base64.b64decode(body[start:start + step])
+
+def make_thumbnail(store, content_hash: str) -> bool:
+    '''Сохраняет JPEG-миниатюру изображения; False, если Pillow нет или файл не читается'''
+    key = thumbnail_key(content_hash)
+    if store.exists(key):
+        return True
+    try:
+        from PIL import Image
+    except ImportError:
+        return False
+
+    Image.MAX_IMAGE_PIXELS = THUMBNAIL_MAX_PIXELS
+    writer = store.writer()
+    try:
+        with store.open(object_key(content_hash)) as source:
+            image = Image.open(source)
+            image.draft('RGB', (THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+            image.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+            if image.mode not in ('RGB', 'L'):
+                image = image.convert('RGB')
+            buffer = io.BytesIO()
+            image.save(buffer, format='JPEG', quality=80)
+        writer.write(buffer.getvalue())
+        writer.commit(key)
+        return True
+    except Exception:
+        writer.abort()
+        return False
+
+def content_disposition(filename: str) -> str:
+    '''Заголовок скачивания: ASCII-имя для старых клиентов и UTF-8 имя в filename*'''
+    filename = FILENAME_UNSAFE.sub('', filename).strip() or 'attachment'
+    ascii_name = filename.encode('ascii', 'replace').decode('ascii').replace('?', '_')
+    return f"attachment; filename=\"{ascii_name}\"; filename*=UTF-8''{quote(filename, safe='')}"
+
+def parse_range(range_header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    '''Диапазон байтов из заголовка Range; None - весь файл, ValueError - 416'''
+    if not range_header:
+        return None
+    match = RANGE_PATTERN.match(range_header.strip())
+    if not match or not (match.group(1) or match.group(2)):
+        # Несколько диапазонов не поддерживаются - отдаём файл целиком
+        return None
+    first, last = match.groups()
+    if not first:
+        length = int(last)
+        if length == 0:
+            raise ValueError('Empty suffix range')
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or end < start:
+        raise ValueError('Range not satisfiable')
+    return start, end
+
+def upload_attachment(cur, conn, event: Dict[str, Any], user_id: str) -> Dict[str, Any]:
+    '''Потоково пишет файл в хранилище, считая хэш, и регистрирует его в БД'''
+    headers = event.get('headers') or {}
+    body = event.get('body') or ''
+    is_base64 = bool(event.get('isBase64Encoded'))
+    if is_base64:
+        # Размер и границы кусков считаются по символам base64 без переносов строк
+        body = strip_base64_whitespace(body)
+
+    size = decoded_size(body, is_base64)
+    if size == 0:
+        return {
+            'statusCode': 400,
+            'headers': {'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Empty file'})
+        }
+    if size > ATTACHMENT_MAX_BYTES:
+        return {
+            'statusCode': 413,
+            'headers': {'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': f'File too large (max {ATTACHMENT_MAX_BYTES} bytes)'})
+        }
+
+    store = get_object_store()
+    writer = store.writer()
+    digest = hashlib.sha256()
+    head = b''
+    written = 0
+    try:
+        for chunk in iter_body_chunks(body, is_base64):
+            if not head:
+                head = chunk[:16]
+            digest.update(chunk)
+            writer.write(chunk)
+            written += len(chunk)
+        content_hash = digest.hexdigest()
+
+        image_type = detect_image_type(head)
+        mime_type = image_type or 'application/octet-stream'
+        original_name = (headers.get('X-File-Name') or '')[:255] or None
+
+        cur.execute("""
+            INSERT INTO t_p7304060_coldfire_authenticat.attachments
+            (content_hash, size_bytes, mime_type, original_name, uploaded_by)
+            VALUES (%s, %s, %s, %s, %s)
+            ON CONFLICT (content_hash) DO UPDATE
+            SET upload_count = attachments.upload_count + 1
+            RETURNING (xmax = 0)
+        """, (content_hash, written, mime_type, original_name, user_id))
+        created = cur.fetchone()[0]
+
+        # Объект попадает в хранилище до фиксации строки, поэтому строка
+        # никогда не ссылается на отсутствующий файл
+        key = object_key(content_hash)
+        if store.exists(key):
+            writer.abort()
+        else:
+            writer.commit(key)
+        conn.commit()
+    except Exception:
+        writer.abort()
+        raise
+
+    thumbnail = False
+    if image_type:
+        from concurrent.futures import TimeoutError as FutureTimeoutError
+        future = get_thumbnail_pool().submit(make_thumbnail, store, content_hash)
+        try:
+            thumbnail = future.result(timeout=THUMBNAIL_WAIT_SECONDS)
+        except FutureTimeoutError:
+            # Миниатюра достроится в фоне; до тех пор отдаётся оригинал
+            pass
+
+    return {
+        'statusCode': 201,
+        'headers': {'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({
+            'success': True,
+            'attachment': {
+                'hash': content_hash,
+                'url': f'{ATTACHMENTS_PUBLIC_URL}?hash={content_hash}',
+                'size': written,
+                'mime_type': mime_type,
+                'message_type': 'image' if image_type else 'file',
+                'deduplicated': not created,
+                'thumbnail': thumbnail
+            }
+        })
+    }
+
+def serve_attachment(cur, event: Dict[str, Any], query_params: Dict[str, Any]) -> Dict[str, Any]:
+    '''Отдаёт вложение или его миниатюру, поддерживая заголовок Range'''
+    content_hash = (query_params.get('hash') or '').lower()
+    if not HASH_PATTERN.match(content_hash):
+        return {
+            'statusCode': 400,
+            'headers': {'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Attachment hash required'})
+        }
+
+    cur.execute("""
+        SELECT mime_type, original_name
+        FROM t_p7304060_coldfire_authenticat.attachments
+        WHERE content_hash = %s
+    """, (content_hash,))
+    row = cur.fetchone()
+    store = get_object_store()
+    key = object_key(content_hash)
+    if not row or not store.exists(key):
+        return {
+            'statusCode': 404,
+            'headers': {'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Attachment not found'})
+        }
+    mime_type, original_name = row
+
+    etag = f'"{content_hash}"'
+    if query_params.get('thumb') == '1' and store.exists(thumbnail_key(content_hash)):
+        key = thumbnail_key(content_hash)
+        mime_type = 'image/jpeg'
+        etag = f'"{content_hash}-thumb"'
+
+    # Содержимое по хэшу не меняется, поэтому кэшируется навсегда
+    response_headers = {
+        'Access-Control-Allow-Origin': '*',
+        'Access-Control-Expose-Headers': 'Content-Range, Accept-Ranges, ETag',
+        'Content-Type': mime_type,
+        'Accept-Ranges': 'bytes',
+        'ETag': etag,
+        'Cache-Control': 'public, max-age=31536000, immutable'
+    }
+    if not mime_type.startswith('image/'):
+        # Файлы не открываются в браузере как страница сайта
+        response_headers['Content-Disposition'] = content_disposition(original_name or content_hash)
+
+    request_headers = event.get('headers') or {}
+    if request_headers.get('If-None-Match') == etag:
+        return {'statusCode': 304, 'headers': response_headers, 'body': ''}
+
+    size = store.size(key)
+    try:
+        byte_range = parse_range(request_headers.get('Range'), size)
+    except ValueError:
+        return {
+            'statusCode': 416,
+            'headers': {**response_headers, 'Content-Range': f'bytes */{size}'},
+            'body': ''
+        }
+
+    start, end = byte_range if byte_range else (0, size - 1)
+    with store.open(key) as f:
+        f.seek(start)
+        data = f.read(end - start + 1)
+
+    if byte_range:
+        response_headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+    return {
+        'statusCode': 206 if byte_range else 200,
+        'headers': response_headers,
+        'isBase64Encoded': True,
+        'body': base64.b64encode(data).decode('ascii')
+    }
+
+@resilient
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    '''
+    Business: Загрузка вложений к сообщениям с дедупликацией по хэшу и их выдача с поддержкой Range
+    Args: event с httpMethod; POST - тело файла (X-User-Id, X-File-Name), GET - queryStringParameters hash, thumb
+          context - объект с request_id, function_name
+    Returns: HTTP response с описанием загруженного вложения или содержимым файла
+    '''
+    method: str = event.get('httpMethod', 'GET')
+    
+    # Handle CORS OPTIONS request
+    if method == 'OPTIONS':
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Auth-Token, X-File-Name, Range, If-None-Match',
+                'Access-Control-Max-Age': '86400'
+            },
+            'body': ''
+        }
+    
+    try:
+        DATABASE_URL = os.environ.get('DATABASE_URL')
+        if not DATABASE_URL:
+            return {
+                'statusCode': 500,
+                'headers': {'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': 'Database connection error'})
+            }
+        
+        headers = event.get('headers') or {}
+        query_params = event.get('queryStringParameters') or {}
+        
+        if method == 'GET':
+            conn = get_connection(DATABASE_URL)
+            cur = conn.cursor()
+            return serve_attachment(cur, event, query_params)
+        
+        elif method == 'POST':
+            user_id = headers.get('X-User-Id')
+            if not user_id:
+                return {
+                    'statusCode': 401,
+                    'headers': {'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': 'User ID required'})
+                }
+            
+            conn = get_connection(DATABASE_URL)
+            cur = conn.cursor()
+            return upload_attachment(cur, conn, event, user_id)
+        
+        else:
+            return {
+                'statusCode': 405,
+                'headers': {'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': 'Method not allowed'})
+            }
+            
+    except binascii.Error:
+        return {
+            'statusCode': 400,
+            'headers': {'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Invalid file encoding'})
+        }
+    except Exception as e:
+        record_db_failure(e)
+        return {
+            'statusCode': 500,
+            'headers': {'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': f'Server error: {str(e)}'})
+        }
+    finally:
+        if 'conn' in locals():
+            release_connection(conn)
@@ -1,14 +1,335 @@
 import json
 import os
+import threading
+import time
 import random
 import string
 import hashlib
-import base64
 from datetime import datetime, timedelta
-from typing import Dict, Any
-import psycopg2
-from psycopg2.extras import RealDictCursor
+from typing import Dict, Any, Tuple
 
+# Простые ASCII символы для каждой буквы/цифры, строятся один раз при загрузке модуля
+ASCII_PATTERNS = {
+    'A': ['  █  ', ' █ █ ', '█████', '█   █', '█   █'],
+    'B': ['████ ', '█   █', '████ ', '█   █', '████ '],
+    'C': [' ████', '█    ', '█    ', '█    ', ' ████'],
+    'D': ['████ ', '█   █', '█   █', '█   █', '████ '],
+    'E': ['█████', '█    ', '███  ', '█    ', '█████'],
+    'F': ['█████', '█    ', '███  ', '█    ', '█    '],
+    'G': [' ████', '█    ', '█ ███', '█   █', ' ████'],
+    'H': ['█   █', '█   █', '█████', '█   █', '█   █'],
+    'I': ['█████', '  █  ', '  █  ', '  █  ', '█████'],
+    'J': ['█████', '    █', '    █', '█   █', ' ████'],
+    'K': ['█   █', '█  █ ', '███  ', '█  █ ', '█   █'],
+    'L': ['█    ', '█    ', '█    ', '█    ', '█████'],
+    'M': ['█   █', '██ ██', '█ █ █', '█   █', '█   █'],
+    'N': ['█   █', '██  █', '█ █ █', '█  ██', '█   █'],
+    'O': [' ███ ', '█   █', '█   █', '█   █', ' ███ '],
+    'P': ['████ ', '█   █', '████ ', '█    ', '█    '],
+    'Q': [' ███ ', '█   █', '█ █ █', '█  ██', ' ████'],
+    'R': ['████ ', '█   █', '████ ', '█  █ ', '█   █'],
+    'S': [' ████', '█    ', ' ███ ', '    █', '████ '],
+    'T': ['█████', '  █  ', '  █  ', '  █  ', '  █  '],
+    'U': ['█   █', '█   █', '█   █', '█   █', ' ███ '],
+    'V': ['█   █', '█   █', '█   █', ' █ █ ', '  █  '],
+    'W': ['█   █', '█   █', '█ █ █', '██ ██', '█   █'],
+    'X': ['█   █', ' █ █ ', '  █  ', ' █ █ ', '█   █'],
+    'Y': ['█   █', ' █ █ ', '  █  ', '  █  ', '  █  '],
+    'Z': ['█████', '   █ ', '  █  ', ' █   ', '█████'],
+    '0': [' ███ ', '█   █', '█   █', '█   █', ' ███ '],
+    '1': ['  █  ', ' ██  ', '  █  ', '  █  ', '█████'],
+    '2': [' ███ ', '█   █', '  ██ ', ' █   ', '█████'],
+    '3': [' ███ ', '█   █', '  ██ ', '█   █', ' ███ '],
+    '4': ['█   █', '█   █', '█████', '    █', '    █'],
+    '5': ['█████', '█    ', '████ ', '    █', '████ '],
+    '6': [' ███ ', '█    ', '████ ', '█   █', ' ███ '],
+    '7': ['█████', '    █', '   █ ', '  █  ', ' █   '],
+    '8': [' ███ ', '█   █', ' ███ ', '█   █', ' ███ '],
+    '9': [' ███ ', '█   █', ' ████', '    █', ' ███ ']
+}
+
+# >>> shared/db_connection.py (копия, правится в shared/ и переносится scripts/sync_shared_blocks.py)
+# Соединения живут в модуле и переиспользуются тёплыми вызовами функции.
+# psycopg2 импортируется только при первом запросе, которому нужна БД,
+# поэтому CORS preflight и холодный старт не платят за загрузку драйвера.
+_conn = None
+
+# Чтения без требований к свежести функция берёт через get_read_connection:
+# они уходят на реплику (REPLICA_DATABASE_URL), пока её отставание не
+# превышает REPLICA_MAX_LAG_SECONDS. Отставание проверяется не чаще раза в
+# REPLICA_LAG_CHECK_INTERVAL секунд.
+REPLICA_MAX_LAG_SECONDS = float(os.environ.get('REPLICA_MAX_LAG_SECONDS', '5'))
+REPLICA_LAG_CHECK_INTERVAL = 2.0
+_replica_conn = None
+_replica_checked_at = 0.0
+_replica_usable = False
+
+def get_connection(database_url: str):
+    '''Возвращает открытое соединение с основной БД, подключаясь только при необходимости'''
+    global _conn
+    if _conn is None or _conn.closed:
+        import psycopg2
+        _conn = psycopg2.connect(database_url, connect_timeout=3,
+                                 options=f'-c statement_timeout={STATEMENT_TIMEOUT_MS}',
+                                 connection_factory=tracked_connection_class())
+        note_db_success()
+    apply_statement_timeout(_conn)
+    return _conn
+
+def get_read_connection(database_url: str):
+    '''Возвращает соединение для чтения: реплику, если она успевает за основной БД'''
+    global _replica_conn, _replica_checked_at, _replica_usable
+    replica_url = os.environ.get('REPLICA_DATABASE_URL')
+    if not replica_url:
+        return get_connection(database_url)
+    
+    now = time.monotonic()
+    if now - _replica_checked_at >= REPLICA_LAG_CHECK_INTERVAL:
+        _replica_checked_at = now
+        try:
+            if _replica_conn is None or _replica_conn.closed:
+                import psycopg2
+                _replica_conn = psycopg2.connect(replica_url, connect_timeout=2,
+                                                 options=f'-c statement_timeout={STATEMENT_TIMEOUT_MS}',
+                                                 connection_factory=tracked_connection_class())
+            cur = _replica_conn.cursor()
+            # Простаивающая основная БД не двигает replay timestamp, поэтому
+            # полностью проигранный WAL считается нулевым отставанием
+            cur.execute("""
+                SELECT CASE
+                    WHEN NOT pg_is_in_recovery() THEN 0
+                    WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                    ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+                END
+            """)
+            lag = float(cur.fetchone()[0])
+            _replica_conn.rollback()
+            _replica_usable = lag <= REPLICA_MAX_LAG_SECONDS
+        except Exception:
+            _replica_usable = False
+            if _replica_conn is not None:
+                _replica_conn.close()
+                _replica_conn = None
+    
+    if _replica_usable and _replica_conn is not None:
+        apply_statement_timeout(_replica_conn)
+        return _replica_conn
+    return get_connection(database_url)
+
+def release_connection(conn) -> None:
+    '''Завершает транзакцию запроса, оставляя соединение открытым для следующего вызова'''
+    global _conn, _replica_conn
+    try:
+        import psycopg2.extensions
+        in_transaction = conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE
+        conn.rollback()
+        if in_transaction:
+            note_db_success()
+    except Exception:
+        conn.close()
+        if conn is _conn:
+            _conn = None
+        if conn is _replica_conn:
+            _replica_conn = None
+# <<< shared/db_connection.py
+
+# Пределы по умолчанию для эндпоинтов, не указанных в ENDPOINT_BUDGETS
+STATEMENT_TIMEOUT_MS = int(os.environ.get('STATEMENT_TIMEOUT_MS', '2000'))
+MAX_CONCURRENT_REQUESTS = int(os.environ.get('MAX_CONCURRENT_REQUESTS', '10'))
+
+# Бюджеты эндпоинтов: (statement_timeout в мс, одновременных запросов на
+# экземпляр). Выдача и проверка капчи ограничены раздельно.
+ENDPOINT_BUDGETS: Dict[str, Tuple[int, int]] = {
+    'create': (STATEMENT_TIMEOUT_MS, MAX_CONCURRENT_REQUESTS),
+    'verify': (STATEMENT_TIMEOUT_MS, MAX_CONCURRENT_REQUESTS),
+}
+
+def endpoint_of(event: Dict[str, Any]) -> str:
+    '''Эндпоинт запроса для выбора бюджета'''
+    return 'create' if event.get('httpMethod') == 'GET' else 'verify'
+
+# >>> shared/db_resilience.py (копия, правится в shared/ и переносится scripts/sync_shared_blocks.py)
+# Устойчивость к деградации БД. У каждого эндпоинта функции свой бюджет из
+# ENDPOINT_BUDGETS (функция определяет его вместе с endpoint_of):
+# statement_timeout его SQL-запросов и число одновременных запросов на
+# экземпляр. Запросы сверх предела эндпоинта отклоняются с 503 и
+# Retry-After; после BREAKER_FAILURE_THRESHOLD подряд сбоев соединения или
+# запроса автомат отключения отвечает 503 без обращения к БД и через
+# BREAKER_RESET_SECONDS пропускает один пробный запрос.
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get('BREAKER_FAILURE_THRESHOLD', '5'))
+BREAKER_RESET_SECONDS = float(os.environ.get('BREAKER_RESET_SECONDS', '10'))
+
+class CircuitBreaker:
+    '''Автомат отключения: closed -> open после серии сбоев -> half_open для пробы'''
+
+    def __init__(self, threshold: int, reset_seconds: float) -> None:
+        self.threshold = threshold
+        self.reset_seconds = reset_seconds
+        self.state = 'closed'
+        self.consecutive_failures = 0
+        self.failures_total = 0
+        self.opened_at = 0.0
+        self.trips = 0
+        self.lock = threading.Lock()
+
+    def allow(self) -> bool:
+        '''Разрешает запрос; в half_open пропускает только одну пробу'''
+        with self.lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and time.monotonic() - self.opened_at >= self.reset_seconds:
+                self.state = 'half_open'
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self.lock:
+            self.state = 'closed'
+            self.consecutive_failures = 0
+
+    def release_probe(self) -> None:
+        '''Возвращает в open пробу, не дошедшую до БД: следующий запрос пробует снова'''
+        with self.lock:
+            if self.state == 'half_open':
+                self.state = 'open'
+                self.opened_at = time.monotonic() - self.reset_seconds
+
+    def record_failure(self) -> None:
+        with self.lock:
+            self.failures_total += 1
+            self.consecutive_failures += 1
+            if self.state == 'half_open' or self.consecutive_failures >= self.threshold:
+                if self.state != 'open':
+                    self.trips += 1
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+
+    def retry_after(self) -> int:
+        return max(1, int(self.reset_seconds - (time.monotonic() - self.opened_at)) + 1)
+
+_breaker = CircuitBreaker(BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_SECONDS)
+_in_flight: Dict[str, threading.BoundedSemaphore] = {}
+_in_flight_lock = threading.Lock()
+_resilience_metrics = {'shed': 0, 'breaker_rejected': 0}
+_shed_by_endpoint: Dict[str, int] = {}
+# Дополнительные счётчики функции для ответа ?metrics=1
+_metrics_sources: Dict[str, Any] = {}
+
+# Исход текущего запроса для автомата: успехом считается только реальный
+# обмен с БД (подключение, COMMIT, откат начатой транзакции), а не ответ
+# из кэша или отказ в валидации до первого запроса
+_request_state = threading.local()
+
+def note_db_success() -> None:
+    '''Отмечает, что запрос успешно обменялся данными с БД'''
+    _request_state.db_ok = True
+
+_tracked_connection_class = None
+
+def tracked_connection_class():
+    '''Класс соединения psycopg2, который отмечает успешный COMMIT'''
+    global _tracked_connection_class
+    if _tracked_connection_class is None:
+        import psycopg2.extensions
+
+        class TrackedConnection(psycopg2.extensions.connection):
+            def commit(self) -> None:
+                super().commit()
+                note_db_success()
+
+        _tracked_connection_class = TrackedConnection
+    return _tracked_connection_class
+
+def endpoint_budget(endpoint: str) -> Tuple[int, int]:
+    '''(statement_timeout в мс, одновременных запросов) для эндпоинта'''
+    return ENDPOINT_BUDGETS.get(endpoint, (STATEMENT_TIMEOUT_MS, MAX_CONCURRENT_REQUESTS))
+
+def endpoint_semaphore(endpoint: str) -> threading.BoundedSemaphore:
+    '''Семафор параллельности эндпоинта, создаётся при первом запросе'''
+    with _in_flight_lock:
+        if endpoint not in _in_flight:
+            _in_flight[endpoint] = threading.BoundedSemaphore(endpoint_budget(endpoint)[1])
+        return _in_flight[endpoint]
+
+def apply_statement_timeout(conn) -> None:
+    '''Переключает statement_timeout сессии на бюджет эндпоинта текущего запроса'''
+    import psycopg2.extensions
+    timeout_ms = endpoint_budget(getattr(_request_state, 'endpoint', ''))[0]
+    if getattr(conn, 'statement_timeout_ms', STATEMENT_TIMEOUT_MS) == timeout_ms:
+        return
+    if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+        return
+    # SET вне транзакции запроса: COMMIT сохраняет значение в сессии, и
+    # запросы того же эндпоинта на тёплом соединении его не повторяют
+    cur = conn.cursor()
+    cur.execute('SET statement_timeout = %s', (timeout_ms,))
+    cur.close()
+    conn.commit()
+    conn.statement_timeout_ms = timeout_ms
+
+def unavailable(retry_after: int, reason: str) -> Dict[str, Any]:
+    '''Ответ 503 с подсказкой, когда повторить запрос'''
+    return {
+        'statusCode': 503,
+        'headers': {'Access-Control-Allow-Origin': '*', 'Retry-After': str(retry_after)},
+        'body': json.dumps({'error': reason})
+    }
+
+def record_db_failure(error: Exception) -> None:
+    '''Учитывает в автомате отключения сбои соединения и таймауты запросов'''
+    import psycopg2
+    if isinstance(error, (psycopg2.OperationalError, psycopg2.InterfaceError)):
+        _request_state.db_failed = True
+        _breaker.record_failure()
+
+def resilient(handler_func):
+    '''Оборачивает handler ограничением параллельности и автоматом отключения'''
+    def wrapper(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+        if event.get('httpMethod') == 'OPTIONS':
+            return handler_func(event, context)
+        
+        # Счётчики сброса нагрузки и срабатываний автомата: ?metrics=1
+        if (event.get('queryStringParameters') or {}).get('metrics') == '1':
+            return {
+                'statusCode': 200,
+                'headers': {'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({
+                    'shed': _resilience_metrics['shed'],
+                    'shed_by_endpoint': _shed_by_endpoint,
+                    'breaker_rejected': _resilience_metrics['breaker_rejected'],
+                    'breaker_trips': _breaker.trips,
+                    'breaker_state': _breaker.state,
+                    'db_failures': _breaker.failures_total,
+                    **_metrics_sources
+                })
+            }
+        
+        endpoint = endpoint_of(event)
+        in_flight = endpoint_semaphore(endpoint)
+        if not in_flight.acquire(blocking=False):
+            _resilience_metrics['shed'] += 1
+            _shed_by_endpoint[endpoint] = _shed_by_endpoint.get(endpoint, 0) + 1
+            return unavailable(1, 'Too many concurrent requests')
+        if not _breaker.allow():
+            in_flight.release()
+            _resilience_metrics['breaker_rejected'] += 1
+            return unavailable(_breaker.retry_after(), 'Database temporarily unavailable')
+        
+        _request_state.endpoint = endpoint
+        _request_state.db_ok = False
+        _request_state.db_failed = False
+        try:
+            return handler_func(event, context)
+        finally:
+            in_flight.release()
+            if _request_state.db_ok and not _request_state.db_failed:
+                _breaker.record_success()
+            elif not _request_state.db_failed:
+                _breaker.release_probe()
+    return wrapper
+# <<< shared/db_resilience.py
+
+@resilient
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
     Business: Генерирует и проверяет капчи для регистрации
@@ -41,7 +362,8 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         }
     
     try:
-        conn = psycopg2.connect(database_url)
+        conn = get_connection(database_url)
+        from psycopg2.extras import RealDictCursor
         cur = conn.cursor(cursor_factory=RealDictCursor)
         
         if method == 'GET':
@@ -62,6 +384,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             }
     
     except Exception as e:
+        record_db_failure(e)
         return {
             'statusCode': 500,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -69,7 +392,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         }
     finally:
         if 'conn' in locals():
-            conn.close()
+            release_connection(conn)
 
 def generate_captcha(cur, conn) -> Dict[str, Any]:
     """Генерирует новую капчу"""
@@ -173,51 +496,11 @@ def verify_captcha(cur, conn, data: Dict[str, Any]) -> Dict[str, Any]:
 
 def generate_ascii_captcha(text: str) -> str:
     """Генерирует простую ASCII-арт капчу"""
-    # Простые ASCII символы для каждой буквы/цифры
-    ascii_patterns = {
-        'A': ['  █  ', ' █ █ ', '█████', '█   █', '█   █'],
-        'B': ['████ ', '█   █', '████ ', '█   █', '████ '],
-        'C': [' ████', '█    ', '█    ', '█    ', ' ████'],
-        'D': ['████ ', '█   █', '█   █', '█   █', '████ '],
-        'E': ['█████', '█    ', '███  ', '█    ', '█████'],
-        'F': ['█████', '█    ', '███  ', '█    ', '█    '],
-        'G': [' ████', '█    ', '█ ███', '█   █', ' ████'],
-        'H': ['█   █', '█   █', '█████', '█   █', '█   █'],
-        'I': ['█████', '  █  ', '  █  ', '  █  ', '█████'],
-        'J': ['█████', '    █', '    █', '█   █', ' ████'],
-        'K': ['█   █', '█  █ ', '███  ', '█  █ ', '█   █'],
-        'L': ['█    ', '█    ', '█    ', '█    ', '█████'],
-        'M': ['█   █', '██ ██', '█ █ █', '█   █', '█   █'],
-        'N': ['█   █', '██  █', '█ █ █', '█  ██', '█   █'],
-        'O': [' ███ ', '█   █', '█   █', '█   █', ' ███ '],
-        'P': ['████ ', '█   █', '████ ', '█    ', '█    '],
-        'Q': [' ███ ', '█   █', '█ █ █', '█  ██', ' ████'],
-        'R': ['████ ', '█   █', '████ ', '█  █ ', '█   █'],
-        'S': [' ████', '█    ', ' ███ ', '    █', '████ '],
-        'T': ['█████', '  █  ', '  █  ', '  █  ', '  █  '],
-        'U': ['█   █', '█   █', '█   █', '█   █', ' ███ '],
-        'V': ['█   █', '█   █', '█   █', ' █ █ ', '  █  '],
-        'W': ['█   █', '█   █', '█ █ █', '██ ██', '█   █'],
-        'X': ['█   █', ' █ █ ', '  █  ', ' █ █ ', '█   █'],
-        'Y': ['█   █', ' █ █ ', '  █  ', '  █  ', '  █  '],
-        'Z': ['█████', '   █ ', '  █  ', ' █   ', '█████'],
-        '0': [' ███ ', '█   █', '█   █', '█   █', ' ███ '],
-        '1': ['  █  ', ' ██  ', '  █  ', '  █  ', '█████'],
-        '2': [' ███ ', '█   █', '  ██ ', ' █   ', '█████'],
-        '3': [' ███ ', '█   █', '  ██ ', '█   █', ' ███ '],
-        '4': ['█   █', '█   █', '█████', '    █', '    █'],
-        '5': ['█████', '█    ', '████ ', '    █', '████ '],
-        '6': [' ███ ', '█    ', '████ ', '█   █', ' ███ '],
-        '7': ['█████', '    █', '   █ ', '  █  ', ' █   '],
-        '8': [' ███ ', '█   █', ' ███ ', '█   █', ' ███ '],
-        '9': [' ███ ', '█   █', ' ████', '    █', ' ███ ']
-    }
-    
     # Создаем многострочный ASCII-арт
     lines = ['', '', '', '', '']
     for char in text:
-        if char in ascii_patterns:
-            for i, line in enumerate(ascii_patterns[char]):
+        if char in ASCII_PATTERNS:
+            for i, line in enumerate(ASCII_PATTERNS[char]):
                 lines[i] += line + ' '
     
     return '\n'.join(lines)
\ No newline at end of file
@@ -0,0 +1,539 @@
+import heapq
+import json
+import os
+import time
+from typing import Dict, Any, List, Optional, Tuple
+
+# Партиции messages создаются на столько месяцев вперёд
+PARTITIONS_AHEAD_MONTHS = int(os.environ.get('MESSAGES_PARTITIONS_AHEAD', '2'))
+# Пустые партиции старше этого числа месяцев удаляются
+PARTITIONS_KEEP_MONTHS = int(os.environ.get('MESSAGES_PARTITIONS_KEEP_MONTHS', '12'))
+# История заявок, закрытых дольше этого срока, уходит в messages_archive
+ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', '30'))
+ARCHIVE_BATCH_SIZE = int(os.environ.get('ARCHIVE_BATCH_SIZE', '100'))
+ARCHIVE_MAX_BATCHES = int(os.environ.get('ARCHIVE_MAX_BATCHES', '20'))
+# Срок хранения ответов для Idempotency-Key (должен совпадать с tickets/messages)
+IDEMPOTENCY_TTL_HOURS = int(os.environ.get('IDEMPOTENCY_TTL_HOURS', '24'))
+PURGE_BATCH_SIZE = 5000
+# Автоматическое назначение: модератор считается в сети, если входил или
+# работал с заявками в последние MODERATOR_ONLINE_MINUTES минут. Нагрузка -
+# сумма весов приоритетов его открытых заявок, не больше MODERATOR_MAX_LOAD.
+MODERATOR_ONLINE_MINUTES = int(os.environ.get('MODERATOR_ONLINE_MINUTES', '30'))
+MODERATOR_MAX_LOAD = int(os.environ.get('MODERATOR_MAX_LOAD', '20'))
+ASSIGN_BATCH_SIZE = int(os.environ.get('ASSIGN_BATCH_SIZE', '50'))
+ASSIGN_MAX_BATCHES = int(os.environ.get('ASSIGN_MAX_BATCHES', '20'))
+# Сколько наименее загруженных модераторов сравнивается по экспертизе
+ASSIGN_CANDIDATES = 3
+PRIORITY_WEIGHTS = {'low': 1, 'medium': 2, 'high': 3, 'urgent': 5}
+# Автозакрытие: часы без активности по статусу и приоритету заявки.
+# Переопределяется JSON в AUTO_CLOSE_THRESHOLDS, например {"open": {"low": 72}}.
+AUTO_CLOSE_THRESHOLDS = {
+    'open': {'low': 336, 'medium': 336, 'high': 504, 'urgent': 720},
+    'in_progress': {'low': 168, 'medium': 168, 'high': 336, 'urgent': 504},
+}
+for _status, _overrides in json.loads(os.environ.get('AUTO_CLOSE_THRESHOLDS') or '{}').items():
+    AUTO_CLOSE_THRESHOLDS.setdefault(_status, {}).update(_overrides)
+AUTO_CLOSE_BATCH_SIZE = int(os.environ.get('AUTO_CLOSE_BATCH_SIZE', '100'))
+AUTO_CLOSE_MAX_BATCHES = int(os.environ.get('AUTO_CLOSE_MAX_BATCHES', '10'))
+# Пауза между пачками, чтобы задача не вытесняла запросы пользователей
+AUTO_CLOSE_PAUSE_SECONDS = float(os.environ.get('AUTO_CLOSE_PAUSE_SECONDS', '0.2'))
+
+# Соединение живёт в модуле и переиспользуется тёплыми вызовами функции.
+# psycopg2 импортируется только при первом запросе, которому нужна БД,
+# поэтому CORS preflight и холодный старт не платят за загрузку драйвера.
+_conn = None
+
+def get_connection(database_url: str):
+    '''Возвращает открытое соединение с БД, подключаясь только при необходимости'''
+    global _conn
+    if _conn is None or _conn.closed:
+        import psycopg2
+        _conn = psycopg2.connect(database_url)
+    return _conn
+
+def release_connection(conn) -> None:
+    '''Завершает транзакцию запроса, оставляя соединение открытым для следующего вызова'''
+    global _conn
+    try:
+        conn.rollback()
+    except Exception:
+        conn.close()
+        _conn = None
+
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    '''
+    Business: Фоновые задачи обслуживания БД - партиции сообщений, архивация, дневные агрегаты, назначение и автозакрытие заявок
+    Args: event с httpMethod POST и body {"job": "<имя задачи>"}, вызывается по таймеру
+          context - объект с request_id, function_name
+    Returns: HTTP response с результатом выполнения задачи
+    '''
+    method: str = event.get('httpMethod', 'POST')
+
+    # Handle CORS OPTIONS request
+    if method == 'OPTIONS':
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Allow-Methods': 'POST, OPTIONS',
+                'Access-Control-Allow-Headers': 'Content-Type, X-Maintenance-Token',
+                'Access-Control-Max-Age': '86400'
+            },
+            'body': ''
+        }
+
+    if method != 'POST':
+        return {
+            'statusCode': 405,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Method not allowed'})
+        }
+
+    # Если задан MAINTENANCE_TOKEN, задачи запускаются только с ним
+    expected_token = os.environ.get('MAINTENANCE_TOKEN')
+    headers = event.get('headers') or {}
+    if expected_token and headers.get('X-Maintenance-Token') != expected_token:
+        return {
+            'statusCode': 401,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Invalid maintenance token'})
+        }
+
+    database_url = os.environ.get('DATABASE_URL')
+    if not database_url:
+        return {
+            'statusCode': 500,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Database connection not configured'})
+        }
+
+    try:
+        body_str = event.get('body') or '{}'
+        body_data = json.loads(body_str)
+        job = body_data.get('job')
+
+        jobs = {
+            'partitions': maintain_partitions,
+            'archive': archive_closed_tickets,
+            'rollups': refresh_daily_rollups,
+            'idempotency': purge_idempotency_keys,
+            'assign': assign_tickets,
+            'auto_close': auto_close_stale_tickets,
+        }
+        if job not in jobs:
+            return {
+                'statusCode': 400,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': 'Unknown job', 'jobs': sorted(jobs)})
+            }
+
+        conn = get_connection(database_url)
+        cur = conn.cursor()
+        result = jobs[job](cur, conn, body_data)
+
+        return {
+            'statusCode': 200,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'job': job, **result})
+        }
+
+    except json.JSONDecodeError:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Invalid JSON format'})
+        }
+    except Exception as e:
+        return {
+            'statusCode': 500,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': f'Server error: {str(e)}'})
+        }
+    finally:
+        if 'conn' in locals():
+            release_connection(conn)
+
+def bump_ticket_list_versions(cur, ticket_ids) -> None:
+    """Сбрасывает кэш списков заявок у владельцев изменённых заявок"""
+    cur.execute("""
+        INSERT INTO t_p7304060_coldfire_authenticat.ticket_list_versions (user_id, version)
+        SELECT DISTINCT user_id, 1
+        FROM t_p7304060_coldfire_authenticat.support_tickets
+        WHERE id = ANY(%s) AND user_id IS NOT NULL
+        ON CONFLICT (user_id) DO UPDATE
+        SET version = ticket_list_versions.version + 1, updated_at = NOW()
+    """, (ticket_ids,))
+
+def maintain_partitions(cur, conn, data: Dict[str, Any]) -> Dict[str, Any]:
+    """Создаёт партиции messages на ближайшие месяцы и удаляет старые пустые"""
+    cur.execute("""
+        SELECT t_p7304060_coldfire_authenticat.ensure_messages_partition(
+            (date_trunc('month', NOW()) + make_interval(months => m))::date
+        )
+        FROM generate_series(0, %s) AS m
+    """, (PARTITIONS_AHEAD_MONTHS,))
+    ensured = [row[0] for row in cur.fetchall()]
+
+    cur.execute(
+        "SELECT t_p7304060_coldfire_authenticat.drop_empty_messages_partitions(%s)",
+        (PARTITIONS_KEEP_MONTHS,)
+    )
+    dropped = cur.fetchone()[0]
+    conn.commit()
+
+    return {'partitions': ensured, 'dropped': dropped}
+
+def archive_closed_tickets(cur, conn, data: Dict[str, Any]) -> Dict[str, Any]:
+    """Переносит историю давно закрытых заявок в messages_archive небольшими транзакциями"""
+    archived_tickets = 0
+    archived_messages = 0
+
+    for _ in range(ARCHIVE_MAX_BATCHES):
+        cur.execute("""
+            SELECT id
+            FROM t_p7304060_coldfire_authenticat.support_tickets
+            WHERE status = 'closed' AND closed_at < NOW() - make_interval(days => %s)
+            ORDER BY closed_at
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        """, (ARCHIVE_AFTER_DAYS, ARCHIVE_BATCH_SIZE))
+        ticket_ids = [row[0] for row in cur.fetchall()]
+        if not ticket_ids:
+            break
+
+        cur.execute("""
+            WITH moved AS (
+                DELETE FROM t_p7304060_coldfire_authenticat.messages
+                WHERE ticket_id = ANY(%s)
+                RETURNING id, ticket_id, sender_id, content, message_type, attachment_url,
+                          is_flagged, flag_reason, created_at, edited_at
+            )
+            INSERT INTO t_p7304060_coldfire_authenticat.messages_archive
+            (id, ticket_id, sender_id, content, message_type, attachment_url,
+             is_flagged, flag_reason, created_at, edited_at)
+            SELECT * FROM moved
+        """, (ticket_ids,))
+        archived_messages += cur.rowcount
+
+        cur.execute("""
+            UPDATE t_p7304060_coldfire_authenticat.support_tickets
+            SET status = 'archived'
+            WHERE id = ANY(%s)
+        """, (ticket_ids,))
+        bump_ticket_list_versions(cur, ticket_ids)
+        archived_tickets += len(ticket_ids)
+        conn.commit()
+
+    return {'archived_tickets': archived_tickets, 'archived_messages': archived_messages}
+
+def refresh_daily_rollups(cur, conn, data: Dict[str, Any]) -> Dict[str, Any]:
+    """Пересчитывает дневные агрегаты начиная с дня водяного знака"""
+    # Каждое событие относится ко дню, когда оно произошло (открытие, закрытие,
+    # первый ответ, оценка), поэтому дни до водяного знака уже не меняются и
+    # пересчитываются только последние дни по индексам времени событий
+    cur.execute("""
+        SELECT watermark::date, NOW()
+        FROM t_p7304060_coldfire_authenticat.job_watermarks
+        WHERE job_name = 'daily_ticket_rollups'
+        FOR UPDATE
+    """)
+    row = cur.fetchone()
+    from_day, started_at = (row[0], row[1]) if row else (None, None)
+    if from_day is None:
+        cur.execute("SELECT '1970-01-01'::date, NOW()")
+        from_day, started_at = cur.fetchone()
+
+    cur.execute("""
+        DELETE FROM t_p7304060_coldfire_authenticat.daily_ticket_rollups
+        WHERE day >= %s
+    """, (from_day,))
+
+    cur.execute("""
+        WITH opened AS (
+            SELECT created_at::date AS day, 0 AS moderator_id,
+                   COALESCE(category, 'general') AS category, COUNT(*) AS opened
+            FROM t_p7304060_coldfire_authenticat.support_tickets
+            WHERE created_at >= %(from_day)s
+            GROUP BY 1, 2, 3
+        ),
+        closed AS (
+            -- Автоматическое закрытие не засчитывается модератору заявки:
+            -- оно попадает только в общие итоги (moderator_id = 0)
+            SELECT closed_at::date AS day,
+                   CASE WHEN auto_closed THEN 0 ELSE COALESCE(assigned_moderator_id, 0) END AS moderator_id,
+                   COALESCE(category, 'general') AS category, COUNT(*) AS closed
+            FROM t_p7304060_coldfire_authenticat.support_tickets
+            WHERE closed_at >= %(from_day)s
+            GROUP BY 1, 2, 3
+        ),
+        answered AS (
+            SELECT DISTINCT m.ticket_id
+            FROM t_p7304060_coldfire_authenticat.messages_all m
+            JOIN t_p7304060_coldfire_authenticat.support_tickets t ON t.id = m.ticket_id
+            WHERE m.created_at >= %(from_day)s AND m.sender_id <> t.user_id
+        ),
+        first_responses AS (
+            SELECT DISTINCT ON (m.ticket_id)
+                   m.ticket_id, m.sender_id, m.created_at,
+                   t.created_at AS ticket_created_at, COALESCE(t.category, 'general') AS category
+            FROM t_p7304060_coldfire_authenticat.messages_all m
+            JOIN t_p7304060_coldfire_authenticat.support_tickets t ON t.id = m.ticket_id
+            WHERE m.ticket_id IN (SELECT ticket_id FROM answered) AND m.sender_id <> t.user_id
+            ORDER BY m.ticket_id, m.created_at
+        ),
+        responses AS (
+            SELECT created_at::date AS day, sender_id AS moderator_id, category,
+                   COUNT(*) AS response_count,
+                   SUM(EXTRACT(EPOCH FROM created_at - ticket_created_at))::bigint AS response_seconds
+            FROM first_responses
+            WHERE created_at >= %(from_day)s
+            GROUP BY 1, 2, 3
+        ),
+        ratings AS (
+            SELECT r.created_at::date AS day, COALESCE(r.moderator_id, 0) AS moderator_id,
+                   COALESCE(t.category, 'general') AS category,
+                   COUNT(*) AS rating_count, SUM(r.rating) AS rating_sum
+            FROM t_p7304060_coldfire_authenticat.moderator_ratings r
+            LEFT JOIN t_p7304060_coldfire_authenticat.support_tickets t ON t.id = r.ticket_id
+            WHERE r.created_at >= %(from_day)s AND r.rating IS NOT NULL
+            GROUP BY 1, 2, 3
+        ),
+        combined AS (
+            SELECT day, moderator_id, category, opened, 0 AS closed, 0 AS response_count,
+                   0 AS response_seconds, 0 AS rating_count, 0 AS rating_sum FROM opened
+            UNION ALL
+            SELECT day, moderator_id, category, 0, closed, 0, 0, 0, 0 FROM closed
+            UNION ALL
+            SELECT day, moderator_id, category, 0, 0, response_count, response_seconds, 0, 0 FROM responses
+            UNION ALL
+            SELECT day, moderator_id, category, 0, 0, 0, 0, rating_count, rating_sum FROM ratings
+        )
+        INSERT INTO t_p7304060_coldfire_authenticat.daily_ticket_rollups
+        (day, moderator_id, category, opened, closed, first_response_count,
+         first_response_seconds_sum, rating_count, rating_sum)
+        SELECT day, moderator_id, category, SUM(opened), SUM(closed), SUM(response_count),
+               SUM(response_seconds), SUM(rating_count), SUM(rating_sum)
+        FROM combined
+        GROUP BY day, moderator_id, category
+    """, {'from_day': from_day})
+    rows_written = cur.rowcount
+
+    cur.execute("""
+        INSERT INTO t_p7304060_coldfire_authenticat.job_watermarks (job_name, watermark)
+        VALUES ('daily_ticket_rollups', %s)
+        ON CONFLICT (job_name) DO UPDATE SET watermark = EXCLUDED.watermark, updated_at = NOW()
+    """, (started_at,))
+    conn.commit()
+
+    return {'from_day': from_day.isoformat(), 'rows': rows_written}
+
+def purge_idempotency_keys(cur, conn, data: Dict[str, Any]) -> Dict[str, Any]:
+    """Удаляет просроченные ключи идемпотентности пачками"""
+    purged = 0
+    while True:
+        cur.execute("""
+            DELETE FROM t_p7304060_coldfire_authenticat.idempotency_keys
+            WHERE (user_id, scope, idempotency_key) IN (
+                SELECT user_id, scope, idempotency_key
+                FROM t_p7304060_coldfire_authenticat.idempotency_keys
+                WHERE created_at < NOW() - make_interval(hours => %s)
+                LIMIT %s
+            )
+        """, (IDEMPOTENCY_TTL_HOURS, PURGE_BATCH_SIZE))
+        deleted = cur.rowcount
+        conn.commit()
+        purged += deleted
+        if deleted < PURGE_BATCH_SIZE:
+            break
+
+    return {'purged': purged}
+
+def pick_moderator(heap: List[Tuple[int, int]], expertise: Dict[int, Dict[str, float]],
+                   category: str, weight: int, max_load: int) -> Optional[int]:
+    """Выбирает модератора из кучи (нагрузка, id) и увеличивает его нагрузку"""
+    # Из нескольких наименее загруженных выбирается тот, у кого нагрузка после
+    # назначения, делённая на экспертизу в категории, минимальна
+    candidates = []
+    while heap and len(candidates) < ASSIGN_CANDIDATES:
+        candidates.append(heapq.heappop(heap))
+
+    best = None
+    best_score = 0.0
+    for candidate in candidates:
+        load, moderator_id = candidate
+        if load + weight > max_load:
+            continue
+        score = (load + weight) / expertise.get(moderator_id, {}).get(category, 1.0)
+        if best is None or score < best_score:
+            best, best_score = candidate, score
+
+    for candidate in candidates:
+        if candidate is not best:
+            heapq.heappush(heap, candidate)
+    if best is None:
+        return None
+    heapq.heappush(heap, (best[0] + weight, best[1]))
+    return best[1]
+
+def load_moderator_heap(cur, priorities: List[str], weights: List[int]) -> List[Tuple[int, int]]:
+    """Куча (нагрузка, модератор) модераторов в сети по текущим назначениям"""
+    cur.execute("""
+        SELECT u.id, COALESCE(SUM(w.weight), 0)
+        FROM t_p7304060_coldfire_authenticat.users u
+        LEFT JOIN t_p7304060_coldfire_authenticat.moderator_stats ms ON ms.moderator_id = u.id
+        LEFT JOIN t_p7304060_coldfire_authenticat.support_tickets t
+               ON t.assigned_moderator_id = u.id AND t.status IN ('open', 'in_progress')
+        LEFT JOIN unnest(%s::text[], %s::int[]) AS w(priority, weight) ON w.priority = t.priority
+        WHERE u.role = 'moderator' AND NOT COALESCE(u.is_banned, FALSE)
+          AND GREATEST(u.last_login, ms.last_active) > NOW() - make_interval(mins => %s)
+        GROUP BY u.id
+    """, (priorities, weights, MODERATOR_ONLINE_MINUTES))
+    heap = [(int(load), moderator_id) for moderator_id, load in cur.fetchall()]
+    heapq.heapify(heap)
+    return heap
+
+def try_lock_assign(cur) -> bool:
+    """Блокировка задачи assign до конца транзакции; False, если её держит другой запуск"""
+    cur.execute("SELECT pg_try_advisory_xact_lock(hashtext('maintenance.assign'))")
+    return cur.fetchone()[0]
+
+def assign_tickets(cur, conn, data: Dict[str, Any]) -> Dict[str, Any]:
+    """Назначает неназначенные открытые заявки наименее загруженным модераторам в сети"""
+    priorities = list(PRIORITY_WEIGHTS)
+    weights = [PRIORITY_WEIGHTS[p] for p in priorities]
+
+    # Пачки разных запусков не чередуются: иначе каждый запуск считал бы
+    # нагрузку без назначений другого и оба выбрали бы одного модератора
+    if not try_lock_assign(cur):
+        conn.rollback()
+        return {'assigned': 0, 'moderators_online': 0, 'skipped': 0, 'locked': True}
+    heap = load_moderator_heap(cur, priorities, weights)
+    if not heap:
+        conn.rollback()
+        return {'assigned': 0, 'moderators_online': 0, 'skipped': 0}
+    moderators_online = len(heap)
+
+    expertise: Dict[int, Dict[str, float]] = {}
+    cur.execute("""
+        SELECT moderator_id, category, weight
+        FROM t_p7304060_coldfire_authenticat.moderator_expertise
+        WHERE moderator_id = ANY(%s)
+    """, ([moderator_id for _, moderator_id in heap],))
+    for moderator_id, category, weight in cur.fetchall():
+        expertise.setdefault(moderator_id, {})[category] = weight
+
+    assigned = 0
+    skipped: List[int] = []
+    for batch in range(ASSIGN_MAX_BATCHES):
+        # Каждая пачка - своя транзакция: блокировка берётся заново, а
+        # нагрузка перечитывается с учётом назначений, сделанных без неё
+        if batch:
+            if not try_lock_assign(cur):
+                conn.rollback()
+                break
+            heap = load_moderator_heap(cur, priorities, weights)
+
+        # Срочные заявки назначаются первыми; заблокированные другим
+        # запуском пропускаются, поэтому одну заявку не назначат дважды
+        cur.execute("""
+            SELECT id, priority, COALESCE(category, 'general')
+            FROM t_p7304060_coldfire_authenticat.support_tickets
+            WHERE assigned_moderator_id IS NULL AND status = 'open' AND id <> ALL(%s)
+            ORDER BY array_position(%s::text[], priority) DESC NULLS LAST, created_at
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        """, (skipped, priorities, ASSIGN_BATCH_SIZE))
+        tickets = cur.fetchall()
+        if not tickets:
+            break
+
+        ticket_ids: List[int] = []
+        moderator_ids: List[int] = []
+        for ticket_id, priority, category in tickets:
+            weight = PRIORITY_WEIGHTS.get(priority, PRIORITY_WEIGHTS['medium'])
+            moderator_id = pick_moderator(heap, expertise, category, weight, MODERATOR_MAX_LOAD)
+            if moderator_id is None:
+                skipped.append(ticket_id)
+                continue
+            ticket_ids.append(ticket_id)
+            moderator_ids.append(moderator_id)
+
+        if ticket_ids:
+            cur.execute("""
+                UPDATE t_p7304060_coldfire_authenticat.support_tickets t
+                SET assigned_moderator_id = a.moderator_id, updated_at = NOW()
+                FROM unnest(%s::int[], %s::int[]) AS a(ticket_id, moderator_id)
+                WHERE t.id = a.ticket_id
+            """, (ticket_ids, moderator_ids))
+            bump_ticket_list_versions(cur, ticket_ids)
+            cur.execute("""
+                INSERT INTO t_p7304060_coldfire_authenticat.system_messages (ticket_id, message_type, content, action_data)
+                SELECT a.ticket_id, 'auto_assigned', 'Заявка автоматически назначена модератору',
+                       jsonb_build_object('moderator_id', a.moderator_id)
+                FROM unnest(%s::int[], %s::int[]) AS a(ticket_id, moderator_id)
+            """, (ticket_ids, moderator_ids))
+            assigned += len(ticket_ids)
+        conn.commit()
+
+        # Все модераторы заняты - дальше выбирать заявки бессмысленно
+        if not ticket_ids:
+            break
+
+    return {'assigned': assigned, 'moderators_online': moderators_online, 'skipped': len(skipped)}
+
+def auto_close_stale_tickets(cur, conn, data: Dict[str, Any]) -> Dict[str, Any]:
+    """Закрывает заявки без активности дольше порога для их статуса и приоритета"""
+    # Закрытые заявки перестают подходить под условие выборки, поэтому
+    # прерванный запуск продолжается следующим без отдельного курсора
+    statuses, priorities, hours = [], [], []
+    for status, thresholds in AUTO_CLOSE_THRESHOLDS.items():
+        for priority, idle_hours in thresholds.items():
+            statuses.append(status)
+            priorities.append(priority)
+            hours.append(int(idle_hours))
+
+    closed = 0
+    batches = 0
+    for batch in range(AUTO_CLOSE_MAX_BATCHES):
+        if batch:
+            time.sleep(AUTO_CLOSE_PAUSE_SECONDS)
+
+        cur.execute("""
+            SELECT t.id, th.idle_hours
+            FROM t_p7304060_coldfire_authenticat.support_tickets t
+            JOIN unnest(%s::text[], %s::text[], %s::int[]) AS th(status, priority, idle_hours)
+              ON th.status = t.status AND th.priority = t.priority
+            WHERE t.status IN ('open', 'in_progress')
+              AND t.updated_at < NOW() - make_interval(hours => th.idle_hours)
+            ORDER BY t.updated_at
+            LIMIT %s
+            FOR UPDATE OF t SKIP LOCKED
+        """, (statuses, priorities, hours, AUTO_CLOSE_BATCH_SIZE))
+        rows = cur.fetchall()
+        if not rows:
+            break
+        ticket_ids = [row[0] for row in rows]
+        idle_hours = [row[1] for row in rows]
+
+        # Автозакрытие не засчитывается модераторам в moderator_stats:
+        # total_tickets_closed растёт только при закрытии заявки модератором
+        cur.execute("""
+            UPDATE t_p7304060_coldfire_authenticat.support_tickets
+            SET status = 'closed', auto_closed = TRUE, closed_at = NOW(), updated_at = NOW()
+            WHERE id = ANY(%s)
+        """, (ticket_ids,))
+
+        bump_ticket_list_versions(cur, ticket_ids)
+        cur.execute("""
+            INSERT INTO t_p7304060_coldfire_authenticat.system_messages (ticket_id, message_type, content, action_data)
+            SELECT a.ticket_id, 'auto_closed', 'Заявка закрыта автоматически из-за отсутствия активности',
+                   jsonb_build_object('idle_hours', a.idle_hours)
+            FROM unnest(%s::int[], %s::int[]) AS a(ticket_id, idle_hours)
+        """, (ticket_ids, idle_hours))
+
+        conn.commit()
+
+        closed += len(ticket_ids)
+        batches += 1
+
+    return {'closed': closed, 'batches': batches}
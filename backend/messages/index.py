@@ -1,11 +1,738 @@
 import json
 import os
-import psycopg2
-from typing import Dict, Any
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Set, Tuple
 
+# >>> shared/db_connection.py (копия, правится в shared/ и переносится scripts/sync_shared_blocks.py)
+# Соединения живут в модуле и переиспользуются тёплыми вызовами функции.
+# psycopg2 импортируется только при первом запросе, которому нужна БД,
+# поэтому CORS preflight и холодный старт не платят за загрузку драйвера.
+_conn = None
+
+# Чтения без требований к свежести функция берёт через get_read_connection:
+# они уходят на реплику (REPLICA_DATABASE_URL), пока её отставание не
+# превышает REPLICA_MAX_LAG_SECONDS. Отставание проверяется не чаще раза в
+# REPLICA_LAG_CHECK_INTERVAL секунд.
+REPLICA_MAX_LAG_SECONDS = float(os.environ.get('REPLICA_MAX_LAG_SECONDS', '5'))
+REPLICA_LAG_CHECK_INTERVAL = 2.0
+_replica_conn = None
+_replica_checked_at = 0.0
+_replica_usable = False
+
+def get_connection(database_url: str):
+    '''Возвращает открытое соединение с основной БД, подключаясь только при необходимости'''
+    global _conn
+    if _conn is None or _conn.closed:
+        import psycopg2
+        _conn = psycopg2.connect(database_url, connect_timeout=3,
+                                 options=f'-c statement_timeout={STATEMENT_TIMEOUT_MS}',
+                                 connection_factory=tracked_connection_class())
+        note_db_success()
+    apply_statement_timeout(_conn)
+    return _conn
+
+def get_read_connection(database_url: str):
+    '''Возвращает соединение для чтения: реплику, если она успевает за основной БД'''
+    global _replica_conn, _replica_checked_at, _replica_usable
+    replica_url = os.environ.get('REPLICA_DATABASE_URL')
+    if not replica_url:
+        return get_connection(database_url)
+    
+    now = time.monotonic()
+    if now - _replica_checked_at >= REPLICA_LAG_CHECK_INTERVAL:
+        _replica_checked_at = now
+        try:
+            if _replica_conn is None or _replica_conn.closed:
+                import psycopg2
+                _replica_conn = psycopg2.connect(replica_url, connect_timeout=2,
+                                                 options=f'-c statement_timeout={STATEMENT_TIMEOUT_MS}',
+                                                 connection_factory=tracked_connection_class())
+            cur = _replica_conn.cursor()
+            # Простаивающая основная БД не двигает replay timestamp, поэтому
+            # полностью проигранный WAL считается нулевым отставанием
+            cur.execute("""
+                SELECT CASE
+                    WHEN NOT pg_is_in_recovery() THEN 0
+                    WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                    ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+                END
+            """)
+            lag = float(cur.fetchone()[0])
+            _replica_conn.rollback()
+            _replica_usable = lag <= REPLICA_MAX_LAG_SECONDS
+        except Exception:
+            _replica_usable = False
+            if _replica_conn is not None:
+                _replica_conn.close()
+                _replica_conn = None
+    
+    if _replica_usable and _replica_conn is not None:
+        apply_statement_timeout(_replica_conn)
+        return _replica_conn
+    return get_connection(database_url)
+
+def release_connection(conn) -> None:
+    '''Завершает транзакцию запроса, оставляя соединение открытым для следующего вызова'''
+    global _conn, _replica_conn
+    try:
+        import psycopg2.extensions
+        in_transaction = conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE
+        conn.rollback()
+        if in_transaction:
+            note_db_success()
+    except Exception:
+        conn.close()
+        if conn is _conn:
+            _conn = None
+        if conn is _replica_conn:
+            _replica_conn = None
+# <<< shared/db_connection.py
+
+# Заявки, в которые этот экземпляр недавно писал: их история читается из
+# основной БД, пока реплика может не видеть новое сообщение (read-your-writes).
+# Так же учитываются пользователи, чьи счётчики непрочитанного менялись:
+# после mark_read бейдж не должен вернуться из отстающей реплики
+_recent_ticket_writes: Dict[str, float] = {}
+_recent_user_writes: Dict[str, float] = {}
+
+def remember_write(writes: Dict[str, float], key: Any) -> None:
+    '''Запоминает запись по ключу и забывает записи старше окна отставания'''
+    now = time.monotonic()
+    for stale_key, written_at in list(writes.items()):
+        if now - written_at > REPLICA_MAX_LAG_SECONDS:
+            del writes[stale_key]
+    writes[str(key)] = now
+
+def is_recent_write(writes: Dict[str, float], key: Any) -> bool:
+    '''Проверяет, могла ли реплика ещё не получить запись по ключу'''
+    written_at = writes.get(str(key))
+    return written_at is not None and time.monotonic() - written_at <= REPLICA_MAX_LAG_SECONDS
+
+def mark_ticket_write(ticket_id: Any) -> None:
+    '''Запоминает запись в заявку'''
+    remember_write(_recent_ticket_writes, ticket_id)
+
+def has_recent_ticket_write(ticket_id: Any) -> bool:
+    '''Проверяет, могла ли реплика ещё не получить запись в заявку'''
+    return is_recent_write(_recent_ticket_writes, ticket_id)
+
+def mark_user_write(user_id: Any) -> None:
+    '''Запоминает изменение счётчиков непрочитанного пользователя'''
+    remember_write(_recent_user_writes, user_id)
+
+def has_recent_user_write(user_id: Any) -> bool:
+    '''Проверяет, могла ли реплика ещё не получить счётчики пользователя'''
+    return is_recent_write(_recent_user_writes, user_id)
+
+# Реестр запросов горячих путей. Каждый запрос готовится один раз на
+# соединение через PREPARE и дальше выполняется по имени через EXECUTE,
+# поэтому Postgres не разбирает и не планирует его на каждом вызове.
+STATEMENTS = {
+    'messages_by_ticket': """
+        SELECT m.id, m.content, m.message_type, m.attachment_url, 
+               m.created_at, m.edited_at, m.is_flagged, m.sender_id
+        FROM messages_all m
+        WHERE m.ticket_id = $1
+        ORDER BY m.created_at ASC
+    """,
+    'messages_batch': """
+        SELECT r.ticket_id, m.id, m.content, m.message_type, m.attachment_url,
+               m.created_at, m.edited_at, m.is_flagged, m.sender_id
+        FROM unnest($1::int[], $2::bigint[]) AS r(ticket_id, after_id)
+        JOIN support_tickets t ON t.id = r.ticket_id
+        JOIN users v ON v.id = $3 AND NOT COALESCE(v.is_banned, FALSE)
+         AND (t.user_id = v.id OR t.assigned_moderator_id = v.id OR v.role IN ('moderator', 'admin'))
+        LEFT JOIN LATERAL (
+            SELECT id, content, message_type, attachment_url, created_at, edited_at, is_flagged, sender_id
+            FROM messages_all
+            WHERE ticket_id = r.ticket_id AND id > r.after_id
+            ORDER BY id
+            LIMIT $4
+        ) m ON TRUE
+        ORDER BY r.ticket_id, m.id
+    """,
+    'sender_profiles': """
+        SELECT id, username, role, station, avatar_url, is_banned
+        FROM users
+        WHERE id = ANY($1::int[])
+    """,
+    'user_profile_version': """
+        SELECT version FROM user_profile_version
+    """,
+    'message_insert': """
+        INSERT INTO messages (ticket_id, sender_id, content, message_type, attachment_url, is_flagged, flag_reason)
+        VALUES ($1, $2, $3, $4, $5, $6, $7)
+        RETURNING id, created_at
+    """,
+    'attachment_exists': """
+        SELECT 1 FROM attachments WHERE content_hash = $1
+    """,
+    'ticket_touch': """
+        UPDATE support_tickets 
+        SET updated_at = CURRENT_TIMESTAMP 
+        WHERE id = $1
+    """,
+    'unread_increment': """
+        INSERT INTO ticket_read_state (user_id, ticket_id, unread_count)
+        SELECT DISTINCT participant, t.id, 1
+        FROM support_tickets t
+        CROSS JOIN unnest(ARRAY[t.user_id, t.assigned_moderator_id]) AS participant
+        WHERE t.id = $1 AND participant IS NOT NULL AND participant <> $2
+        ON CONFLICT (user_id, ticket_id) DO UPDATE
+        SET unread_count = ticket_read_state.unread_count + 1, updated_at = CURRENT_TIMESTAMP
+        RETURNING user_id
+    """,
+    'list_version_bump': """
+        INSERT INTO ticket_list_versions (user_id, version)
+        SELECT user_id, 1 FROM support_tickets WHERE id = $1
+        ON CONFLICT (user_id) DO UPDATE
+        SET version = ticket_list_versions.version + 1, updated_at = CURRENT_TIMESTAMP
+    """,
+    'unread_by_user': """
+        SELECT ticket_id, unread_count
+        FROM ticket_read_state
+        WHERE user_id = $1 AND unread_count > 0
+    """,
+}
+
+# >>> shared/prepared_statements.py (копия, правится в shared/ и переносится scripts/sync_shared_blocks.py)
+# Запросы берутся из реестра STATEMENTS, который функция определяет до
+# этого блока. Имена уже подготовленных запросов по соединениям:
+# id(conn) -> (conn, {name})
+_prepared: Dict[int, Any] = {}
+
+def execute_prepared(cur, name: str, params: tuple = ()) -> None:
+    '''Выполняет запрос из STATEMENTS, подготавливая его на соединении при первом обращении'''
+    import psycopg2.errors
+    import psycopg2.extensions
+    conn = cur.connection
+    entry = _prepared.get(id(conn))
+    if entry is None or entry[0] is not conn:
+        entry = (conn, set())
+        _prepared[id(conn)] = entry
+    names = entry[1]
+    
+    # Повтор после сброса безопасен, только если запрос открывает транзакцию
+    starts_transaction = conn.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_IDLE
+    placeholders = ' (' + ', '.join(['%s'] * len(params)) + ')' if params else ''
+    
+    for attempt in range(2):
+        try:
+            if name not in names:
+                cur.execute(f'PREPARE {name} AS {STATEMENTS[name]}')
+                names.add(name)
+            cur.execute(f'EXECUTE {name}{placeholders}', params)
+            return
+        except (psycopg2.errors.FeatureNotSupported, psycopg2.errors.InvalidSqlStatementName):
+            # Схема изменилась ("cached plan must not change result type")
+            # или подготовленный запрос пропал: сбрасываем реестр соединения
+            conn.rollback()
+            cur.execute('DEALLOCATE ALL')
+            names.clear()
+            if attempt or not starts_transaction:
+                raise
+# <<< shared/prepared_statements.py
+
+# Вложение сообщения - ссылка, которую вернула функция attachments:
+# ATTACHMENTS_PUBLIC_URL (тот же, что у attachments) и ?hash=<sha256>.
+# Вместо ссылки можно передать сам хэш; сохраняется всегда ссылка.
+ATTACHMENTS_PUBLIC_URL = os.environ.get('ATTACHMENTS_PUBLIC_URL', '')
+ATTACHMENT_HASH_PATTERN = re.compile(r'^(?:\?hash=)?([0-9a-f]{64})$')
+
+def parse_attachment_hash(attachment_url: str) -> Optional[str]:
+    '''Хэш вложения из ссылки функции attachments; None для чужих ссылок'''
+    if ATTACHMENTS_PUBLIC_URL and attachment_url.startswith(ATTACHMENTS_PUBLIC_URL + '?'):
+        attachment_url = attachment_url[len(ATTACHMENTS_PUBLIC_URL):]
+    match = ATTACHMENT_HASH_PATTERN.match(attachment_url)
+    return match.group(1) if match else None
+
+# Пакетная выборка истории для нескольких открытых заявок: tickets=12:340,15
+# (id заявки и необязательный курсор - id последнего полученного сообщения)
+BATCH_MAX_TICKETS = 50
+BATCH_DEFAULT_LIMIT = 50
+BATCH_MAX_LIMIT = 200
+
+def parse_ticket_cursors(raw: str) -> Optional[Dict[int, int]]:
+    '''Разбирает список "id[:после_id]" через запятую; None при ошибке формата'''
+    cursors: Dict[int, int] = {}
+    for item in raw.split(','):
+        ticket_part, _, after_part = item.strip().partition(':')
+        if not ticket_part.isdigit() or (after_part and not after_part.isdigit()):
+            return None
+        cursors[int(ticket_part)] = int(after_part or 0)
+    return cursors
+
+def fetch_messages_batch(cur, user_id: Any, cursors: Dict[int, int], limit: int) -> Dict[str, Any]:
+    '''История нескольких заявок одним запросом; недоступные заявки попадают в denied'''
+    ticket_ids = list(cursors)
+    # Берётся на одно сообщение больше лимита, чтобы узнать, есть ли продолжение
+    execute_prepared(cur, 'messages_batch', (ticket_ids, [cursors[t] for t in ticket_ids], user_id, limit + 1))
+    
+    tickets: Dict[int, Dict[str, Any]] = {}
+    for row in cur.fetchall():
+        ticket = tickets.setdefault(row[0], {'messages': [], 'has_more': False, 'cursor': cursors[row[0]]})
+        if row[1] is None:
+            continue
+        if len(ticket['messages']) == limit:
+            ticket['has_more'] = True
+            continue
+        ticket['messages'].append({
+            'id': row[1],
+            'content': row[2],
+            'message_type': row[3],
+            'attachment_url': row[4],
+            'created_at': row[5].isoformat() if row[5] else None,
+            'edited_at': row[6].isoformat() if row[6] else None,
+            'is_flagged': row[7],
+            'sender_id': row[8]
+        })
+        ticket['cursor'] = row[1]
+    
+    senders = get_sender_profiles(cur, {
+        message['sender_id'] for ticket in tickets.values() for message in ticket['messages']
+    })
+    return {
+        'tickets': {str(ticket_id): ticket for ticket_id, ticket in tickets.items()},
+        'senders': {str(sender_id): profile for sender_id, profile in senders.items()},
+        'denied': [ticket_id for ticket_id in ticket_ids if ticket_id not in tickets]
+    }
+
+# Профили отправителей для истории сообщений: ограниченный LRU в памяти
+# процесса. Любое изменение профиля или блокировки в БД поднимает версию в
+# user_profile_version (триггер на users); версия сверяется не чаще раза в
+# SENDER_CACHE_VERSION_TTL секунд, и при её росте кэш сбрасывается целиком.
+# SENDER_CACHE_TTL ограничивает жизнь записи, блокировка из report_message
+# сбрасывает запись сразу.
+SENDER_CACHE_SIZE = int(os.environ.get('SENDER_CACHE_SIZE', '2000'))
+SENDER_CACHE_TTL = float(os.environ.get('SENDER_CACHE_TTL', '60'))
+SENDER_CACHE_VERSION_TTL = float(os.environ.get('SENDER_CACHE_VERSION_TTL', '2'))
+_sender_cache: 'OrderedDict[int, Tuple[float, Dict[str, Any]]]' = OrderedDict()
+_sender_cache_version: Tuple[float, Optional[int]] = (0.0, None)
+
+def check_sender_cache_version(cur) -> None:
+    '''Сбрасывает кэш отправителей, если версия профилей в БД изменилась'''
+    global _sender_cache_version
+    now = time.monotonic()
+    checked_at, version = _sender_cache_version
+    if version is not None and now - checked_at < SENDER_CACHE_VERSION_TTL:
+        return
+    execute_prepared(cur, 'user_profile_version')
+    row = cur.fetchone()
+    current = row[0] if row else 0
+    if current != version:
+        _sender_cache.clear()
+    _sender_cache_version = (now, current)
+
+def get_sender_profiles(cur, sender_ids: Set[int]) -> Dict[int, Dict[str, Any]]:
+    '''Возвращает профили отправителей, дочитывая из БД только отсутствующие в кэше'''
+    if not sender_ids:
+        return {}
+    check_sender_cache_version(cur)
+    now = time.monotonic()
+    profiles: Dict[int, Dict[str, Any]] = {}
+    missing = []
+    for sender_id in sender_ids:
+        cached = _sender_cache.get(sender_id)
+        if cached and now - cached[0] < SENDER_CACHE_TTL:
+            _sender_cache.move_to_end(sender_id)
+            profiles[sender_id] = cached[1]
+        else:
+            missing.append(sender_id)
+    
+    if missing:
+        execute_prepared(cur, 'sender_profiles', (missing,))
+        for row in cur.fetchall():
+            profile = {
+                'username': row[1],
+                'role': row[2],
+                'station': row[3],
+                'avatar_url': row[4],
+                'is_banned': row[5]
+            }
+            profiles[row[0]] = profile
+            _sender_cache[row[0]] = (now, profile)
+            _sender_cache.move_to_end(row[0])
+        while len(_sender_cache) > SENDER_CACHE_SIZE:
+            _sender_cache.popitem(last=False)
+    
+    return profiles
+
+def invalidate_sender(user_id: Any) -> None:
+    '''Убирает профиль из кэша после изменения профиля или статуса блокировки'''
+    _sender_cache.pop(int(user_id), None)
+
+# Предварительная проверка сообщений по списку запрещённых фраз (по одной на
+# строку, # - комментарий). Автомат Ахо-Корасик строится один раз на процесс и
+# перестраивается, когда меняется время изменения файла; файл проверяется не
+# чаще раза в BANNED_PHRASES_CHECK_SECONDS секунд.
+BANNED_PHRASES_FILE = os.environ.get(
+    'BANNED_PHRASES_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'banned_phrases.txt')
+)
+BANNED_PHRASES_CHECK_SECONDS = float(os.environ.get('BANNED_PHRASES_CHECK_SECONDS', '30'))
+_phrase_matcher = None
+_phrase_matcher_mtime = None
+_phrase_matcher_checked_at = 0.0
+
+def normalize_text(text: str) -> str:
+    '''Приводит текст к виду для сравнения: без регистра, ё = е'''
+    return text.casefold().replace('ё', 'е')
+
+class PhraseMatcher:
+    '''Автомат Ахо-Корасик: поиск любой из фраз за один проход по тексту'''
+
+    def __init__(self, phrases) -> None:
+        self.phrases = []
+        self.goto = [{}]
+        self.fail = [0]
+        # Индекс фразы, оканчивающейся в узле или в его суффиксе; -1 - нет
+        self.output = [-1]
+        for phrase in phrases:
+            phrase = normalize_text(phrase.strip())
+            if not phrase:
+                continue
+            node = 0
+            for char in phrase:
+                next_node = self.goto[node].get(char)
+                if next_node is None:
+                    next_node = len(self.goto)
+                    self.goto[node][char] = next_node
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append(-1)
+                node = next_node
+            if self.output[node] < 0:
+                self.output[node] = len(self.phrases)
+                self.phrases.append(phrase)
+        
+        # Ссылки неудачи в порядке обхода в ширину: родитель всегда обработан раньше
+        queue = list(self.goto[0].values())
+        for node in queue:
+            for char, child in self.goto[node].items():
+                queue.append(child)
+                fallback = self.fail[node]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                target = self.goto[fallback].get(char, 0)
+                self.fail[child] = target if target != child else 0
+                if self.output[child] < 0:
+                    self.output[child] = self.output[self.fail[child]]
+
+    def find(self, text: str) -> Optional[str]:
+        '''Первая найденная в тексте фраза или None'''
+        goto, fail, output = self.goto, self.fail, self.output
+        node = 0
+        for char in normalize_text(text):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            if output[node] >= 0:
+                return self.phrases[output[node]]
+        return None
+
+def load_phrase_matcher(path: str) -> PhraseMatcher:
+    '''Строит автомат из файла фраз, пропуская комментарии'''
+    with open(path, encoding='utf-8') as f:
+        return PhraseMatcher(line for line in f if not line.lstrip().startswith('#'))
+
+def get_phrase_matcher() -> Optional[PhraseMatcher]:
+    '''Текущий автомат; при ошибке чтения файла остаётся последний удачный'''
+    global _phrase_matcher, _phrase_matcher_mtime, _phrase_matcher_checked_at
+    now = time.monotonic()
+    if _phrase_matcher is not None and now - _phrase_matcher_checked_at < BANNED_PHRASES_CHECK_SECONDS:
+        return _phrase_matcher
+    _phrase_matcher_checked_at = now
+    try:
+        mtime = os.stat(BANNED_PHRASES_FILE).st_mtime_ns
+        if mtime != _phrase_matcher_mtime:
+            _phrase_matcher = load_phrase_matcher(BANNED_PHRASES_FILE)
+            _phrase_matcher_mtime = mtime
+    except (OSError, UnicodeDecodeError):
+        pass
+    return _phrase_matcher
+
+def screen_content(content: str) -> Optional[str]:
+    '''Причина пометки сообщения автофильтром или None'''
+    matcher = get_phrase_matcher()
+    if matcher is None:
+        return None
+    phrase = matcher.find(content)
+    return f'Автофильтр: {phrase}' if phrase else None
+
+# >>> shared/idempotency.py (копия, правится в shared/ и переносится scripts/sync_shared_blocks.py)
+# Повторы POST с тем же заголовком Idempotency-Key получают сохранённый ответ
+# и не доходят до вставки. Ключи живут IDEMPOTENCY_TTL_HOURS часов.
+IDEMPOTENCY_TTL_HOURS = int(os.environ.get('IDEMPOTENCY_TTL_HOURS', '24'))
+IDEMPOTENCY_KEY_MAX_LENGTH = 100
+
+# Запросы таблицы idempotency_keys добавляются в реестр функции
+STATEMENTS.update({
+    'idempotency_lookup': """
+        SELECT status_code, response_body
+        FROM idempotency_keys
+        WHERE user_id = $1 AND scope = $2 AND idempotency_key = $3
+          AND status_code IS NOT NULL AND created_at > NOW() - make_interval(hours => $4)
+    """,
+    'idempotency_claim': """
+        INSERT INTO idempotency_keys (user_id, scope, idempotency_key)
+        VALUES ($1, $2, $3)
+        ON CONFLICT (user_id, scope, idempotency_key) DO UPDATE
+        SET status_code = NULL, response_body = NULL, created_at = NOW()
+        WHERE idempotency_keys.created_at <= NOW() - make_interval(hours => $4)
+    """,
+    'idempotency_store': """
+        UPDATE idempotency_keys
+        SET status_code = $4, response_body = $5
+        WHERE user_id = $1 AND scope = $2 AND idempotency_key = $3
+    """,
+})
+
+def get_idempotency_key(headers: Dict[str, Any]) -> Optional[str]:
+    '''Достаёт Idempotency-Key из заголовков запроса'''
+    key = headers.get('Idempotency-Key') or headers.get('idempotency-key')
+    return key.strip()[:IDEMPOTENCY_KEY_MAX_LENGTH] if key and key.strip() else None
+
+def find_idempotent_response(cur, user_id: Any, scope: str, key: str) -> Optional[Dict[str, Any]]:
+    '''Возвращает сохранённый ответ на запрос с этим ключом, если он есть'''
+    execute_prepared(cur, 'idempotency_lookup', (user_id, scope, key, IDEMPOTENCY_TTL_HOURS))
+    row = cur.fetchone()
+    if not row:
+        return None
+    return {
+        'statusCode': row[0],
+        'headers': {'Access-Control-Allow-Origin': '*', 'Idempotent-Replayed': 'true'},
+        'body': row[1]
+    }
+
+def claim_idempotency_key(cur, user_id: Any, scope: str, key: str) -> bool:
+    '''Занимает ключ в текущей транзакции; параллельный повтор ждёт её завершения'''
+    execute_prepared(cur, 'idempotency_claim', (user_id, scope, key, IDEMPOTENCY_TTL_HOURS))
+    return cur.rowcount == 1
+
+def resolve_idempotency_key(cur, user_id: Any, scope: str, key: str) -> Optional[Dict[str, Any]]:
+    '''Возвращает готовый ответ для повтора или None, если запрос нужно выполнить'''
+    stored = find_idempotent_response(cur, user_id, scope, key)
+    if stored is not None or claim_idempotency_key(cur, user_id, scope, key):
+        return stored
+    # Ключ занял параллельный запрос, который уже зафиксировал свой ответ
+    stored = find_idempotent_response(cur, user_id, scope, key)
+    if stored is not None:
+        return stored
+    return {
+        'statusCode': 409,
+        'headers': {'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({'error': 'Request with this Idempotency-Key is already in progress'})
+    }
+
+def store_idempotent_response(cur, user_id: Any, scope: str, key: Optional[str], response: Dict[str, Any]) -> None:
+    '''Сохраняет ответ под ключом в той же транзакции, что и запись'''
+    if key:
+        execute_prepared(cur, 'idempotency_store', (user_id, scope, key, response['statusCode'], response['body']))
+# <<< shared/idempotency.py
+
+# Пределы по умолчанию для эндпоинтов, не указанных в ENDPOINT_BUDGETS
+STATEMENT_TIMEOUT_MS = int(os.environ.get('STATEMENT_TIMEOUT_MS', '3000'))
+MAX_CONCURRENT_REQUESTS = int(os.environ.get('MAX_CONCURRENT_REQUESTS', '10'))
+
+# Бюджеты эндпоинтов: (statement_timeout в мс, одновременных запросов на
+# экземпляр). Чтение истории и отправка ограничены раздельно, поэтому опрос
+# новых сообщений не отнимает слоты у отправки.
+ENDPOINT_BUDGETS: Dict[str, Tuple[int, int]] = {
+    'read': (STATEMENT_TIMEOUT_MS, MAX_CONCURRENT_REQUESTS),
+    'send': (STATEMENT_TIMEOUT_MS, MAX_CONCURRENT_REQUESTS),
+}
+
+def endpoint_of(event: Dict[str, Any]) -> str:
+    '''Эндпоинт запроса для выбора бюджета'''
+    return 'read' if event.get('httpMethod') == 'GET' else 'send'
+
+# >>> shared/db_resilience.py (копия, правится в shared/ и переносится scripts/sync_shared_blocks.py)
+# Устойчивость к деградации БД. У каждого эндпоинта функции свой бюджет из
+# ENDPOINT_BUDGETS (функция определяет его вместе с endpoint_of):
+# statement_timeout его SQL-запросов и число одновременных запросов на
+# экземпляр. Запросы сверх предела эндпоинта отклоняются с 503 и
+# Retry-After; после BREAKER_FAILURE_THRESHOLD подряд сбоев соединения или
+# запроса автомат отключения отвечает 503 без обращения к БД и через
+# BREAKER_RESET_SECONDS пропускает один пробный запрос.
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get('BREAKER_FAILURE_THRESHOLD', '5'))
+BREAKER_RESET_SECONDS = float(os.environ.get('BREAKER_RESET_SECONDS', '10'))
+
+class CircuitBreaker:
+    '''Автомат отключения: closed -> open после серии сбоев -> half_open для пробы'''
+
+    def __init__(self, threshold: int, reset_seconds: float) -> None:
+        self.threshold = threshold
+        self.reset_seconds = reset_seconds
+        self.state = 'closed'
+        self.consecutive_failures = 0
+        self.failures_total = 0
+        self.opened_at = 0.0
+        self.trips = 0
+        self.lock = threading.Lock()
+
+    def allow(self) -> bool:
+        '''Разрешает запрос; в half_open пропускает только одну пробу'''
+        with self.lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and time.monotonic() - self.opened_at >= self.reset_seconds:
+                self.state = 'half_open'
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self.lock:
+            self.state = 'closed'
+            self.consecutive_failures = 0
+
+    def release_probe(self) -> None:
+        '''Возвращает в open пробу, не дошедшую до БД: следующий запрос пробует снова'''
+        with self.lock:
+            if self.state == 'half_open':
+                self.state = 'open'
+                self.opened_at = time.monotonic() - self.reset_seconds
+
+    def record_failure(self) -> None:
+        with self.lock:
+            self.failures_total += 1
+            self.consecutive_failures += 1
+            if self.state == 'half_open' or self.consecutive_failures >= self.threshold:
+                if self.state != 'open':
+                    self.trips += 1
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+
+    def retry_after(self) -> int:
+        return max(1, int(self.reset_seconds - (time.monotonic() - self.opened_at)) + 1)
+
+_breaker = CircuitBreaker(BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_SECONDS)
+_in_flight: Dict[str, threading.BoundedSemaphore] = {}
+_in_flight_lock = threading.Lock()
+_resilience_metrics = {'shed': 0, 'breaker_rejected': 0}
+_shed_by_endpoint: Dict[str, int] = {}
+# Дополнительные счётчики функции для ответа ?metrics=1
+_metrics_sources: Dict[str, Any] = {}
+
+# Исход текущего запроса для автомата: успехом считается только реальный
+# обмен с БД (подключение, COMMIT, откат начатой транзакции), а не ответ
+# из кэша или отказ в валидации до первого запроса
+_request_state = threading.local()
+
+def note_db_success() -> None:
+    '''Отмечает, что запрос успешно обменялся данными с БД'''
+    _request_state.db_ok = True
+
+_tracked_connection_class = None
+
+def tracked_connection_class():
+    '''Класс соединения psycopg2, который отмечает успешный COMMIT'''
+    global _tracked_connection_class
+    if _tracked_connection_class is None:
+        import psycopg2.extensions
+
+        class TrackedConnection(psycopg2.extensions.connection):
+            def commit(self) -> None:
+                super().commit()
+                note_db_success()
+
+        _tracked_connection_class = TrackedConnection
+    return _tracked_connection_class
+
+def endpoint_budget(endpoint: str) -> Tuple[int, int]:
+    '''(statement_timeout в мс, одновременных запросов) для эндпоинта'''
+    return ENDPOINT_BUDGETS.get(endpoint, (STATEMENT_TIMEOUT_MS, MAX_CONCURRENT_REQUESTS))
+
+def endpoint_semaphore(endpoint: str) -> threading.BoundedSemaphore:
+    '''Семафор параллельности эндпоинта, создаётся при первом запросе'''
+    with _in_flight_lock:
+        if endpoint not in _in_flight:
+            _in_flight[endpoint] = threading.BoundedSemaphore(endpoint_budget(endpoint)[1])
+        return _in_flight[endpoint]
+
+def apply_statement_timeout(conn) -> None:
+    '''Переключает statement_timeout сессии на бюджет эндпоинта текущего запроса'''
+    import psycopg2.extensions
+    timeout_ms = endpoint_budget(getattr(_request_state, 'endpoint', ''))[0]
+    if getattr(conn, 'statement_timeout_ms', STATEMENT_TIMEOUT_MS) == timeout_ms:
+        return
+    if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+        return
+    # SET вне транзакции запроса: COMMIT сохраняет значение в сессии, и
+    # запросы того же эндпоинта на тёплом соединении его не повторяют
+    cur = conn.cursor()
+    cur.execute('SET statement_timeout = %s', (timeout_ms,))
+    cur.close()
+    conn.commit()
+    conn.statement_timeout_ms = timeout_ms
+
+def unavailable(retry_after: int, reason: str) -> Dict[str, Any]:
+    '''Ответ 503 с подсказкой, когда повторить запрос'''
+    return {
+        'statusCode': 503,
+        'headers': {'Access-Control-Allow-Origin': '*', 'Retry-After': str(retry_after)},
+        'body': json.dumps({'error': reason})
+    }
+
+def record_db_failure(error: Exception) -> None:
+    '''Учитывает в автомате отключения сбои соединения и таймауты запросов'''
+    import psycopg2
+    if isinstance(error, (psycopg2.OperationalError, psycopg2.InterfaceError)):
+        _request_state.db_failed = True
+        _breaker.record_failure()
+
+def resilient(handler_func):
+    '''Оборачивает handler ограничением параллельности и автоматом отключения'''
+    def wrapper(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+        if event.get('httpMethod') == 'OPTIONS':
+            return handler_func(event, context)
+        
+        # Счётчики сброса нагрузки и срабатываний автомата: ?metrics=1
+        if (event.get('queryStringParameters') or {}).get('metrics') == '1':
+            return {
+                'statusCode': 200,
+                'headers': {'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({
+                    'shed': _resilience_metrics['shed'],
+                    'shed_by_endpoint': _shed_by_endpoint,
+                    'breaker_rejected': _resilience_metrics['breaker_rejected'],
+                    'breaker_trips': _breaker.trips,
+                    'breaker_state': _breaker.state,
+                    'db_failures': _breaker.failures_total,
+                    **_metrics_sources
+                })
+            }
+        
+        endpoint = endpoint_of(event)
+        in_flight = endpoint_semaphore(endpoint)
+        if not in_flight.acquire(blocking=False):
+            _resilience_metrics['shed'] += 1
+            _shed_by_endpoint[endpoint] = _shed_by_endpoint.get(endpoint, 0) + 1
+            return unavailable(1, 'Too many concurrent requests')
+        if not _breaker.allow():
+            in_flight.release()
+            _resilience_metrics['breaker_rejected'] += 1
+            return unavailable(_breaker.retry_after(), 'Database temporarily unavailable')
+        
+        _request_state.endpoint = endpoint
+        _request_state.db_ok = False
+        _request_state.db_failed = False
+        try:
+            return handler_func(event, context)
+        finally:
+            in_flight.release()
+            if _request_state.db_ok and not _request_state.db_failed:
+                _breaker.record_success()
+            elif not _request_state.db_failed:
+                _breaker.release_probe()
+    return wrapper
+# <<< shared/db_resilience.py
+
+@resilient
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
-    Business: Управление сообщениями в чатах поддержки - отправка, получение, жалобы
+    Business: Управление сообщениями в чатах поддержки - отправка, получение, жалобы, непрочитанные
     Args: event с httpMethod, queryStringParameters для GET, body для POST
     Returns: HTTP response с сообщениями или результатом операции
     '''
@@ -18,7 +745,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Auth-Token',
+                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Auth-Token, Idempotency-Key',
                 'Access-Control-Max-Age': '86400'
             },
             'body': ''
@@ -34,17 +761,73 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'body': json.dumps({'error': 'Database connection error'})
             }
         
-        conn = psycopg2.connect(DATABASE_URL)
-        cur = conn.cursor()
-        
+        query_params = event.get('queryStringParameters') or {}
+        ticket_id = query_params.get('ticket_id')
+        read_ticket_ids = [ticket_id] + [item.partition(':')[0] for item in query_params.get('tickets', '').split(',')]
         headers = event.get('headers', {})
         user_id = headers.get('X-User-Id')
         
+        # История читается с реплики, если клиент не просит свежих данных
+        # (fresh=1) и в заявки недавно не писали через этот экземпляр;
+        # счётчики непрочитанного - если они недавно не менялись здесь
+        if query_params.get('action') == 'unread':
+            recent_write = has_recent_user_write(user_id)
+        else:
+            recent_write = any(map(has_recent_ticket_write, read_ticket_ids))
+        if method == 'GET' and not query_params.get('fresh') and not recent_write:
+            conn = get_read_connection(DATABASE_URL)
+        else:
+            conn = get_connection(DATABASE_URL)
+        cur = conn.cursor()
+        
         if method == 'GET':
-            # Получение сообщений для конкретной заявки
-            query_params = event.get('queryStringParameters') or {}
-            ticket_id = query_params.get('ticket_id')
+            # Счётчики непрочитанных сообщений пользователя для бейджей
+            if query_params.get('action') == 'unread':
+                if not user_id:
+                    return {
+                        'statusCode': 401,
+                        'headers': {'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'User ID required'})
+                    }
+                
+                execute_prepared(cur, 'unread_by_user', (user_id,))
+                unread = {str(row[0]): row[1] for row in cur.fetchall()}
+                
+                return {
+                    'statusCode': 200,
+                    'headers': {'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'unread': unread, 'total': sum(unread.values())})
+                }
             
+            # Новые сообщения сразу нескольких заявок (панель модератора)
+            if query_params.get('tickets'):
+                if not user_id:
+                    return {
+                        'statusCode': 401,
+                        'headers': {'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'User ID required'})
+                    }
+                
+                cursors = parse_ticket_cursors(query_params['tickets'])
+                if not cursors or len(cursors) > BATCH_MAX_TICKETS:
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': f'Expected up to {BATCH_MAX_TICKETS} tickets as id[:after_id]'})
+                    }
+                
+                try:
+                    limit = min(max(int(query_params.get('limit', BATCH_DEFAULT_LIMIT)), 1), BATCH_MAX_LIMIT)
+                except ValueError:
+                    limit = BATCH_DEFAULT_LIMIT
+                
+                return {
+                    'statusCode': 200,
+                    'headers': {'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps(fetch_messages_batch(cur, user_id, cursors, limit))
+                }
+            
+            # Получение сообщений для конкретной заявки
             if not ticket_id:
                 return {
                     'statusCode': 400,
@@ -52,16 +835,8 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'body': json.dumps({'error': 'Ticket ID required'})
                 }
             
-            # Получаем сообщения с информацией об отправителях
-            cur.execute("""
-                SELECT m.id, m.content, m.message_type, m.attachment_url, 
-                       m.created_at, m.edited_at, m.is_flagged,
-                       u.username, u.role, u.station, u.avatar_url
-                FROM messages m
-                JOIN users u ON m.sender_id = u.id
-                WHERE m.ticket_id = %s
-                ORDER BY m.created_at ASC
-            """, (ticket_id,))
+            # Получаем сообщения; отправители приходят один раз в словаре senders
+            execute_prepared(cur, 'messages_by_ticket', (ticket_id,))
             
             messages = []
             for row in cur.fetchall():
@@ -73,18 +848,18 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'created_at': row[4].isoformat() if row[4] else None,
                     'edited_at': row[5].isoformat() if row[5] else None,
                     'is_flagged': row[6],
-                    'sender': {
-                        'username': row[7],
-                        'role': row[8],
-                        'station': row[9],
-                        'avatar_url': row[10]
-                    }
+                    'sender_id': row[7]
                 })
             
+            senders = get_sender_profiles(cur, {message['sender_id'] for message in messages})
+            
             return {
                 'statusCode': 200,
                 'headers': {'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'messages': messages})
+                'body': json.dumps({
+                    'messages': messages,
+                    'senders': {str(sender_id): profile for sender_id, profile in senders.items()}
+                })
             }
             
         elif method == 'POST':
@@ -103,15 +878,34 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 # Отправка сообщения
                 ticket_id = body_data.get('ticket_id')
                 content = body_data.get('content', '').strip()
-                message_type = body_data.get('message_type', 'text')
+                # Вложение загружается заранее через функцию attachments,
+                # сюда приходит только ссылка на него
+                attachment_url = (body_data.get('attachment_url') or '').strip() or None
+                message_type = body_data.get('message_type', 'file' if attachment_url else 'text')
                 
-                if not ticket_id or not content:
+                if not ticket_id or not (content or attachment_url):
                     return {
                         'statusCode': 400,
                         'headers': {'Access-Control-Allow-Origin': '*'},
                         'body': json.dumps({'error': 'Ticket ID and content required'})
                     }
                 
+                if message_type not in ('text', 'image', 'file') or (message_type == 'text') != (attachment_url is None):
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Attachment URL required for image and file messages'})
+                    }
+                
+                # Принимаются только вложения, загруженные через attachments
+                attachment_hash = parse_attachment_hash(attachment_url) if attachment_url else None
+                if attachment_url and attachment_hash is None:
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Attachment URL must point to an uploaded attachment'})
+                    }
+                
                 if len(content) > 1000:
                     return {
                         'statusCode': 400,
@@ -119,25 +913,43 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         'body': json.dumps({'error': 'Message too long (max 1000 characters)'})
                     }
                 
+                if attachment_hash:
+                    execute_prepared(cur, 'attachment_exists', (attachment_hash,))
+                    if cur.fetchone() is None:
+                        return {
+                            'statusCode': 400,
+                            'headers': {'Access-Control-Allow-Origin': '*'},
+                            'body': json.dumps({'error': 'Attachment not found'})
+                        }
+                    attachment_url = f'{ATTACHMENTS_PUBLIC_URL}?hash={attachment_hash}'
+                
+                # Повтор запроса с тем же Idempotency-Key возвращает первый ответ
+                idempotency_key = get_idempotency_key(headers)
+                if idempotency_key:
+                    replay = resolve_idempotency_key(cur, user_id, 'send_message', idempotency_key)
+                    if replay is not None:
+                        return replay
+                
+                # Сообщения с запрещёнными фразами сразу помечаются для модераторов
+                flag_reason = screen_content(content) if content else None
+                
                 # Вставляем сообщение
-                cur.execute("""
-                    INSERT INTO messages (ticket_id, sender_id, content, message_type)
-                    VALUES (%s, %s, %s, %s)
-                    RETURNING id, created_at
-                """, (ticket_id, user_id, content, message_type))
+                execute_prepared(cur, 'message_insert', (
+                    ticket_id, user_id, content, message_type, attachment_url, flag_reason is not None, flag_reason
+                ))
                 
                 message_id, created_at = cur.fetchone()
                 
-                # Обновляем время последнего обновления заявки
-                cur.execute("""
-                    UPDATE support_tickets 
-                    SET updated_at = CURRENT_TIMESTAMP 
-                    WHERE id = %s
-                """, (ticket_id,))
+                # Обновляем время последнего обновления заявки; кэш списка
+                # заявок владельца в tickets устаревает по версии
+                execute_prepared(cur, 'ticket_touch', (ticket_id,))
+                execute_prepared(cur, 'list_version_bump', (ticket_id,))
                 
-                conn.commit()
+                # Непрочитанное у владельца заявки и назначенного модератора
+                execute_prepared(cur, 'unread_increment', (ticket_id, user_id))
+                unread_user_ids = [row[0] for row in cur.fetchall()]
                 
-                return {
+                response = {
                     'statusCode': 201,
                     'headers': {'Access-Control-Allow-Origin': '*'},
                     'body': json.dumps({
@@ -145,10 +957,97 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         'message': {
                             'id': message_id,
                             'content': content,
+                            'message_type': message_type,
+                            'attachment_url': attachment_url,
+                            'is_flagged': flag_reason is not None,
                             'created_at': created_at.isoformat()
                         }
                     })
                 }
+                store_idempotent_response(cur, user_id, 'send_message', idempotency_key, response)
+                conn.commit()
+                mark_ticket_write(ticket_id)
+                for unread_user_id in unread_user_ids:
+                    mark_user_write(unread_user_id)
+                
+                return response
+                
+            elif action == 'mark_read':
+                # Отметка о прочтении заявки до сообщения message_id (по умолчанию до последнего)
+                ticket_id = body_data.get('ticket_id')
+                message_id = body_data.get('message_id')
+                
+                if not ticket_id or (message_id is not None and not str(message_id).isdigit()):
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Ticket ID required'})
+                    }
+                
+                # Счётчики непрочитанного ведутся только у участников заявки
+                cur.execute(
+                    "SELECT user_id = %s OR assigned_moderator_id = %s FROM support_tickets WHERE id = %s",
+                    (user_id, user_id, ticket_id)
+                )
+                ticket_row = cur.fetchone()
+                if not ticket_row:
+                    return {
+                        'statusCode': 404,
+                        'headers': {'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Ticket not found'})
+                    }
+                if not ticket_row[0]:
+                    return {
+                        'statusCode': 403,
+                        'headers': {'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Not a participant of this ticket'})
+                    }
+                
+                # Строка блокируется до пересчёта, чтобы параллельная отправка
+                # сообщения прибавила непрочитанное уже к новому значению
+                cur.execute("""
+                    INSERT INTO ticket_read_state (user_id, ticket_id)
+                    VALUES (%s, %s)
+                    ON CONFLICT (user_id, ticket_id) DO NOTHING
+                """, (user_id, ticket_id))
+                cur.execute("""
+                    SELECT last_read_message_id
+                    FROM ticket_read_state
+                    WHERE user_id = %s AND ticket_id = %s
+                    FOR UPDATE
+                """, (user_id, ticket_id))
+                last_read_message_id = cur.fetchone()[0]
+                
+                if message_id is None:
+                    cur.execute("SELECT COALESCE(MAX(id), 0) FROM messages_all WHERE ticket_id = %s", (ticket_id,))
+                    message_id = cur.fetchone()[0]
+                # Отметка не сдвигается назад
+                last_read_message_id = max(last_read_message_id, int(message_id))
+                
+                cur.execute("""
+                    SELECT COUNT(*)
+                    FROM messages_all
+                    WHERE ticket_id = %s AND id > %s AND sender_id <> %s
+                """, (ticket_id, last_read_message_id, user_id))
+                unread_count = cur.fetchone()[0]
+                
+                cur.execute("""
+                    UPDATE ticket_read_state
+                    SET last_read_message_id = %s, unread_count = %s, updated_at = CURRENT_TIMESTAMP
+                    WHERE user_id = %s AND ticket_id = %s
+                """, (last_read_message_id, unread_count, user_id, ticket_id))
+                conn.commit()
+                mark_user_write(user_id)
+                
+                return {
+                    'statusCode': 200,
+                    'headers': {'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({
+                        'success': True,
+                        'last_read_message_id': last_read_message_id,
+                        'unread_count': unread_count
+                    })
+                }
                 
             elif action == 'report_message':
                 # Подача жалобы на сообщение
@@ -210,6 +1109,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     """, (reported_user_id,))
                 
                 conn.commit()
+                invalidate_sender(reported_user_id)
                 
                 return {
                     'statusCode': 201,
@@ -243,6 +1143,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'body': json.dumps({'error': 'Invalid JSON format'})
         }
     except Exception as e:
+        record_db_failure(e)
         return {
             'statusCode': 500,
             'headers': {'Access-Control-Allow-Origin': '*'},
@@ -250,4 +1151,4 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         }
     finally:
         if 'conn' in locals():
-            conn.close()
\ No newline at end of file
+            release_connection(conn)
@@ -1,8 +1,719 @@
 import json
 import os
-import psycopg2
-from typing import Dict, Any
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple
 
+# >>> shared/db_connection.py (копия, правится в shared/ и переносится scripts/sync_shared_blocks.py)
+# Соединения живут в модуле и переиспользуются тёплыми вызовами функции.
+# psycopg2 импортируется только при первом запросе, которому нужна БД,
+# поэтому CORS preflight и холодный старт не платят за загрузку драйвера.
+_conn = None
+
+# Чтения без требований к свежести функция берёт через get_read_connection:
+# они уходят на реплику (REPLICA_DATABASE_URL), пока её отставание не
+# превышает REPLICA_MAX_LAG_SECONDS. Отставание проверяется не чаще раза в
+# REPLICA_LAG_CHECK_INTERVAL секунд.
+REPLICA_MAX_LAG_SECONDS = float(os.environ.get('REPLICA_MAX_LAG_SECONDS', '5'))
+REPLICA_LAG_CHECK_INTERVAL = 2.0
+_replica_conn = None
+_replica_checked_at = 0.0
+_replica_usable = False
+
+def get_connection(database_url: str):
+    '''Возвращает открытое соединение с основной БД, подключаясь только при необходимости'''
+    global _conn
+    if _conn is None or _conn.closed:
+        import psycopg2
+        _conn = psycopg2.connect(database_url, connect_timeout=3,
+                                 options=f'-c statement_timeout={STATEMENT_TIMEOUT_MS}',
+                                 connection_factory=tracked_connection_class())
+        note_db_success()
+    apply_statement_timeout(_conn)
+    return _conn
+
+def get_read_connection(database_url: str):
+    '''Возвращает соединение для чтения: реплику, если она успевает за основной БД'''
+    global _replica_conn, _replica_checked_at, _replica_usable
+    replica_url = os.environ.get('REPLICA_DATABASE_URL')
+    if not replica_url:
+        return get_connection(database_url)
+    
+    now = time.monotonic()
+    if now - _replica_checked_at >= REPLICA_LAG_CHECK_INTERVAL:
+        _replica_checked_at = now
+        try:
+            if _replica_conn is None or _replica_conn.closed:
+                import psycopg2
+                _replica_conn = psycopg2.connect(replica_url, connect_timeout=2,
+                                                 options=f'-c statement_timeout={STATEMENT_TIMEOUT_MS}',
+                                                 connection_factory=tracked_connection_class())
+            cur = _replica_conn.cursor()
+            # Простаивающая основная БД не двигает replay timestamp, поэтому
+            # полностью проигранный WAL считается нулевым отставанием
+            cur.execute("""
+                SELECT CASE
+                    WHEN NOT pg_is_in_recovery() THEN 0
+                    WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                    ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+                END
+            """)
+            lag = float(cur.fetchone()[0])
+            _replica_conn.rollback()
+            _replica_usable = lag <= REPLICA_MAX_LAG_SECONDS
+        except Exception:
+            _replica_usable = False
+            if _replica_conn is not None:
+                _replica_conn.close()
+                _replica_conn = None
+    
+    if _replica_usable and _replica_conn is not None:
+        apply_statement_timeout(_replica_conn)
+        return _replica_conn
+    return get_connection(database_url)
+
+def release_connection(conn) -> None:
+    '''Завершает транзакцию запроса, оставляя соединение открытым для следующего вызова'''
+    global _conn, _replica_conn
+    try:
+        import psycopg2.extensions
+        in_transaction = conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE
+        conn.rollback()
+        if in_transaction:
+            note_db_success()
+    except Exception:
+        conn.close()
+        if conn is _conn:
+            _conn = None
+        if conn is _replica_conn:
+            _replica_conn = None
+# <<< shared/db_connection.py
+
+# Время последней записи в этом экземпляре: пока реплика может её не видеть,
+# чтения идут в основную БД (read-your-writes)
+_last_write_at = 0.0
+
+def mark_write() -> None:
+    '''Запоминает момент записи для маршрутизации последующих чтений'''
+    global _last_write_at
+    _last_write_at = time.monotonic()
+
+def has_recent_write() -> bool:
+    '''Проверяет, могла ли реплика ещё не получить последнюю запись'''
+    return time.monotonic() - _last_write_at <= REPLICA_MAX_LAG_SECONDS
+
+# Реестр запросов горячих путей. Каждый запрос готовится один раз на
+# соединение через PREPARE и дальше выполняется по имени через EXECUTE,
+# поэтому Postgres не разбирает и не планирует его на каждом вызове.
+STATEMENTS = {
+    'tickets_list_all': """
+        SELECT t.id, t.title, t.status, t.priority, t.category, t.created_at, t.updated_at,
+               u.username, u.email, u.station, u.avatar_url,
+               COUNT(m.id) as message_count,
+               MAX(m.created_at) as last_message_at
+        FROM support_tickets t
+        JOIN users u ON t.user_id = u.id
+        LEFT JOIN messages_all m ON t.id = m.ticket_id
+        GROUP BY t.id, u.username, u.email, u.station, u.avatar_url
+        ORDER BY t.updated_at DESC
+    """,
+    'tickets_list_by_user': """
+        SELECT t.id, t.title, t.status, t.priority, t.category, t.created_at, t.updated_at,
+               u.username, u.email, u.station, u.avatar_url,
+               COUNT(m.id) as message_count,
+               MAX(m.created_at) as last_message_at
+        FROM support_tickets t
+        JOIN users u ON t.user_id = u.id
+        LEFT JOIN messages_all m ON t.id = m.ticket_id
+        WHERE t.user_id = $1
+        GROUP BY t.id, u.username, u.email, u.station, u.avatar_url
+        ORDER BY t.updated_at DESC
+    """,
+    'ticket_insert': """
+        INSERT INTO support_tickets (title, user_id, category, priority)
+        VALUES ($1, $2, $3, $4)
+        RETURNING id, created_at
+    """,
+    'ticket_update_status': """
+        UPDATE support_tickets t
+        SET status = $1, assigned_moderator_id = COALESCE($2, t.assigned_moderator_id), updated_at = CURRENT_TIMESTAMP,
+            closed_at = CASE WHEN $1 = 'closed' AND prev.status <> 'closed' THEN CURRENT_TIMESTAMP ELSE t.closed_at END
+        FROM (SELECT id, status FROM support_tickets WHERE id = $3 FOR UPDATE) prev
+        WHERE t.id = prev.id
+        RETURNING prev.status, t.assigned_moderator_id
+    """,
+    'list_version': """
+        SELECT version FROM ticket_list_versions WHERE user_id = $1
+    """,
+    'list_version_bump': """
+        INSERT INTO ticket_list_versions (user_id, version)
+        SELECT user_id, 1 FROM support_tickets WHERE id = $1
+        ON CONFLICT (user_id) DO UPDATE
+        SET version = ticket_list_versions.version + 1, updated_at = CURRENT_TIMESTAMP
+        RETURNING user_id, version
+    """,
+    'moderator_touch': """
+        UPDATE moderator_stats SET last_active = CURRENT_TIMESTAMP WHERE moderator_id = $1
+    """,
+    'moderator_close_credit': """
+        INSERT INTO moderator_stats (moderator_id, total_tickets_closed) VALUES ($1, 1)
+        ON CONFLICT (moderator_id) DO UPDATE
+        SET total_tickets_closed = COALESCE(moderator_stats.total_tickets_closed, 0) + 1,
+            updated_at = CURRENT_TIMESTAMP
+    """,
+}
+
+# Поиск по темам и сообщениям: совпадения сообщений агрегируются до
+# заявки, совпадение в теме весит вдвое больше лучшего сообщения.
+# $1 - запрос, $2/$3 - LIMIT/OFFSET, $4 - сколько совпавших сообщений
+# брать из индекса, $5 - владелец заявок (только в поиске пользователя).
+# Предел применяется до ts_rank: ранжируются первые $4 совпадений из GIN,
+# а не все сообщения с частым словом. total и total_capped считаются
+# отдельно от страницы, поэтому приходят и для страницы за концом выдачи
+# (одна строка с пустыми полями заявки).
+SEARCH_STATEMENT = """
+    WITH query AS (
+        SELECT websearch_to_tsquery('russian', $1) AS q
+    ),
+    message_matches AS (
+        SELECT m.ticket_id, m.search_vector
+        FROM messages_all m, query
+        WHERE m.search_vector @@ query.q{message_scope}
+        LIMIT $4
+    ),
+    message_hits AS (
+        SELECT mm.ticket_id, COUNT(*) AS hits, MAX(ts_rank(mm.search_vector, query.q)) AS rank
+        FROM message_matches mm, query
+        GROUP BY mm.ticket_id
+    ),
+    ticket_hits AS (
+        SELECT t.id AS ticket_id, ts_rank(t.search_vector, query.q) AS rank
+        FROM support_tickets t, query
+        WHERE t.search_vector @@ query.q{ticket_scope}
+    ),
+    ranked AS (
+        SELECT COALESCE(th.ticket_id, mh.ticket_id) AS ticket_id,
+               COALESCE(th.rank, 0) * 2 + COALESCE(mh.rank, 0) AS rank,
+               COALESCE(mh.hits, 0) AS message_hits
+        FROM ticket_hits th
+        FULL JOIN message_hits mh ON mh.ticket_id = th.ticket_id
+    ),
+    totals AS (
+        SELECT COUNT(*) AS total,
+               (SELECT COUNT(*) FROM message_matches) >= $4 AS total_capped
+        FROM ranked
+    )
+    SELECT page.id, page.title, page.status, page.priority, page.category, page.created_at, page.updated_at,
+           page.username, page.email, page.station, page.avatar_url,
+           page.rank, page.message_hits, totals.total, totals.total_capped
+    FROM totals
+    LEFT JOIN (
+        SELECT t.id, t.title, t.status, t.priority, t.category, t.created_at, t.updated_at,
+               u.username, u.email, u.station, u.avatar_url,
+               r.rank, r.message_hits
+        FROM ranked r
+        JOIN support_tickets t ON t.id = r.ticket_id
+        JOIN users u ON t.user_id = u.id
+        ORDER BY r.rank DESC, t.updated_at DESC
+        LIMIT $2 OFFSET $3
+    ) page ON TRUE
+    ORDER BY page.rank DESC, page.updated_at DESC
+"""
+# Область поиска подставляется в текст запроса, а не условием "$5 IS NULL
+# OR ...": с ним общий план подготовленного запроса теряет индексы
+STATEMENTS['tickets_search_all'] = SEARCH_STATEMENT.format(message_scope='', ticket_scope='')
+STATEMENTS['tickets_search_by_user'] = SEARCH_STATEMENT.format(
+    message_scope='\n          AND m.ticket_id IN (SELECT id FROM support_tickets WHERE user_id = $5)',
+    ticket_scope='\n          AND t.user_id = $5'
+)
+
+# >>> shared/prepared_statements.py (копия, правится в shared/ и переносится scripts/sync_shared_blocks.py)
+# Запросы берутся из реестра STATEMENTS, который функция определяет до
+# этого блока. Имена уже подготовленных запросов по соединениям:
+# id(conn) -> (conn, {name})
+_prepared: Dict[int, Any] = {}
+
+def execute_prepared(cur, name: str, params: tuple = ()) -> None:
+    '''Выполняет запрос из STATEMENTS, подготавливая его на соединении при первом обращении'''
+    import psycopg2.errors
+    import psycopg2.extensions
+    conn = cur.connection
+    entry = _prepared.get(id(conn))
+    if entry is None or entry[0] is not conn:
+        entry = (conn, set())
+        _prepared[id(conn)] = entry
+    names = entry[1]
+    
+    # Повтор после сброса безопасен, только если запрос открывает транзакцию
+    starts_transaction = conn.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_IDLE
+    placeholders = ' (' + ', '.join(['%s'] * len(params)) + ')' if params else ''
+    
+    for attempt in range(2):
+        try:
+            if name not in names:
+                cur.execute(f'PREPARE {name} AS {STATEMENTS[name]}')
+                names.add(name)
+            cur.execute(f'EXECUTE {name}{placeholders}', params)
+            return
+        except (psycopg2.errors.FeatureNotSupported, psycopg2.errors.InvalidSqlStatementName):
+            # Схема изменилась ("cached plan must not change result type")
+            # или подготовленный запрос пропал: сбрасываем реестр соединения
+            conn.rollback()
+            cur.execute('DEALLOCATE ALL')
+            names.clear()
+            if attempt or not starts_transaction:
+                raise
+# <<< shared/prepared_statements.py
+
+# Кэш отрисованного списка заявок пользователя, действительный для версии;
+# версия в ticket_list_versions растёт при создании заявки, смене статуса и
+# новом сообщении. Известная версия считается актуальной TICKETS_CACHE_VERSION_TTL
+# секунд: в это время повторный просмотр не обращается к БД, потом версия
+# сверяется одним запросом по ключу. Записи через этот экземпляр обновляют
+# версию сразу. Если задан TICKETS_CACHE_DIR, списки дополнительно хранятся в
+# SQLite и доступны другим процессам на той же машине.
+TICKETS_CACHE_SIZE = int(os.environ.get('TICKETS_CACHE_SIZE', '1000'))
+TICKETS_CACHE_VERSION_TTL = float(os.environ.get('TICKETS_CACHE_VERSION_TTL', '2'))
+# Предел жизни записи: в списке есть профиль владельца, который меняется без версии
+TICKETS_CACHE_MAX_AGE = float(os.environ.get('TICKETS_CACHE_MAX_AGE', '300'))
+TICKETS_CACHE_DIR = os.environ.get('TICKETS_CACHE_DIR', '')
+_list_cache: 'OrderedDict[str, Tuple[float, int, str]]' = OrderedDict()
+_list_versions: 'OrderedDict[str, Tuple[float, int]]' = OrderedDict()
+_list_cache_metrics = {'hits': 0, 'revalidated_hits': 0, 'shared_hits': 0, 'misses': 0}
+_shared_list_cache = None
+_shared_list_cache_writes = 0
+
+def get_shared_list_cache():
+    '''SQLite-хранилище списков в TICKETS_CACHE_DIR или None, если оно не задано или недоступно'''
+    global _shared_list_cache
+    if _shared_list_cache is None:
+        _shared_list_cache = False
+        if TICKETS_CACHE_DIR:
+            try:
+                import sqlite3
+                os.makedirs(TICKETS_CACHE_DIR, exist_ok=True)
+                db = sqlite3.connect(os.path.join(TICKETS_CACHE_DIR, 'ticket_lists.sqlite3'),
+                                     timeout=0.05, isolation_level=None, check_same_thread=False)
+                db.execute('PRAGMA journal_mode=WAL')
+                db.execute("""
+                    CREATE TABLE IF NOT EXISTS ticket_lists (
+                        user_id TEXT PRIMARY KEY, version INTEGER NOT NULL,
+                        stored_at REAL NOT NULL, body TEXT NOT NULL
+                    )
+                """)
+                _shared_list_cache = db
+            except Exception:
+                pass
+    return _shared_list_cache or None
+
+def remember_list_version(user_id: Any, version: int) -> None:
+    '''Запоминает версию списка, не откатывая известную назад; известных версий не больше TICKETS_CACHE_SIZE'''
+    known = _list_versions.get(str(user_id))
+    _list_versions[str(user_id)] = (time.monotonic(), max(version, known[1]) if known else version)
+    _list_versions.move_to_end(str(user_id))
+    while len(_list_versions) > TICKETS_CACHE_SIZE:
+        _list_versions.popitem(last=False)
+
+def load_list_version(cur, user_id: Any, authoritative: bool = False) -> Optional[int]:
+    '''Текущая версия списка пользователя из БД; None, если реплика отстала от известной версии'''
+    execute_prepared(cur, 'list_version', (user_id,))
+    row = cur.fetchone()
+    version = row[0] if row else 0
+    known = _list_versions.get(str(user_id))
+    if known and version < known[1] and not authoritative:
+        return None
+    remember_list_version(user_id, version)
+    return version
+
+def get_cached_ticket_list(user_id: str, version: Optional[int] = None) -> Optional[str]:
+    '''Тело ответа со списком для версии; без версии - только если известная версия свежая'''
+    now = time.monotonic()
+    revalidated = version is not None
+    if version is None:
+        known = _list_versions.get(user_id)
+        if not known or now - known[0] >= TICKETS_CACHE_VERSION_TTL:
+            return None
+        version = known[1]
+    
+    cached = _list_cache.get(user_id)
+    if cached and cached[1] == version and now - cached[0] < TICKETS_CACHE_MAX_AGE:
+        _list_cache.move_to_end(user_id)
+        _list_cache_metrics['revalidated_hits' if revalidated else 'hits'] += 1
+        return cached[2]
+    
+    shared = get_shared_list_cache()
+    if shared:
+        try:
+            row = shared.execute(
+                'SELECT body FROM ticket_lists WHERE user_id = ? AND version = ? AND stored_at > ?',
+                (user_id, version, time.time() - TICKETS_CACHE_MAX_AGE)
+            ).fetchone()
+        except Exception:
+            row = None
+        if row:
+            _list_cache[user_id] = (now, version, row[0])
+            _list_cache.move_to_end(user_id)
+            _list_cache_metrics['shared_hits'] += 1
+            _list_cache_metrics['revalidated_hits' if revalidated else 'hits'] += 1
+            return row[0]
+    
+    if revalidated:
+        _list_cache_metrics['misses'] += 1
+    return None
+
+def store_ticket_list(user_id: str, version: int, body: str) -> None:
+    '''Кладёт список в кэш процесса и в общее хранилище вместо прежней версии'''
+    global _shared_list_cache_writes
+    _list_cache[user_id] = (time.monotonic(), version, body)
+    _list_cache.move_to_end(user_id)
+    while len(_list_cache) > TICKETS_CACHE_SIZE:
+        _list_cache.popitem(last=False)
+    
+    shared = get_shared_list_cache()
+    if shared:
+        try:
+            shared.execute(
+                'INSERT OR REPLACE INTO ticket_lists (user_id, version, stored_at, body) VALUES (?, ?, ?, ?)',
+                (user_id, version, time.time(), body)
+            )
+            _shared_list_cache_writes += 1
+            if _shared_list_cache_writes % 100 == 0:
+                shared.execute('DELETE FROM ticket_lists WHERE stored_at < ?', (time.time() - TICKETS_CACHE_MAX_AGE,))
+        except Exception:
+            pass
+
+SEARCH_PAGE_SIZE = 20
+SEARCH_MAX_PAGE_SIZE = 100
+# Ограничение числа совпавших сообщений держит ранжирование и группировку
+# по частым словам в пределах бюджета времени на больших объёмах. В предел
+# попадают первые найденные индексом сообщения, а не лучшие по рангу; если
+# он достигнут, total считает только заявки этих сообщений и ответ
+# помечается total_capped
+SEARCH_MAX_MESSAGE_HITS = 5000
+
+def search_tickets(cur, search_text: str, owner_id: Any, page: int, page_size: int) -> Dict[str, Any]:
+    '''Ищет заявки по теме и сообщениям, возвращает страницу с рангом и числом совпадений'''
+    params = (search_text, page_size, (page - 1) * page_size, SEARCH_MAX_MESSAGE_HITS)
+    if owner_id is None:
+        execute_prepared(cur, 'tickets_search_all', params)
+    else:
+        execute_prepared(cur, 'tickets_search_by_user', params + (owner_id,))
+    
+    tickets = []
+    total = 0
+    total_capped = False
+    for row in cur.fetchall():
+        total = row[13]
+        total_capped = row[14]
+        if row[0] is None:
+            continue
+        tickets.append({
+            'id': row[0],
+            'title': row[1],
+            'status': row[2],
+            'priority': row[3],
+            'category': row[4],
+            'created_at': row[5].isoformat() if row[5] else None,
+            'updated_at': row[6].isoformat() if row[6] else None,
+            'user': {
+                'username': row[7],
+                'email': row[8],
+                'station': row[9],
+                'avatar_url': row[10]
+            },
+            'rank': float(row[11]),
+            'message_hits': row[12]
+        })
+    
+    return {
+        'statusCode': 200,
+        'headers': {'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({
+            'tickets': tickets,
+            'total': total,
+            'total_capped': total_capped,
+            'page': page,
+            'page_size': page_size
+        })
+    }
+
+# >>> shared/idempotency.py (копия, правится в shared/ и переносится scripts/sync_shared_blocks.py)
+# Повторы POST с тем же заголовком Idempotency-Key получают сохранённый ответ
+# и не доходят до вставки. Ключи живут IDEMPOTENCY_TTL_HOURS часов.
+IDEMPOTENCY_TTL_HOURS = int(os.environ.get('IDEMPOTENCY_TTL_HOURS', '24'))
+IDEMPOTENCY_KEY_MAX_LENGTH = 100
+
+# Запросы таблицы idempotency_keys добавляются в реестр функции
+STATEMENTS.update({
+    'idempotency_lookup': """
+        SELECT status_code, response_body
+        FROM idempotency_keys
+        WHERE user_id = $1 AND scope = $2 AND idempotency_key = $3
+          AND status_code IS NOT NULL AND created_at > NOW() - make_interval(hours => $4)
+    """,
+    'idempotency_claim': """
+        INSERT INTO idempotency_keys (user_id, scope, idempotency_key)
+        VALUES ($1, $2, $3)
+        ON CONFLICT (user_id, scope, idempotency_key) DO UPDATE
+        SET status_code = NULL, response_body = NULL, created_at = NOW()
+        WHERE idempotency_keys.created_at <= NOW() - make_interval(hours => $4)
+    """,
+    'idempotency_store': """
+        UPDATE idempotency_keys
+        SET status_code = $4, response_body = $5
+        WHERE user_id = $1 AND scope = $2 AND idempotency_key = $3
+    """,
+})
+
+def get_idempotency_key(headers: Dict[str, Any]) -> Optional[str]:
+    '''Достаёт Idempotency-Key из заголовков запроса'''
+    key = headers.get('Idempotency-Key') or headers.get('idempotency-key')
+    return key.strip()[:IDEMPOTENCY_KEY_MAX_LENGTH] if key and key.strip() else None
+
+def find_idempotent_response(cur, user_id: Any, scope: str, key: str) -> Optional[Dict[str, Any]]:
+    '''Возвращает сохранённый ответ на запрос с этим ключом, если он есть'''
+    execute_prepared(cur, 'idempotency_lookup', (user_id, scope, key, IDEMPOTENCY_TTL_HOURS))
+    row = cur.fetchone()
+    if not row:
+        return None
+    return {
+        'statusCode': row[0],
+        'headers': {'Access-Control-Allow-Origin': '*', 'Idempotent-Replayed': 'true'},
+        'body': row[1]
+    }
+
+def claim_idempotency_key(cur, user_id: Any, scope: str, key: str) -> bool:
+    '''Занимает ключ в текущей транзакции; параллельный повтор ждёт её завершения'''
+    execute_prepared(cur, 'idempotency_claim', (user_id, scope, key, IDEMPOTENCY_TTL_HOURS))
+    return cur.rowcount == 1
+
+def resolve_idempotency_key(cur, user_id: Any, scope: str, key: str) -> Optional[Dict[str, Any]]:
+    '''Возвращает готовый ответ для повтора или None, если запрос нужно выполнить'''
+    stored = find_idempotent_response(cur, user_id, scope, key)
+    if stored is not None or claim_idempotency_key(cur, user_id, scope, key):
+        return stored
+    # Ключ занял параллельный запрос, который уже зафиксировал свой ответ
+    stored = find_idempotent_response(cur, user_id, scope, key)
+    if stored is not None:
+        return stored
+    return {
+        'statusCode': 409,
+        'headers': {'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({'error': 'Request with this Idempotency-Key is already in progress'})
+    }
+
+def store_idempotent_response(cur, user_id: Any, scope: str, key: Optional[str], response: Dict[str, Any]) -> None:
+    '''Сохраняет ответ под ключом в той же транзакции, что и запись'''
+    if key:
+        execute_prepared(cur, 'idempotency_store', (user_id, scope, key, response['statusCode'], response['body']))
+# <<< shared/idempotency.py
+
+# Пределы по умолчанию для эндпоинтов, не указанных в ENDPOINT_BUDGETS
+STATEMENT_TIMEOUT_MS = int(os.environ.get('STATEMENT_TIMEOUT_MS', '5000'))
+MAX_CONCURRENT_REQUESTS = int(os.environ.get('MAX_CONCURRENT_REQUESTS', '10'))
+
+# Бюджеты эндпоинтов: (statement_timeout в мс, одновременных запросов на
+# экземпляр). Полнотекстовый поиск получает отдельный узкий пул и длинный
+# таймаут, поэтому всплеск поиска не занимает слоты списка и записи.
+ENDPOINT_BUDGETS: Dict[str, Tuple[int, int]] = {
+    'search': (STATEMENT_TIMEOUT_MS, max(1, MAX_CONCURRENT_REQUESTS // 2)),
+    'list': (min(STATEMENT_TIMEOUT_MS, 2000), MAX_CONCURRENT_REQUESTS),
+    'write': (min(STATEMENT_TIMEOUT_MS, 3000), MAX_CONCURRENT_REQUESTS),
+}
+
+def endpoint_of(event: Dict[str, Any]) -> str:
+    '''Эндпоинт запроса для выбора бюджета'''
+    if event.get('httpMethod') != 'GET':
+        return 'write'
+    if ((event.get('queryStringParameters') or {}).get('q') or '').strip():
+        return 'search'
+    return 'list'
+
+# >>> shared/db_resilience.py (копия, правится в shared/ и переносится scripts/sync_shared_blocks.py)
+# Устойчивость к деградации БД. У каждого эндпоинта функции свой бюджет из
+# ENDPOINT_BUDGETS (функция определяет его вместе с endpoint_of):
+# statement_timeout его SQL-запросов и число одновременных запросов на
+# экземпляр. Запросы сверх предела эндпоинта отклоняются с 503 и
+# Retry-After; после BREAKER_FAILURE_THRESHOLD подряд сбоев соединения или
+# запроса автомат отключения отвечает 503 без обращения к БД и через
+# BREAKER_RESET_SECONDS пропускает один пробный запрос.
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get('BREAKER_FAILURE_THRESHOLD', '5'))
+BREAKER_RESET_SECONDS = float(os.environ.get('BREAKER_RESET_SECONDS', '10'))
+
+class CircuitBreaker:
+    '''Автомат отключения: closed -> open после серии сбоев -> half_open для пробы'''
+
+    def __init__(self, threshold: int, reset_seconds: float) -> None:
+        self.threshold = threshold
+        self.reset_seconds = reset_seconds
+        self.state = 'closed'
+        self.consecutive_failures = 0
+        self.failures_total = 0
+        self.opened_at = 0.0
+        self.trips = 0
+        self.lock = threading.Lock()
+
+    def allow(self) -> bool:
+        '''Разрешает запрос; в half_open пропускает только одну пробу'''
+        with self.lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and time.monotonic() - self.opened_at >= self.reset_seconds:
+                self.state = 'half_open'
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self.lock:
+            self.state = 'closed'
+            self.consecutive_failures = 0
+
+    def release_probe(self) -> None:
+        '''Возвращает в open пробу, не дошедшую до БД: следующий запрос пробует снова'''
+        with self.lock:
+            if self.state == 'half_open':
+                self.state = 'open'
+                self.opened_at = time.monotonic() - self.reset_seconds
+
+    def record_failure(self) -> None:
+        with self.lock:
+            self.failures_total += 1
+            self.consecutive_failures += 1
+            if self.state == 'half_open' or self.consecutive_failures >= self.threshold:
+                if self.state != 'open':
+                    self.trips += 1
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+
+    def retry_after(self) -> int:
+        return max(1, int(self.reset_seconds - (time.monotonic() - self.opened_at)) + 1)
+
+_breaker = CircuitBreaker(BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_SECONDS)
+_in_flight: Dict[str, threading.BoundedSemaphore] = {}
+_in_flight_lock = threading.Lock()
+_resilience_metrics = {'shed': 0, 'breaker_rejected': 0}
+_shed_by_endpoint: Dict[str, int] = {}
+# Дополнительные счётчики функции для ответа ?metrics=1
+_metrics_sources: Dict[str, Any] = {}
+
+# Исход текущего запроса для автомата: успехом считается только реальный
+# обмен с БД (подключение, COMMIT, откат начатой транзакции), а не ответ
+# из кэша или отказ в валидации до первого запроса
+_request_state = threading.local()
+
+def note_db_success() -> None:
+    '''Отмечает, что запрос успешно обменялся данными с БД'''
+    _request_state.db_ok = True
+
+_tracked_connection_class = None
+
+def tracked_connection_class():
+    '''Класс соединения psycopg2, который отмечает успешный COMMIT'''
+    global _tracked_connection_class
+    if _tracked_connection_class is None:
+        import psycopg2.extensions
+
+        class TrackedConnection(psycopg2.extensions.connection):
+            def commit(self) -> None:
+                super().commit()
+                note_db_success()
+
+        _tracked_connection_class = TrackedConnection
+    return _tracked_connection_class
+
+def endpoint_budget(endpoint: str) -> Tuple[int, int]:
+    '''(statement_timeout в мс, одновременных запросов) для эндпоинта'''
+    return ENDPOINT_BUDGETS.get(endpoint, (STATEMENT_TIMEOUT_MS, MAX_CONCURRENT_REQUESTS))
+
+def endpoint_semaphore(endpoint: str) -> threading.BoundedSemaphore:
+    '''Семафор параллельности эндпоинта, создаётся при первом запросе'''
+    with _in_flight_lock:
+        if endpoint not in _in_flight:
+            _in_flight[endpoint] = threading.BoundedSemaphore(endpoint_budget(endpoint)[1])
+        return _in_flight[endpoint]
+
+def apply_statement_timeout(conn) -> None:
+    '''Переключает statement_timeout сессии на бюджет эндпоинта текущего запроса'''
+    import psycopg2.extensions
+    timeout_ms = endpoint_budget(getattr(_request_state, 'endpoint', ''))[0]
+    if getattr(conn, 'statement_timeout_ms', STATEMENT_TIMEOUT_MS) == timeout_ms:
+        return
+    if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+        return
+    # SET вне транзакции запроса: COMMIT сохраняет значение в сессии, и
+    # запросы того же эндпоинта на тёплом соединении его не повторяют
+    cur = conn.cursor()
+    cur.execute('SET statement_timeout = %s', (timeout_ms,))
+    cur.close()
+    conn.commit()
+    conn.statement_timeout_ms = timeout_ms
+
+def unavailable(retry_after: int, reason: str) -> Dict[str, Any]:
+    '''Ответ 503 с подсказкой, когда повторить запрос'''
+    return {
+        'statusCode': 503,
+        'headers': {'Access-Control-Allow-Origin': '*', 'Retry-After': str(retry_after)},
+        'body': json.dumps({'error': reason})
+    }
+
+def record_db_failure(error: Exception) -> None:
+    '''Учитывает в автомате отключения сбои соединения и таймауты запросов'''
+    import psycopg2
+    if isinstance(error, (psycopg2.OperationalError, psycopg2.InterfaceError)):
+        _request_state.db_failed = True
+        _breaker.record_failure()
+
+def resilient(handler_func):
+    '''Оборачивает handler ограничением параллельности и автоматом отключения'''
+    def wrapper(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+        if event.get('httpMethod') == 'OPTIONS':
+            return handler_func(event, context)
+        
+        # Счётчики сброса нагрузки и срабатываний автомата: ?metrics=1
+        if (event.get('queryStringParameters') or {}).get('metrics') == '1':
+            return {
+                'statusCode': 200,
+                'headers': {'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({
+                    'shed': _resilience_metrics['shed'],
+                    'shed_by_endpoint': _shed_by_endpoint,
+                    'breaker_rejected': _resilience_metrics['breaker_rejected'],
+                    'breaker_trips': _breaker.trips,
+                    'breaker_state': _breaker.state,
+                    'db_failures': _breaker.failures_total,
+                    **_metrics_sources
+                })
+            }
+        
+        endpoint = endpoint_of(event)
+        in_flight = endpoint_semaphore(endpoint)
+        if not in_flight.acquire(blocking=False):
+            _resilience_metrics['shed'] += 1
+            _shed_by_endpoint[endpoint] = _shed_by_endpoint.get(endpoint, 0) + 1
+            return unavailable(1, 'Too many concurrent requests')
+        if not _breaker.allow():
+            in_flight.release()
+            _resilience_metrics['breaker_rejected'] += 1
+            return unavailable(_breaker.retry_after(), 'Database temporarily unavailable')
+        
+        _request_state.endpoint = endpoint
+        _request_state.db_ok = False
+        _request_state.db_failed = False
+        try:
+            return handler_func(event, context)
+        finally:
+            in_flight.release()
+            if _request_state.db_ok and not _request_state.db_failed:
+                _breaker.record_success()
+            elif not _request_state.db_failed:
+                _breaker.release_probe()
+    return wrapper
+# <<< shared/db_resilience.py
+
+_metrics_sources['ticket_list_cache'] = _list_cache_metrics
+
+@resilient
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
     Business: Управление заявками поддержки - получение, создание, обновление статуса
@@ -18,7 +729,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, POST, PUT, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Auth-Token',
+                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Auth-Token, Idempotency-Key',
                 'Access-Control-Max-Age': '86400'
             },
             'body': ''
@@ -34,30 +745,63 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'body': json.dumps({'error': 'Database connection error'})
             }
         
-        conn = psycopg2.connect(DATABASE_URL)
-        cur = conn.cursor()
-        
+        query_params = event.get('queryStringParameters') or {}
         headers = event.get('headers', {})
         user_id = headers.get('X-User-Id')
         
+        # Собственный список пользователя кэшируется по версии; повторный
+        # просмотр при свежей известной версии отдаётся без обращения к БД
+        cacheable_list = (
+            method == 'GET' and bool(user_id) and query_params.get('role', 'user') != 'moderator'
+            and not (query_params.get('q') or '').strip()
+        )
+        if cacheable_list and not query_params.get('fresh'):
+            cached_body = get_cached_ticket_list(user_id)
+            if cached_body is not None:
+                return {
+                    'statusCode': 200,
+                    'headers': {'Access-Control-Allow-Origin': '*'},
+                    'body': cached_body
+                }
+        
+        # Список заявок можно читать с реплики, если клиент не просит свежих
+        # данных (fresh=1) и этот экземпляр недавно ничего не записывал
+        if method == 'GET' and not query_params.get('fresh') and not has_recent_write():
+            conn = get_read_connection(DATABASE_URL)
+        else:
+            conn = get_connection(DATABASE_URL)
+        cur = conn.cursor()
+        
         if method == 'GET':
             # Получение списка заявок
-            query_params = event.get('queryStringParameters') or {}
             user_role = query_params.get('role', 'user')
+            search_text = (query_params.get('q') or '').strip()
+            
+            if search_text:
+                # Поиск: модераторы ищут по всем заявкам, пользователи - по своим
+                if user_role != 'moderator' and not user_id:
+                    return {
+                        'statusCode': 401,
+                        'headers': {'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'User ID required'})
+                    }
+                
+                try:
+                    page = max(1, int(query_params.get('page', 1)))
+                    page_size = min(SEARCH_MAX_PAGE_SIZE, max(1, int(query_params.get('page_size', SEARCH_PAGE_SIZE))))
+                except ValueError:
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Invalid pagination parameters'})
+                    }
+                
+                owner_id = None if user_role == 'moderator' else user_id
+                return search_tickets(cur, search_text, owner_id, page, page_size)
             
             if user_role == 'moderator':
                 # Модераторы видят все заявки
-                cur.execute("""
-                    SELECT t.id, t.title, t.status, t.priority, t.category, t.created_at, t.updated_at,
-                           u.username, u.email, u.station, u.avatar_url,
-                           COUNT(m.id) as message_count,
-                           MAX(m.created_at) as last_message_at
-                    FROM support_tickets t
-                    JOIN users u ON t.user_id = u.id
-                    LEFT JOIN messages m ON t.id = m.ticket_id
-                    GROUP BY t.id, u.username, u.email, u.station, u.avatar_url
-                    ORDER BY t.updated_at DESC
-                """)
+                execute_prepared(cur, 'tickets_list_all')
             else:
                 # Пользователи видят только свои заявки
                 if not user_id:
@@ -67,18 +811,24 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         'body': json.dumps({'error': 'User ID required'})
                     }
                 
-                cur.execute("""
-                    SELECT t.id, t.title, t.status, t.priority, t.category, t.created_at, t.updated_at,
-                           u.username, u.email, u.station, u.avatar_url,
-                           COUNT(m.id) as message_count,
-                           MAX(m.created_at) as last_message_at
-                    FROM support_tickets t
-                    JOIN users u ON t.user_id = u.id
-                    LEFT JOIN messages m ON t.id = m.ticket_id
-                    WHERE t.user_id = %s
-                    GROUP BY t.id, u.username, u.email, u.station, u.avatar_url
-                    ORDER BY t.updated_at DESC
-                """, (user_id,))
+                # Версия читается до списка: запись между ними только поднимет версию
+                list_version = load_list_version(cur, user_id)
+                if list_version is None:
+                    # Реплика не видит уже известную запись: список с неё был
+                    # бы старым, поэтому версия и список читаются из основной БД
+                    release_connection(conn)
+                    conn = get_connection(DATABASE_URL)
+                    cur = conn.cursor()
+                    list_version = load_list_version(cur, user_id, authoritative=True)
+                cached_body = get_cached_ticket_list(user_id, list_version)
+                if cached_body is not None:
+                    return {
+                        'statusCode': 200,
+                        'headers': {'Access-Control-Allow-Origin': '*'},
+                        'body': cached_body
+                    }
+                
+                execute_prepared(cur, 'tickets_list_by_user', (user_id,))
             
             tickets = []
             for row in cur.fetchall():
@@ -100,10 +850,14 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'last_message_at': row[12].isoformat() if row[12] else None
                 })
             
+            body = json.dumps({'tickets': tickets})
+            if cacheable_list:
+                store_ticket_list(user_id, list_version, body)
+            
             return {
                 'statusCode': 200,
                 'headers': {'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'tickets': tickets})
+                'body': body
             }
             
         elif method == 'POST':
@@ -128,16 +882,17 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'body': json.dumps({'error': 'Title is required'})
                 }
             
-            cur.execute("""
-                INSERT INTO support_tickets (title, user_id, category, priority)
-                VALUES (%s, %s, %s, %s)
-                RETURNING id, created_at
-            """, (title, user_id, category, priority))
+            # Повтор запроса с тем же Idempotency-Key возвращает первый ответ
+            idempotency_key = get_idempotency_key(headers)
+            if idempotency_key:
+                replay = resolve_idempotency_key(cur, user_id, 'create_ticket', idempotency_key)
+                if replay is not None:
+                    return replay
             
-            ticket_id, created_at = cur.fetchone()
-            conn.commit()
+            execute_prepared(cur, 'ticket_insert', (title, user_id, category, priority))
             
-            return {
+            ticket_id, created_at = cur.fetchone()
+            response = {
                 'statusCode': 201,
                 'headers': {'Access-Control-Allow-Origin': '*'},
                 'body': json.dumps({
@@ -152,6 +907,14 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     }
                 })
             }
+            execute_prepared(cur, 'list_version_bump', (ticket_id,))
+            list_owner, list_version = cur.fetchone()
+            store_idempotent_response(cur, user_id, 'create_ticket', idempotency_key, response)
+            conn.commit()
+            mark_write()
+            remember_list_version(list_owner, list_version)
+            
+            return response
             
         elif method == 'PUT':
             # Обновление статуса заявки (только для модераторов)
@@ -168,13 +931,22 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 }
             
             # Обновляем статус и назначаем модератора
-            cur.execute("""
-                UPDATE support_tickets 
-                SET status = %s, assigned_moderator_id = %s, updated_at = CURRENT_TIMESTAMP
-                WHERE id = %s
-            """, (new_status, moderator_id, ticket_id))
+            execute_prepared(cur, 'ticket_update_status', (new_status, moderator_id, ticket_id))
+            status_row = cur.fetchone()
+            # Закрытие засчитывается модератору заявки один раз, при переходе в closed;
+            # автоматически закрытые заявки в статистику модераторов не попадают
+            if status_row and new_status == 'closed' and status_row[0] != 'closed' and status_row[1]:
+                execute_prepared(cur, 'moderator_close_credit', (status_row[1],))
+            # Активность модератора учитывается автоматическим назначением заявок
+            if moderator_id:
+                execute_prepared(cur, 'moderator_touch', (moderator_id,))
+            execute_prepared(cur, 'list_version_bump', (ticket_id,))
+            list_row = cur.fetchone()
             
             conn.commit()
+            mark_write()
+            if list_row:
+                remember_list_version(*list_row)
             
             return {
                 'statusCode': 200,
@@ -196,6 +968,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'body': json.dumps({'error': 'Invalid JSON format'})
         }
     except Exception as e:
+        record_db_failure(e)
         return {
             'statusCode': 500,
             'headers': {'Access-Control-Allow-Origin': '*'},
@@ -203,4 +976,4 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         }
     finally:
         if 'conn' in locals():
-            conn.close()
\ No newline at end of file
+            release_connection(conn)
@@ -0,0 +1,12 @@
+-- Полнотекстовый поиск по темам заявок и сообщениям (русская морфология)
+ALTER TABLE t_p7304060_coldfire_authenticat.support_tickets
+ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS (to_tsvector('russian', COALESCE(title, ''))) STORED;
+
+ALTER TABLE t_p7304060_coldfire_authenticat.messages
+ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS (to_tsvector('russian', COALESCE(content, ''))) STORED;
+
+-- GIN индексы для оператора @@
+CREATE INDEX IF NOT EXISTS idx_tickets_search ON t_p7304060_coldfire_authenticat.support_tickets USING GIN (search_vector);
+CREATE INDEX IF NOT EXISTS idx_messages_search ON t_p7304060_coldfire_authenticat.messages USING GIN (search_vector);
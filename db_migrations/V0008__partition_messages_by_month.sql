@@ -0,0 +1,127 @@
+-- Перевод messages на помесячное партиционирование по created_at.
+-- Первичный ключ партиционированной таблицы обязан включать ключ
+-- партиционирования, поэтому внешний ключ reports.message_id снимается.
+ALTER TABLE t_p7304060_coldfire_authenticat.reports DROP CONSTRAINT IF EXISTS reports_message_id_fkey;
+
+ALTER TABLE t_p7304060_coldfire_authenticat.messages RENAME TO messages_legacy;
+ALTER TABLE t_p7304060_coldfire_authenticat.messages_legacy RENAME CONSTRAINT messages_pkey TO messages_legacy_pkey;
+ALTER SEQUENCE t_p7304060_coldfire_authenticat.messages_id_seq OWNED BY NONE;
+
+CREATE TABLE t_p7304060_coldfire_authenticat.messages (
+    id INTEGER NOT NULL DEFAULT nextval('t_p7304060_coldfire_authenticat.messages_id_seq'),
+    ticket_id INTEGER REFERENCES t_p7304060_coldfire_authenticat.support_tickets(id),
+    sender_id INTEGER REFERENCES t_p7304060_coldfire_authenticat.users(id),
+    content TEXT NOT NULL,
+    message_type VARCHAR(20) DEFAULT 'text' CHECK (message_type IN ('text', 'image', 'file')),
+    attachment_url TEXT,
+    is_flagged BOOLEAN DEFAULT FALSE,
+    flag_reason TEXT,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    edited_at TIMESTAMP,
+    search_vector tsvector GENERATED ALWAYS AS (to_tsvector('russian', COALESCE(content, ''))) STORED,
+    CONSTRAINT message_length CHECK (LENGTH(content) <= 1000),
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+
+ALTER SEQUENCE t_p7304060_coldfire_authenticat.messages_id_seq OWNED BY t_p7304060_coldfire_authenticat.messages.id;
+
+-- Создаёт партицию messages_YYYY_MM для месяца, если её ещё нет
+CREATE OR REPLACE FUNCTION t_p7304060_coldfire_authenticat.ensure_messages_partition(month_start DATE)
+RETURNS TEXT AS $$
+DECLARE
+    start_date DATE := date_trunc('month', month_start)::date;
+    partition_name TEXT := 'messages_' || to_char(start_date, 'YYYY_MM');
+BEGIN
+    IF to_regclass('t_p7304060_coldfire_authenticat.' || partition_name) IS NULL THEN
+        EXECUTE format(
+            'CREATE TABLE t_p7304060_coldfire_authenticat.%I PARTITION OF t_p7304060_coldfire_authenticat.messages FOR VALUES FROM (%L) TO (%L)',
+            partition_name, start_date, (start_date + INTERVAL '1 month')::date
+        );
+    END IF;
+    RETURN partition_name;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Удаляет пустые партиции старше keep_months месяцев (сообщения закрытых
+-- заявок к этому времени уже перенесены в messages_archive)
+CREATE OR REPLACE FUNCTION t_p7304060_coldfire_authenticat.drop_empty_messages_partitions(keep_months INTEGER)
+RETURNS INTEGER AS $$
+DECLARE
+    part RECORD;
+    has_rows BOOLEAN;
+    dropped INTEGER := 0;
+    cutoff TEXT := 'messages_' || to_char(date_trunc('month', NOW()) - make_interval(months => keep_months), 'YYYY_MM');
+BEGIN
+    FOR part IN
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 't_p7304060_coldfire_authenticat.messages'::regclass
+          AND c.relname ~ '^messages_[0-9]{4}_[0-9]{2}$'
+          AND c.relname < cutoff
+    LOOP
+        EXECUTE format('SELECT EXISTS (SELECT 1 FROM t_p7304060_coldfire_authenticat.%I)', part.relname) INTO has_rows;
+        IF NOT has_rows THEN
+            EXECUTE format('ALTER TABLE t_p7304060_coldfire_authenticat.messages DETACH PARTITION t_p7304060_coldfire_authenticat.%I', part.relname);
+            EXECUTE format('DROP TABLE t_p7304060_coldfire_authenticat.%I', part.relname);
+            dropped := dropped + 1;
+        END IF;
+    END LOOP;
+    RETURN dropped;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Партиции для всей истории и двух месяцев вперёд, плюс страховочная DEFAULT
+DO $$
+DECLARE
+    month_start DATE;
+BEGIN
+    month_start := date_trunc('month', COALESCE(
+        (SELECT MIN(created_at) FROM t_p7304060_coldfire_authenticat.messages_legacy), NOW()
+    ))::date;
+    WHILE month_start <= (date_trunc('month', NOW()) + INTERVAL '2 months')::date LOOP
+        PERFORM t_p7304060_coldfire_authenticat.ensure_messages_partition(month_start);
+        month_start := (month_start + INTERVAL '1 month')::date;
+    END LOOP;
+END $$;
+
+CREATE TABLE IF NOT EXISTS t_p7304060_coldfire_authenticat.messages_default
+    PARTITION OF t_p7304060_coldfire_authenticat.messages DEFAULT;
+
+INSERT INTO t_p7304060_coldfire_authenticat.messages
+(id, ticket_id, sender_id, content, message_type, attachment_url, is_flagged, flag_reason, created_at, edited_at)
+SELECT id, ticket_id, sender_id, content, message_type, attachment_url, is_flagged, flag_reason,
+       COALESCE(created_at, NOW()), edited_at
+FROM t_p7304060_coldfire_authenticat.messages_legacy;
+
+DROP TABLE t_p7304060_coldfire_authenticat.messages_legacy;
+
+CREATE INDEX IF NOT EXISTS idx_messages_ticket_created ON t_p7304060_coldfire_authenticat.messages(ticket_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_messages_sender_id ON t_p7304060_coldfire_authenticat.messages(sender_id);
+CREATE INDEX IF NOT EXISTS idx_messages_search ON t_p7304060_coldfire_authenticat.messages USING GIN (search_vector);
+
+-- Холодное хранилище истории давно закрытых заявок
+CREATE TABLE IF NOT EXISTS t_p7304060_coldfire_authenticat.messages_archive (
+    id INTEGER PRIMARY KEY,
+    ticket_id INTEGER REFERENCES t_p7304060_coldfire_authenticat.support_tickets(id),
+    sender_id INTEGER REFERENCES t_p7304060_coldfire_authenticat.users(id),
+    content TEXT NOT NULL,
+    message_type VARCHAR(20),
+    attachment_url TEXT,
+    is_flagged BOOLEAN DEFAULT FALSE,
+    flag_reason TEXT,
+    created_at TIMESTAMP NOT NULL,
+    edited_at TIMESTAMP,
+    archived_at TIMESTAMP DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_messages_archive_ticket ON t_p7304060_coldfire_authenticat.messages_archive(ticket_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_tickets_status_closed_at ON t_p7304060_coldfire_authenticat.support_tickets(status, closed_at);
+
+-- Единое чтение горячей и архивной истории
+CREATE OR REPLACE VIEW t_p7304060_coldfire_authenticat.messages_all AS
+SELECT id, ticket_id, sender_id, content, message_type, attachment_url, is_flagged, flag_reason, created_at, edited_at
+FROM t_p7304060_coldfire_authenticat.messages
+UNION ALL
+SELECT id, ticket_id, sender_id, content, message_type, attachment_url, is_flagged, flag_reason, created_at, edited_at
+FROM t_p7304060_coldfire_authenticat.messages_archive;
@@ -0,0 +1,34 @@
+-- Дневные агрегаты по заявкам: день x модератор x категория.
+-- moderator_id = 0 означает «без модератора» (например, открытие заявки).
+CREATE TABLE IF NOT EXISTS t_p7304060_coldfire_authenticat.daily_ticket_rollups (
+    day DATE NOT NULL,
+    moderator_id INTEGER NOT NULL DEFAULT 0,
+    category VARCHAR(50) NOT NULL DEFAULT 'general',
+    opened INTEGER NOT NULL DEFAULT 0,
+    closed INTEGER NOT NULL DEFAULT 0,
+    first_response_count INTEGER NOT NULL DEFAULT 0,
+    first_response_seconds_sum BIGINT NOT NULL DEFAULT 0,
+    rating_count INTEGER NOT NULL DEFAULT 0,
+    rating_sum INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT NOW(),
+    PRIMARY KEY (day, moderator_id, category)
+);
+
+CREATE INDEX IF NOT EXISTS idx_daily_rollups_moderator_day ON t_p7304060_coldfire_authenticat.daily_ticket_rollups(moderator_id, day);
+
+-- Водяные знаки фоновых задач: с какого момента пересчитывать данные
+CREATE TABLE IF NOT EXISTS t_p7304060_coldfire_authenticat.job_watermarks (
+    job_name VARCHAR(50) PRIMARY KEY,
+    watermark TIMESTAMP NOT NULL,
+    updated_at TIMESTAMP DEFAULT NOW()
+);
+
+-- Первый запуск пересчитывает всю историю
+INSERT INTO t_p7304060_coldfire_authenticat.job_watermarks (job_name, watermark)
+VALUES ('daily_ticket_rollups', '1970-01-01')
+ON CONFLICT (job_name) DO NOTHING;
+
+-- Индексы для инкрементальных диапазонных выборок по времени событий
+CREATE INDEX IF NOT EXISTS idx_tickets_created_at ON t_p7304060_coldfire_authenticat.support_tickets(created_at);
+CREATE INDEX IF NOT EXISTS idx_tickets_closed_at ON t_p7304060_coldfire_authenticat.support_tickets(closed_at);
+CREATE INDEX IF NOT EXISTS idx_moderator_ratings_created_at ON t_p7304060_coldfire_authenticat.moderator_ratings(created_at);
@@ -0,0 +1,50 @@
+-- Соответствие id из импортируемых дампов и id в системе. Запись попадает
+-- сюда в той же транзакции, что и сама строка, поэтому повторный запуск
+-- импорта пропускает уже перенесённые данные.
+CREATE TABLE IF NOT EXISTS t_p7304060_coldfire_authenticat.import_id_map (
+    entity VARCHAR(20) NOT NULL CHECK (entity IN ('user', 'ticket', 'message')),
+    legacy_id BIGINT NOT NULL,
+    new_id INTEGER NOT NULL,
+    imported_at TIMESTAMP DEFAULT NOW(),
+    PRIMARY KEY (entity, legacy_id)
+);
+
+-- Промежуточные таблицы для COPY: без WAL, содержимое пересобирается при каждом
+-- запуске. Дубли legacy_id в дампе не ломают COPY и отсекаются при переносе.
+CREATE UNLOGGED TABLE IF NOT EXISTS t_p7304060_coldfire_authenticat.import_users (
+    legacy_id BIGINT NOT NULL,
+    username VARCHAR(50) NOT NULL,
+    email VARCHAR(100) NOT NULL,
+    password_hash VARCHAR(255),
+    role VARCHAR(20) NOT NULL,
+    station VARCHAR(100),
+    avatar_url TEXT,
+    created_at TIMESTAMP
+);
+
+CREATE UNLOGGED TABLE IF NOT EXISTS t_p7304060_coldfire_authenticat.import_tickets (
+    legacy_id BIGINT NOT NULL,
+    legacy_user_id BIGINT NOT NULL,
+    legacy_moderator_id BIGINT,
+    title VARCHAR(200) NOT NULL,
+    status VARCHAR(20) NOT NULL,
+    priority VARCHAR(20) NOT NULL,
+    category VARCHAR(50) NOT NULL,
+    created_at TIMESTAMP,
+    updated_at TIMESTAMP,
+    closed_at TIMESTAMP
+);
+
+CREATE UNLOGGED TABLE IF NOT EXISTS t_p7304060_coldfire_authenticat.import_messages (
+    legacy_id BIGINT NOT NULL,
+    legacy_ticket_id BIGINT NOT NULL,
+    legacy_sender_id BIGINT NOT NULL,
+    content TEXT NOT NULL,
+    message_type VARCHAR(20) NOT NULL,
+    attachment_url TEXT,
+    created_at TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_import_users_legacy ON t_p7304060_coldfire_authenticat.import_users(legacy_id);
+CREATE INDEX IF NOT EXISTS idx_import_tickets_legacy ON t_p7304060_coldfire_authenticat.import_tickets(legacy_id);
+CREATE INDEX IF NOT EXISTS idx_import_messages_legacy ON t_p7304060_coldfire_authenticat.import_messages(legacy_id);
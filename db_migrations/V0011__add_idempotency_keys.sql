@@ -0,0 +1,14 @@
+-- Сохранённые ответы на POST с заголовком Idempotency-Key. Ключ занимается
+-- в той же транзакции, что и запись, поэтому из параллельных повторов
+-- вставку выполняет ровно один запрос.
+CREATE TABLE IF NOT EXISTS t_p7304060_coldfire_authenticat.idempotency_keys (
+    user_id INTEGER NOT NULL,
+    scope VARCHAR(30) NOT NULL,
+    idempotency_key VARCHAR(100) NOT NULL,
+    status_code INTEGER,
+    response_body TEXT,
+    created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (user_id, scope, idempotency_key)
+);
+
+CREATE INDEX IF NOT EXISTS idx_idempotency_keys_created_at ON t_p7304060_coldfire_authenticat.idempotency_keys(created_at);
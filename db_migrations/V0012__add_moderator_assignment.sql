@@ -0,0 +1,16 @@
+-- Экспертиза модераторов по категориям заявок для автоматического назначения.
+-- weight > 1 - модератор предпочтителен для категории, < 1 - нежелателен.
+CREATE TABLE IF NOT EXISTS t_p7304060_coldfire_authenticat.moderator_expertise (
+    moderator_id INTEGER NOT NULL REFERENCES t_p7304060_coldfire_authenticat.users(id),
+    category VARCHAR(50) NOT NULL,
+    weight REAL NOT NULL DEFAULT 1.0 CHECK (weight > 0),
+    PRIMARY KEY (moderator_id, category)
+);
+
+-- Очередь неназначенных заявок для выборки пачками
+CREATE INDEX IF NOT EXISTS idx_tickets_unassigned_open ON t_p7304060_coldfire_authenticat.support_tickets(created_at)
+    WHERE assigned_moderator_id IS NULL AND status = 'open';
+
+-- Текущая нагрузка модераторов
+CREATE INDEX IF NOT EXISTS idx_tickets_assigned_active ON t_p7304060_coldfire_authenticat.support_tickets(assigned_moderator_id)
+    WHERE status IN ('open', 'in_progress');
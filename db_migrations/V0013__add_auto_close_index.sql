@@ -0,0 +1,3 @@
+-- Поиск давно неактивных открытых заявок для автоматического закрытия
+CREATE INDEX IF NOT EXISTS idx_tickets_active_updated_at ON t_p7304060_coldfire_authenticat.support_tickets(updated_at)
+    WHERE status IN ('open', 'in_progress');
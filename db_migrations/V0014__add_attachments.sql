@@ -0,0 +1,12 @@
+-- Вложения сообщений: один файл в хранилище на одинаковое содержимое.
+-- Ключ объекта в хранилище вычисляется из content_hash (SHA-256).
+CREATE TABLE IF NOT EXISTS t_p7304060_coldfire_authenticat.attachments (
+    id SERIAL PRIMARY KEY,
+    content_hash CHAR(64) UNIQUE NOT NULL,
+    size_bytes BIGINT NOT NULL,
+    mime_type VARCHAR(100) NOT NULL,
+    original_name VARCHAR(255),
+    uploaded_by INTEGER REFERENCES t_p7304060_coldfire_authenticat.users(id),
+    upload_count INTEGER NOT NULL DEFAULT 1,
+    created_at TIMESTAMP DEFAULT NOW()
+);
@@ -0,0 +1,15 @@
+-- Отметки о прочтении и счётчики непрочитанных сообщений по заявкам.
+-- unread_count увеличивается при каждом новом сообщении для владельца заявки
+-- и назначенного модератора (кроме отправителя) и обнуляется отметкой о прочтении.
+CREATE TABLE IF NOT EXISTS t_p7304060_coldfire_authenticat.ticket_read_state (
+    user_id INTEGER NOT NULL,
+    ticket_id INTEGER NOT NULL,
+    last_read_message_id BIGINT NOT NULL DEFAULT 0,
+    unread_count INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (user_id, ticket_id)
+);
+
+-- Бейджи читают только заявки с непрочитанными сообщениями
+CREATE INDEX IF NOT EXISTS idx_ticket_read_state_unread ON t_p7304060_coldfire_authenticat.ticket_read_state(user_id)
+    WHERE unread_count > 0;
@@ -0,0 +1,3 @@
+-- Выборка новых сообщений нескольких заявок после курсора по id
+CREATE INDEX IF NOT EXISTS idx_messages_ticket_id_id ON t_p7304060_coldfire_authenticat.messages(ticket_id, id);
+CREATE INDEX IF NOT EXISTS idx_messages_archive_ticket_id_id ON t_p7304060_coldfire_authenticat.messages_archive(ticket_id, id);
@@ -0,0 +1,7 @@
+-- Версия списка заявок пользователя для кэша в функции tickets. Растёт при
+-- создании заявки, смене её статуса и новом сообщении в ней.
+CREATE TABLE IF NOT EXISTS t_p7304060_coldfire_authenticat.ticket_list_versions (
+    user_id INTEGER PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
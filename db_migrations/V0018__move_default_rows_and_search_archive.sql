@@ -0,0 +1,74 @@
+-- Партиция месяца, строки которого уже попали в messages_default, не может
+-- быть создана через PARTITION OF: Postgres отказывает, пока в DEFAULT есть
+-- строки её диапазона, и задача partitions падала бы на каждом запуске.
+-- Такие строки переносятся в новую таблицу, которая затем подключается
+-- как партиция, всё в одной транзакции.
+CREATE OR REPLACE FUNCTION t_p7304060_coldfire_authenticat.ensure_messages_partition(month_start DATE)
+RETURNS TEXT AS $$
+DECLARE
+    start_date DATE := date_trunc('month', month_start)::date;
+    end_date DATE := (date_trunc('month', month_start) + INTERVAL '1 month')::date;
+    partition_name TEXT := 'messages_' || to_char(start_date, 'YYYY_MM');
+    has_default_rows BOOLEAN := FALSE;
+    column_list TEXT;
+BEGIN
+    IF to_regclass('t_p7304060_coldfire_authenticat.' || partition_name) IS NOT NULL THEN
+        RETURN partition_name;
+    END IF;
+
+    IF to_regclass('t_p7304060_coldfire_authenticat.messages_default') IS NOT NULL THEN
+        SELECT EXISTS (
+            SELECT 1 FROM t_p7304060_coldfire_authenticat.messages_default
+            WHERE created_at >= start_date AND created_at < end_date
+        ) INTO has_default_rows;
+    END IF;
+
+    IF NOT has_default_rows THEN
+        EXECUTE format(
+            'CREATE TABLE t_p7304060_coldfire_authenticat.%I PARTITION OF t_p7304060_coldfire_authenticat.messages FOR VALUES FROM (%L) TO (%L)',
+            partition_name, start_date, end_date
+        );
+        RETURN partition_name;
+    END IF;
+
+    -- Генерируемые столбцы (search_vector) пересчитываются при вставке
+    SELECT string_agg(quote_ident(attname), ', ' ORDER BY attnum) INTO column_list
+    FROM pg_attribute
+    WHERE attrelid = 't_p7304060_coldfire_authenticat.messages'::regclass
+      AND attnum > 0 AND NOT attisdropped AND attgenerated = '';
+
+    EXECUTE format(
+        'CREATE TABLE t_p7304060_coldfire_authenticat.%I (LIKE t_p7304060_coldfire_authenticat.messages INCLUDING DEFAULTS INCLUDING CONSTRAINTS INCLUDING GENERATED)',
+        partition_name
+    );
+    EXECUTE format(
+        'WITH moved AS (DELETE FROM t_p7304060_coldfire_authenticat.messages_default WHERE created_at >= %L AND created_at < %L RETURNING %s) '
+        'INSERT INTO t_p7304060_coldfire_authenticat.%I (%s) SELECT %s FROM moved',
+        start_date, end_date, column_list, partition_name, column_list, column_list
+    );
+    -- Индексы и внешние ключи родителя создаются на партиции при подключении
+    EXECUTE format(
+        'ALTER TABLE t_p7304060_coldfire_authenticat.messages ATTACH PARTITION t_p7304060_coldfire_authenticat.%I FOR VALUES FROM (%L) TO (%L)',
+        partition_name, start_date, end_date
+    );
+    RETURN partition_name;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Полнотекстовый поиск по архивной истории. Добавление хранимого
+-- генерируемого столбца переписывает messages_archive целиком.
+ALTER TABLE t_p7304060_coldfire_authenticat.messages_archive
+ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS (to_tsvector('russian', COALESCE(content, ''))) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_messages_archive_search ON t_p7304060_coldfire_authenticat.messages_archive USING GIN (search_vector);
+
+-- search_vector в представлении: поиск заявок читает горячую и архивную историю
+CREATE OR REPLACE VIEW t_p7304060_coldfire_authenticat.messages_all AS
+SELECT id, ticket_id, sender_id, content, message_type, attachment_url, is_flagged, flag_reason, created_at, edited_at,
+       search_vector
+FROM t_p7304060_coldfire_authenticat.messages
+UNION ALL
+SELECT id, ticket_id, sender_id, content, message_type, attachment_url, is_flagged, flag_reason, created_at, edited_at,
+       search_vector
+FROM t_p7304060_coldfire_authenticat.messages_archive;
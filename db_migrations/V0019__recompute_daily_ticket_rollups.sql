@@ -0,0 +1,6 @@
+-- Агрегаты теперь не засчитывают автоматические закрытия модератору заявки
+-- и берут первые ответы из архивной истории тоже. Уже посчитанные дни
+-- пересчитываются целиком при следующем запуске задачи rollups.
+UPDATE t_p7304060_coldfire_authenticat.job_watermarks
+SET watermark = '1970-01-01', updated_at = NOW()
+WHERE job_name = 'daily_ticket_rollups';
@@ -0,0 +1,3 @@
+-- Импорт истории сопоставляет пользователей по email без учёта регистра
+-- (email из дампа приводятся к нижнему регистру)
+CREATE INDEX IF NOT EXISTS idx_users_email_lower ON t_p7304060_coldfire_authenticat.users (lower(email));
@@ -0,0 +1,28 @@
+-- Версия профилей пользователей для кэша отправителей в функции messages.
+-- Растёт при любом изменении имени, роли, станции, аватара или блокировки,
+-- кем бы оно ни было сделано, поэтому кэш сбрасывается без ожидания TTL.
+CREATE TABLE IF NOT EXISTS t_p7304060_coldfire_authenticat.user_profile_version (
+    singleton BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (singleton),
+    version BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+INSERT INTO t_p7304060_coldfire_authenticat.user_profile_version (singleton, version)
+VALUES (TRUE, 0)
+ON CONFLICT (singleton) DO NOTHING;
+
+CREATE OR REPLACE FUNCTION t_p7304060_coldfire_authenticat.bump_user_profile_version()
+RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE t_p7304060_coldfire_authenticat.user_profile_version
+    SET version = version + 1, updated_at = NOW();
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Триггер на оператор: last_login и счётчики входов версию не трогают
+DROP TRIGGER IF EXISTS users_profile_version ON t_p7304060_coldfire_authenticat.users;
+CREATE TRIGGER users_profile_version
+AFTER UPDATE OF username, role, station, avatar_url, is_banned OR DELETE
+ON t_p7304060_coldfire_authenticat.users
+FOR EACH STATEMENT EXECUTE FUNCTION t_p7304060_coldfire_authenticat.bump_user_profile_version();
@@ -0,0 +1,80 @@
+"""
+Бенчмарк пропускной способности массового импорта.
+
+Генерирует синтетические NDJSON-дампы пользователей, заявок и сообщений и
+прогоняет их через scripts/import_history.py. Пишет данные в БД, поэтому
+запускать только на тестовой базе.
+
+Запуск: DATABASE_URL=... python scripts/bench_import.py [--users 1000] [--tickets 20000] [--messages 200000]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from import_history import TICKET_PRIORITIES, TICKET_STATUSES, run_import  # noqa: E402
+
+
+def write_dumps(directory: str, users: int, tickets: int, messages: int) -> dict:
+    '''Пишет синтетические дампы; legacy id уникальны для каждого запуска'''
+    base = int(time.time()) * 10_000_000
+    run_tag = base // 10_000_000
+    paths = {entity: os.path.join(directory, f'{entity}s.ndjson') for entity in ('user', 'ticket', 'message')}
+    statuses = sorted(TICKET_STATUSES)
+    priorities = sorted(TICKET_PRIORITIES)
+
+    with open(paths['user'], 'w') as f:
+        for i in range(users):
+            f.write(json.dumps({
+                'id': base + i, 'username': f'bench_{run_tag}_{i}', 'email': f'bench_{run_tag}_{i}@example.com',
+                'role': 'moderator' if i % 50 == 0 else 'user', 'station': 'ВДНХ',
+                'created_at': '2024-01-01T00:00:00',
+            }) + '\n')
+
+    with open(paths['ticket'], 'w') as f:
+        for i in range(tickets):
+            f.write(json.dumps({
+                'id': base + i, 'user_id': base + random.randrange(users), 'title': f'Обращение {i}',
+                'status': random.choice(statuses), 'priority': random.choice(priorities),
+                'category': 'general', 'created_at': f'2024-{1 + i % 12:02d}-{1 + i % 28:02d}T12:00:00',
+            }) + '\n')
+
+    with open(paths['message'], 'w') as f:
+        for i in range(messages):
+            f.write(json.dumps({
+                'id': base + i, 'ticket_id': base + random.randrange(tickets),
+                'sender_id': base + random.randrange(users), 'content': 'Сообщение ' * random.randint(1, 50),
+                'message_type': 'text', 'created_at': f'2024-{1 + i % 12:02d}-{1 + i % 28:02d}T12:30:00',
+            }) + '\n')
+
+    return paths
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Bulk import throughput benchmark')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--tickets', type=int, default=20000)
+    parser.add_argument('--messages', type=int, default=200000)
+    args = parser.parse_args()
+
+    database_url = os.environ.get('DATABASE_URL')
+    if not database_url:
+        print('DATABASE_URL is required', file=sys.stderr)
+        return 2
+
+    with tempfile.TemporaryDirectory() as directory:
+        paths = write_dumps(directory, args.users, args.tickets, args.messages)
+        summary = run_import(database_url, paths)
+
+    total_rows = args.users + args.tickets + args.messages
+    print(json.dumps(summary, indent=2))
+    print(f"throughput: {total_rows / summary['seconds']:.0f} rows/s over {total_rows} rows")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
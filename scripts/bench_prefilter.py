@@ -0,0 +1,82 @@
+"""
+Бенчмарк автофильтра сообщений на автомате Ахо-Корасик.
+
+Строит PhraseMatcher из backend/messages/index.py по синтетическому списку
+запрещённых фраз и измеряет время построения автомата и проверки одного
+сообщения (чистого и с совпадением в конце) по сравнению с наивным перебором
+фраз через `in`.
+
+Запуск: python scripts/bench_prefilter.py [--patterns 10000] [--messages 2000] [--length 300]
+"""
+import argparse
+import importlib.util
+import os
+import random
+import sys
+import time
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend')
+ALPHABET = 'абвгдежзийклмнопрстуфхцчшщьыэюя'
+
+
+def load_messages_module():
+    '''Импортирует index.py функции messages'''
+    path = os.path.join(BACKEND_DIR, 'messages', 'index.py')
+    spec = importlib.util.spec_from_file_location('messages_index', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def random_words(rng: random.Random, count: int) -> str:
+    '''Случайные «слова» из кириллицы'''
+    return ' '.join(''.join(rng.choices(ALPHABET, k=rng.randint(3, 9))) for _ in range(count))
+
+
+def per_message_us(check, texts: list) -> float:
+    '''Среднее время проверки одного сообщения в микросекундах'''
+    started = time.perf_counter()
+    for text in texts:
+        check(text)
+    return (time.perf_counter() - started) / len(texts) * 1e6
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Aho-Corasick pre-filter cost per message')
+    parser.add_argument('--patterns', type=int, default=10000)
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--length', type=int, default=300, help='approximate message length in characters')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    module = load_messages_module()
+    phrases = [random_words(rng, rng.randint(1, 3)) for _ in range(args.patterns)]
+
+    started = time.perf_counter()
+    matcher = module.PhraseMatcher(phrases)
+    build_ms = (time.perf_counter() - started) * 1000
+
+    words = max(1, args.length // 7)
+    clean = [random_words(rng, words) for _ in range(args.messages)]
+    dirty = [text + ' ' + rng.choice(phrases) for text in clean]
+    normalized = [module.normalize_text(p) for p in phrases]
+
+    def naive(text: str):
+        text = module.normalize_text(text)
+        return next((p for p in normalized if p in text), None)
+
+    assert all(matcher.find(text) is not None for text in dirty)
+
+    print(f'patterns: {args.patterns}, automaton nodes: {len(matcher.goto)}, build: {build_ms:.0f} ms')
+    print(f"{'messages':<18}{'automaton us':>14}{'naive us':>12}")
+    naive_sample = max(1, args.messages // 20)
+    for name, texts in (('clean', clean), ('match at end', dirty)):
+        automaton_us = per_message_us(matcher.find, texts)
+        naive_us = per_message_us(naive, texts[:naive_sample])
+        print(f'{name:<18}{automaton_us:>14.1f}{naive_us:>12.1f}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
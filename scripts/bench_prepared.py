@@ -0,0 +1,86 @@
+"""
+Бенчмарк подготовленных запросов на горячих путях tickets и messages.
+
+Для каждого читающего запроса из реестров STATEMENTS сравнивает обычное
+выполнение (разбор и планирование на каждом вызове) с EXECUTE заранее
+подготовленного запроса и показывает время планирования из EXPLAIN ANALYZE.
+Пишущие запросы не выполняются, чтобы не менять данные.
+
+Запуск: DATABASE_URL=... python scripts/bench_prepared.py [--iterations 500] [--ticket-id 1] [--user-id 1]
+"""
+import argparse
+import importlib.util
+import os
+import re
+import sys
+import time
+
+import psycopg2
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend')
+
+
+def load_statements(function_name: str) -> dict:
+    '''Импортирует реестр STATEMENTS из index.py функции'''
+    path = os.path.join(BACKEND_DIR, function_name, 'index.py')
+    spec = importlib.util.spec_from_file_location(f'{function_name}_index', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.STATEMENTS
+
+
+def timed(cur, sql: str, params: tuple, iterations: int) -> float:
+    '''Среднее время одного выполнения в микросекундах'''
+    started = time.perf_counter()
+    for _ in range(iterations):
+        cur.execute(sql, params)
+        cur.fetchall()
+    return (time.perf_counter() - started) / iterations * 1e6
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='PREPARE/EXECUTE vs plain execution')
+    parser.add_argument('--iterations', type=int, default=500)
+    parser.add_argument('--ticket-id', default='1')
+    parser.add_argument('--user-id', default='1')
+    args = parser.parse_args()
+
+    database_url = os.environ.get('DATABASE_URL')
+    if not database_url:
+        print('DATABASE_URL is required', file=sys.stderr)
+        return 2
+
+    params_by_name = {
+        'tickets_list_all': (),
+        'tickets_list_by_user': (args.user_id,),
+        'messages_by_ticket': (args.ticket_id,),
+        'messages_batch': ([int(args.ticket_id)], [0], args.user_id, 50),
+    }
+    statements = {**load_statements('tickets'), **load_statements('messages')}
+
+    conn = psycopg2.connect(database_url)
+    cur = conn.cursor()
+    print(f"{'statement':<24}{'plan ms':>9}{'plain us':>11}{'prepared us':>13}{'saved':>8}")
+    for name, params in params_by_name.items():
+        plain_sql = re.sub(r'\$\d+', '%s', statements[name])
+
+        cur.execute('EXPLAIN (ANALYZE, FORMAT JSON) ' + plain_sql, params)
+        planning_ms = cur.fetchone()[0][0]['Planning Time']
+
+        plain_us = timed(cur, plain_sql, params, args.iterations)
+
+        cur.execute(f'PREPARE bench_{name} AS {statements[name]}')
+        placeholders = ' (' + ', '.join(['%s'] * len(params)) + ')' if params else ''
+        prepared_us = timed(cur, f'EXECUTE bench_{name}{placeholders}', params, args.iterations)
+        cur.execute(f'DEALLOCATE bench_{name}')
+
+        saved = (1 - prepared_us / plain_us) * 100 if plain_us else 0.0
+        print(f'{name:<24}{planning_ms:>9.3f}{plain_us:>11.1f}{prepared_us:>13.1f}{saved:>7.1f}%')
+
+    conn.rollback()
+    conn.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,164 @@
+"""
+Бенчмарк полнотекстового поиска заявок (tickets_search_all и
+tickets_search_by_user из backend/tickets).
+
+С --populate N сначала дописывает в БД N синтетических сообщений в новые
+заявки отдельного пользователя (тексты из словаря с неравномерной частотой
+слов, даты за последние 60 дней). Это запись в БД, поэтому --populate
+запускать только на тестовой базе; цель из задачи - 10 000 000 сообщений.
+
+Затем для частого, среднего, редкого слова и фразы выполняет поиск через
+PREPARE/EXECUTE так же, как функция, от лица модератора (по всем заявкам) и
+пользователя (по своим), и выводит медиану и p95 времени ответа, число
+найденных заявок и признак total_capped.
+
+Запуск: DATABASE_URL=... python scripts/bench_search.py [--populate 10000000] [--iterations 50]
+"""
+import argparse
+import importlib.util
+import os
+import statistics
+import sys
+import time
+
+import psycopg2
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend')
+SCHEMA = 't_p7304060_coldfire_authenticat'
+
+# Первые слова словаря встречаются чаще: индекс слова берётся как random()^3
+VOCABULARY = [
+    'поезд', 'станция', 'турникет', 'карта', 'оплата', 'вход', 'выход', 'эскалатор',
+    'задержка', 'расписание', 'билет', 'проездной', 'возврат', 'списание', 'баланс',
+    'приложение', 'ошибка', 'вагон', 'кондиционер', 'шум', 'уборка', 'лифт', 'пандус',
+    'переход', 'касса', 'терминал', 'платформа', 'объявление', 'табло', 'интервал',
+    'пересадка', 'кольцевая', 'радиальная', 'депо', 'контролёр', 'штраф', 'льгота',
+    'студенческий', 'пенсионный', 'потерянные', 'вещи', 'зонт', 'рюкзак', 'телефон',
+    'велосипед', 'самокат', 'собака', 'музыкант', 'реклама', 'вестибюль',
+]
+QUERIES = {
+    'frequent': 'поезд',
+    'medium': 'проездной',
+    'rare': 'вестибюль',
+    'phrase': '"возврат оплата"',
+}
+BATCH_SIZE = 500_000
+
+
+def load_tickets_module():
+    '''Импортирует index.py функции tickets'''
+    path = os.path.join(BACKEND_DIR, 'tickets', 'index.py')
+    spec = importlib.util.spec_from_file_location('tickets_index', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def populate(conn, messages: int, tickets: int) -> int:
+    '''Пишет синтетические заявки и сообщения; возвращает id пользователя-владельца'''
+    cur = conn.cursor()
+    tag = int(time.time())
+    cur.execute(f"""
+        INSERT INTO {SCHEMA}.users (username, email, password_hash, role)
+        VALUES (%s, %s, 'bench', 'user')
+        RETURNING id
+    """, (f'search_bench_{tag}', f'search_bench_{tag}@example.com'))
+    user_id = cur.fetchone()[0]
+    cur.execute(f"""
+        INSERT INTO {SCHEMA}.support_tickets (user_id, title, status, priority, category)
+        SELECT %s, 'Обращение ' || g || ' ' || (%s::text[])[1 + floor(power(random(), 3) * %s)::int],
+               'open', 'medium', 'general'
+        FROM generate_series(1, %s) g
+        RETURNING id
+    """, (user_id, VOCABULARY, len(VOCABULARY), tickets))
+    ticket_ids = [row[0] for row in cur.fetchall()]
+    for offset in range(0, 3):
+        cur.execute(f"SELECT {SCHEMA}.ensure_messages_partition((NOW() - make_interval(months => %s))::date)", (offset,))
+    conn.commit()
+
+    written = 0
+    while written < messages:
+        count = min(BATCH_SIZE, messages - written)
+        cur.execute(f"""
+            INSERT INTO {SCHEMA}.messages (ticket_id, sender_id, content, message_type, created_at)
+            SELECT (%s::int[])[1 + (g %% %s)], %s,
+                   array_to_string(ARRAY(
+                       SELECT (%s::text[])[1 + floor(power(random(), 3) * %s)::int]
+                       FROM generate_series(1, 6 + g %% 10)
+                   ), ' '),
+                   'text', NOW() - random() * INTERVAL '60 days'
+            FROM generate_series(1, %s) g
+        """, (ticket_ids, len(ticket_ids), user_id, VOCABULARY, len(VOCABULARY), count))
+        conn.commit()
+        written += count
+        print(f'populated {written}/{messages} messages', file=sys.stderr)
+
+    cur.execute(f'ANALYZE {SCHEMA}.messages')
+    conn.commit()
+    return user_id
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Full-text ticket search latency')
+    parser.add_argument('--populate', type=int, default=0, help='synthetic messages to insert first')
+    parser.add_argument('--tickets', type=int, default=200_000, help='tickets for populated messages')
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--user-id', type=int, default=None, help='owner for user searches')
+    args = parser.parse_args()
+
+    database_url = os.environ.get('DATABASE_URL')
+    if not database_url:
+        print('DATABASE_URL is required', file=sys.stderr)
+        return 2
+
+    tickets = load_tickets_module()
+    conn = psycopg2.connect(database_url)
+    cur = conn.cursor()
+    cur.execute(f'SET search_path TO {SCHEMA}, public')
+
+    user_id = args.user_id
+    if args.populate:
+        user_id = populate(conn, args.populate, args.tickets)
+    if user_id is None:
+        cur.execute('SELECT user_id FROM support_tickets GROUP BY user_id ORDER BY COUNT(*) DESC LIMIT 1')
+        row = cur.fetchone()
+        user_id = row[0] if row else 0
+
+    # У партиционированной таблицы оценка числа строк хранится в партициях
+    cur.execute("""
+        SELECT COALESCE(SUM(c.reltuples), 0)::bigint
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'messages'::regclass
+    """)
+    print(f'messages (estimate): {cur.fetchone()[0]}')
+
+    cur.execute(f"PREPARE bench_search_all AS {tickets.STATEMENTS['tickets_search_all']}")
+    cur.execute(f"PREPARE bench_search_by_user AS {tickets.STATEMENTS['tickets_search_by_user']}")
+    print(f"{'query':<10}{'scope':<11}{'p50 ms':>9}{'p95 ms':>9}{'total':>8}{'capped':>8}")
+    for label, text in QUERIES.items():
+        params = (text, tickets.SEARCH_PAGE_SIZE, 0, tickets.SEARCH_MAX_MESSAGE_HITS)
+        for scope, statement in (('moderator', 'EXECUTE bench_search_all (%s, %s, %s, %s)'),
+                                 ('user', 'EXECUTE bench_search_by_user (%s, %s, %s, %s, %s)')):
+            scope_params = params if scope == 'moderator' else params + (user_id,)
+            timings = []
+            rows = []
+            for _ in range(args.iterations):
+                started = time.perf_counter()
+                cur.execute(statement, scope_params)
+                rows = cur.fetchall()
+                timings.append((time.perf_counter() - started) * 1000)
+            timings.sort()
+            p95 = timings[min(len(timings) - 1, int(0.95 * len(timings)))]
+            total = rows[0][13] if rows else 0
+            capped = rows[0][14] if rows else False
+            print(f'{label:<10}{scope:<11}{statistics.median(timings):>9.1f}{p95:>9.1f}{total:>8}{str(capped):>8}')
+
+    cur.execute('DEALLOCATE bench_search_all')
+    cur.execute('DEALLOCATE bench_search_by_user')
+    conn.rollback()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
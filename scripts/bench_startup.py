@@ -0,0 +1,176 @@
+"""
+Бенчмарк холодного старта backend-функций.
+
+Для каждой функции из backend/ запускает свежий процесс интерпретатора,
+импортирует index.py, вызывает handler и измеряет время до первого ответа
+(старт интерпретатора + импорт модуля + первый вызов). Превышение бюджета
+функции завершает скрипт с кодом 1.
+
+Для каждой функции меряются два пути:
+  preflight - CORS preflight (OPTIONS), который не загружает драйвер БД;
+  request   - сценарий из tests.json функции, который подключается к БД
+              (READ_ONLY_CASES или первый GET). Без --with-db DATABASE_URL
+              указывает на закрытый локальный порт: запрос загружает psycopg2
+              и сразу получает отказ соединения, поэтому в замер входит импорт
+              драйвера, но не сеть.
+С флагом --with-db сценарий request идёт в настоящую БД из DATABASE_URL.
+Путь request, который не загрузил драйвер, считается проваленным: такой
+замер не проверяет холодный старт с БД. Если psycopg2 не установлен, путь
+request пропускается с пометкой в выводе.
+
+Запуск: python scripts/bench_startup.py [--runs 5] [--with-db] [--budget-scale 1.0]
+"""
+import argparse
+import importlib.util
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend')
+
+# Бюджет времени до первого ответа в миллисекундах:
+# (preflight, request без БД, request с БД)
+BUDGETS_MS = {
+    'auth': (150, 250, 400),
+    'captcha': (150, 250, 400),
+    'messages': (150, 250, 400),
+    'moderator-stats': (150, 250, 450),
+    'tickets': (150, 250, 400),
+}
+DEFAULT_BUDGET_MS = (150, 250, 400)
+
+# Читающие сценарии tests.json, которые доходят до БД, для функций, где
+# первый GET пишет в БД или GET нет
+READ_ONLY_CASES = {
+    'attachments': 'Get unknown attachment',
+    'auth': 'Test login with invalid credentials',
+    'captcha': 'Verify captcha - missing data',
+}
+# У maintenance все задачи пишут в БД. Без --with-db задача падает на
+# подключении к закрытому порту, ничего не записав; с --with-db путь request
+# для этих функций пропускается
+WRITE_ONLY_CASES = {
+    'maintenance': 'Auto-close stale tickets',
+}
+# Закрытый порт: соединение отклоняется сразу, без таймаута
+UNREACHABLE_DATABASE_URL = 'postgresql://bench@127.0.0.1:1/bench'
+
+CHILD_CODE = '''
+import importlib.util, json, sys, time
+t0 = time.perf_counter()
+spec = importlib.util.spec_from_file_location('index', sys.argv[1])
+module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(module)
+t1 = time.perf_counter()
+response = module.handler(json.loads(sys.argv[2]), None)
+t2 = time.perf_counter()
+print(json.dumps({'import_ms': (t1 - t0) * 1000, 'first_call_ms': (t2 - t1) * 1000,
+                  'status': response.get('statusCode'), 'driver_loaded': 'psycopg2' in sys.modules}))
+'''
+
+
+def build_event(function_dir: str, phase: str) -> dict:
+    '''Собирает событие для первого вызова функции'''
+    if phase == 'preflight':
+        return {'httpMethod': 'OPTIONS', 'headers': {}}
+
+    with open(os.path.join(function_dir, 'tests.json')) as f:
+        tests = json.load(f)['tests']
+    name = os.path.basename(function_dir)
+    case_name = READ_ONLY_CASES.get(name) or WRITE_ONLY_CASES.get(name)
+    test = next((t for t in tests if t['name'] == case_name), None) if case_name else None
+    test = test or next((t for t in tests if t['method'] == 'GET'), tests[0])
+
+    path, _, query = test.get('path', '/').partition('?')
+    query = query or test.get('query', '')
+    params = dict(pair.split('=', 1) for pair in query.split('&') if '=' in pair)
+    return {
+        'httpMethod': test['method'],
+        'headers': test.get('headers', {}),
+        'queryStringParameters': params or None,
+        'body': json.dumps(test['body']) if 'body' in test else '',
+    }
+
+
+def measure(function_dir: str, event: dict, env: dict) -> dict:
+    '''Один холодный запуск функции в новом процессе'''
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, '-c', CHILD_CODE, os.path.join(function_dir, 'index.py'), json.dumps(event)],
+        capture_output=True, text=True, cwd=function_dir, env=env
+    )
+    total_ms = (time.perf_counter() - started) * 1000
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip())
+    stats = json.loads(result.stdout.strip().splitlines()[-1])
+    stats['total_ms'] = total_ms
+    return stats
+
+
+def driver_available() -> bool:
+    '''Установлен ли psycopg2 в интерпретаторе, которым запускаются функции'''
+    return importlib.util.find_spec('psycopg2') is not None
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Cold start benchmark for backend functions')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--with-db', action='store_true', help='run the request path against DATABASE_URL')
+    parser.add_argument('--budget-scale', type=float, default=1.0, help='multiply budgets for slow machines')
+    args = parser.parse_args()
+
+    if args.with_db and not os.environ.get('DATABASE_URL'):
+        print('DATABASE_URL is required for --with-db', file=sys.stderr)
+        return 2
+
+    env = os.environ.copy()
+    if not args.with_db:
+        env['DATABASE_URL'] = UNREACHABLE_DATABASE_URL
+        env.pop('REPLICA_DATABASE_URL', None)
+        # Задача maintenance без токена в событии должна дойти до подключения
+        env.pop('MAINTENANCE_TOKEN', None)
+
+    failed = []
+    print(f"{'function':<18}{'path':<11}{'median ms':>10}{'import':>9}{'call':>9}{'budget':>9}  status")
+    for name in sorted(os.listdir(BACKEND_DIR)):
+        function_dir = os.path.join(BACKEND_DIR, name)
+        if not os.path.isfile(os.path.join(function_dir, 'index.py')):
+            continue
+
+        budgets = BUDGETS_MS.get(name, DEFAULT_BUDGET_MS)
+        for phase, budget in (('preflight', budgets[0]), ('request', budgets[2 if args.with_db else 1])):
+            if phase == 'request' and not driver_available():
+                print(f'{name:<18}{phase:<11}{"-":>10}{"-":>9}{"-":>9}{budget:>9.0f}  skipped, psycopg2 not installed')
+                continue
+            if phase == 'request' and args.with_db and name in WRITE_ONLY_CASES:
+                print(f'{name:<18}{phase:<11}{"-":>10}{"-":>9}{"-":>9}{budget:>9.0f}  skipped, no read-only request')
+                continue
+            event = build_event(function_dir, phase)
+            runs = [measure(function_dir, event, env) for _ in range(args.runs)]
+            budget *= args.budget_scale
+            median_total = statistics.median(r['total_ms'] for r in runs)
+            median_import = statistics.median(r['import_ms'] for r in runs)
+            median_call = statistics.median(r['first_call_ms'] for r in runs)
+
+            if phase == 'request' and not runs[-1]['driver_loaded']:
+                verdict = 'FAILED, driver not loaded'
+                failed.append(f'{name} {phase}')
+            elif median_total <= budget:
+                verdict = 'ok'
+            else:
+                verdict = 'OVER BUDGET'
+                failed.append(f'{name} {phase}')
+            print(f'{name:<18}{phase:<11}{median_total:>10.1f}{median_import:>9.1f}{median_call:>9.1f}{budget:>9.0f}  '
+                  f"{verdict} (HTTP {runs[-1]['status']})")
+
+    if failed:
+        print(f"Failed: {', '.join(failed)}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,87 @@
+"""
+Проверка идемпотентности под параллельными повторами.
+
+Запускает несколько процессов, которые одновременно вызывают handler функции
+tickets (создание заявки) или messages (send_message) с одним и тем же
+Idempotency-Key, и проверяет, что в БД появилась ровно одна запись, а все
+процессы получили одинаковый ответ. Пишет в БД, запускать на тестовой базе.
+
+Запуск: DATABASE_URL=... python scripts/check_idempotency.py [--target tickets|messages]
+        [--user-id 1] [--ticket-id 1] [--parallel 8]
+"""
+import argparse
+import importlib.util
+import json
+import multiprocessing
+import os
+import sys
+import uuid
+
+import psycopg2
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend')
+
+
+def call_handler(args: tuple) -> tuple:
+    '''Вызывает handler в отдельном процессе со своим соединением'''
+    target, event, barrier = args
+    spec = importlib.util.spec_from_file_location(f'{target}_index', os.path.join(BACKEND_DIR, target, 'index.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    barrier.wait()
+    response = module.handler(event, None)
+    return response['statusCode'], response['body']
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Parallel retries with one Idempotency-Key')
+    parser.add_argument('--target', choices=['tickets', 'messages'], default='tickets')
+    parser.add_argument('--user-id', default='1')
+    parser.add_argument('--ticket-id', type=int, default=1)
+    parser.add_argument('--parallel', type=int, default=8)
+    args = parser.parse_args()
+
+    database_url = os.environ.get('DATABASE_URL')
+    if not database_url:
+        print('DATABASE_URL is required', file=sys.stderr)
+        return 2
+
+    marker = f'idempotency-check-{uuid.uuid4().hex[:12]}'
+    if args.target == 'tickets':
+        body = {'title': marker, 'category': 'general', 'priority': 'medium'}
+        count_sql = 'SELECT COUNT(*) FROM t_p7304060_coldfire_authenticat.support_tickets WHERE title = %s'
+    else:
+        body = {'action': 'send_message', 'ticket_id': args.ticket_id, 'content': marker, 'message_type': 'text'}
+        count_sql = 'SELECT COUNT(*) FROM t_p7304060_coldfire_authenticat.messages WHERE content = %s'
+
+    event = {
+        'httpMethod': 'POST',
+        'headers': {'X-User-Id': args.user_id, 'Idempotency-Key': marker},
+        'body': json.dumps(body),
+    }
+
+    with multiprocessing.Manager() as manager:
+        barrier = manager.Barrier(args.parallel)
+        with multiprocessing.get_context('spawn').Pool(args.parallel) as pool:
+            results = pool.map(call_handler, [(args.target, event, barrier)] * args.parallel, chunksize=1)
+
+    conn = psycopg2.connect(database_url)
+    cur = conn.cursor()
+    cur.execute(count_sql, (marker,))
+    inserted = cur.fetchone()[0]
+    conn.close()
+
+    statuses = sorted(status for status, _ in results)
+    distinct_bodies = {body for status, body in results if status == 201}
+    print(f'statuses: {statuses}')
+    print(f'rows inserted: {inserted}, distinct 201 bodies: {len(distinct_bodies)}')
+
+    if inserted != 1 or len(distinct_bodies) != 1:
+        print('FAIL: expected exactly one insert and one shared response', file=sys.stderr)
+        return 1
+    print('OK')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,220 @@
+"""
+Потоковая выгрузка заявок с сообщениями, жалобами и оценками.
+
+Данные идут через COPY ... TO STDOUT прямо в файл, поэтому память не зависит
+от объёма выгрузки, а БД не обслуживает построчные выборки. Заявки
+выгружаются пачками по id; после каждой пачки последний id и длина файла
+выгрузки (записанной на диск) сохраняются в файл курсора. Прерванная
+выгрузка обрезает файл до сохранённой длины, убирая недописанную пачку, и
+продолжается с того же места.
+
+Форматы:
+  ndjson - одна строка на заявку с вложенными messages, reports, ratings
+  csv    - одна строка на сообщение с полями заявки, числом жалоб и оценкой;
+           заявка без сообщений даёт одну строку с пустыми полями сообщения
+
+По умолчанию читает с реплики (REPLICA_DATABASE_URL), иначе из DATABASE_URL.
+
+Запуск:
+  python scripts/export_history.py --format ndjson --output tickets.ndjson \\
+      [--since 2026-01-01] [--until 2026-02-01] [--status closed --status archived] \\
+      [--cursor-file export.cursor] [--chunk-size 1000]
+"""
+import argparse
+import os
+import sys
+import time
+from typing import Optional
+
+import psycopg2
+
+SCHEMA = 't_p7304060_coldfire_authenticat'
+
+# CSV-режим COPY не экранирует обратные слэши, а управляющие символы \x01/\x02
+# в JSON всегда экранированы, поэтому строки JSON выходят без изменений
+NDJSON_COPY_OPTIONS = "(FORMAT csv, QUOTE E'\\x01', DELIMITER E'\\x02')"
+
+NDJSON_QUERY = f"""
+    SELECT row_to_json(x)::text
+    FROM (
+        SELECT t.id, t.title, t.status, t.priority, t.category, t.user_id,
+               t.assigned_moderator_id, t.created_at, t.updated_at, t.closed_at, t.auto_closed,
+               COALESCE((
+                   SELECT json_agg(json_build_object(
+                       'id', m.id, 'sender_id', m.sender_id, 'content', m.content,
+                       'message_type', m.message_type, 'attachment_url', m.attachment_url,
+                       'is_flagged', m.is_flagged, 'flag_reason', m.flag_reason,
+                       'created_at', m.created_at, 'edited_at', m.edited_at
+                   ) ORDER BY m.created_at)
+                   FROM {SCHEMA}.messages_all m
+                   WHERE m.ticket_id = t.id
+               ), '[]'::json) AS messages,
+               COALESCE((
+                   SELECT json_agg(json_build_object(
+                       'id', r.id, 'message_id', r.message_id, 'reporter_id', r.reporter_id,
+                       'reported_user_id', r.reported_user_id, 'reason', r.reason,
+                       'status', r.status, 'created_at', r.created_at
+                   ) ORDER BY r.id)
+                   FROM {SCHEMA}.reports r
+                   JOIN {SCHEMA}.messages_all m ON m.id = r.message_id
+                   WHERE m.ticket_id = t.id
+               ), '[]'::json) AS reports,
+               COALESCE((
+                   SELECT json_agg(json_build_object(
+                       'moderator_id', ra.moderator_id, 'user_id', ra.user_id, 'rating', ra.rating,
+                       'review_text', ra.review_text, 'created_at', ra.created_at
+                   ) ORDER BY ra.id)
+                   FROM {SCHEMA}.moderator_ratings ra
+                   WHERE ra.ticket_id = t.id
+               ), '[]'::json) AS ratings
+        FROM {SCHEMA}.support_tickets t
+        WHERE t.id > %(after_id)s AND t.id <= %(last_id)s AND {{filters}}
+        ORDER BY t.id
+    ) x
+"""
+
+CSV_QUERY = f"""
+    SELECT t.id AS ticket_id, t.title AS ticket_title, t.status AS ticket_status,
+           t.priority AS ticket_priority, t.category AS ticket_category,
+           t.created_at AS ticket_created_at, t.closed_at AS ticket_closed_at,
+           m.id AS message_id, m.sender_id, m.message_type, m.content, m.attachment_url,
+           m.is_flagged, m.flag_reason, m.created_at AS message_created_at,
+           CASE WHEN m.id IS NULL THEN 0
+                ELSE (SELECT COUNT(*) FROM {SCHEMA}.reports r WHERE r.message_id = m.id)
+           END AS report_count,
+           (SELECT MAX(ra.rating) FROM {SCHEMA}.moderator_ratings ra WHERE ra.ticket_id = t.id) AS ticket_rating
+    FROM {SCHEMA}.support_tickets t
+    LEFT JOIN {SCHEMA}.messages_all m ON m.ticket_id = t.id
+    WHERE t.id > %(after_id)s AND t.id <= %(last_id)s AND {{filters}}
+    ORDER BY t.id, m.created_at
+"""
+
+
+def read_cursor(path: str) -> tuple:
+    '''Последний выгруженный id заявки и длина файла выгрузки после него (None, если не сохранена)'''
+    if path and os.path.exists(path):
+        with open(path) as f:
+            parts = f.read().split()
+        if parts:
+            return int(parts[0]), int(parts[1]) if len(parts) > 1 else None
+    return 0, None
+
+
+def write_cursor(path: str, ticket_id: int, offset: Optional[int]) -> None:
+    '''Атомарно сохраняет курсор, чтобы обрыв не оставил его полузаписанным'''
+    if not path:
+        return
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(str(ticket_id) if offset is None else f'{ticket_id} {offset}')
+    os.replace(tmp_path, path)
+
+
+def build_filters(args: argparse.Namespace) -> tuple:
+    '''SQL-условия отбора заявок и их параметры'''
+    conditions = ['TRUE']
+    params = {}
+    if args.since:
+        conditions.append('t.created_at >= %(since)s')
+        params['since'] = args.since
+    if args.until:
+        conditions.append('t.created_at < %(until)s')
+        params['until'] = args.until
+    if args.status:
+        conditions.append('t.status = ANY(%(statuses)s)')
+        params['statuses'] = args.status
+    return ' AND '.join(conditions), params
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Stream tickets with messages via COPY')
+    parser.add_argument('--format', choices=['ndjson', 'csv'], default='ndjson')
+    parser.add_argument('--output', help='output file (default: stdout)')
+    parser.add_argument('--since', help='tickets created at or after this timestamp')
+    parser.add_argument('--until', help='tickets created before this timestamp')
+    parser.add_argument('--status', action='append', help='ticket status filter, repeatable')
+    parser.add_argument('--cursor-file', help='resume/progress file with the last exported ticket id')
+    parser.add_argument('--chunk-size', type=int, default=1000, help='tickets per COPY')
+    args = parser.parse_args()
+
+    database_url = os.environ.get('REPLICA_DATABASE_URL') or os.environ.get('DATABASE_URL')
+    if not database_url:
+        print('DATABASE_URL or REPLICA_DATABASE_URL is required', file=sys.stderr)
+        return 2
+
+    after_id, committed_offset = read_cursor(args.cursor_file)
+    resuming = after_id > 0
+    filters, filter_params = build_filters(args)
+    query_template = (NDJSON_QUERY if args.format == 'ndjson' else CSV_QUERY).replace('{filters}', filters)
+
+    conn = psycopg2.connect(database_url)
+    conn.set_session(readonly=True)
+    cur = conn.cursor()
+
+    if args.output and resuming and committed_offset is not None:
+        # Всё, что дописано после последнего курсора, относится к пачке,
+        # которая будет выгружена заново
+        size = os.path.getsize(args.output) if os.path.exists(args.output) else -1
+        if size < committed_offset:
+            print(f'{args.output} is shorter than the cursor offset {committed_offset}, cannot resume',
+                  file=sys.stderr)
+            return 2
+        os.truncate(args.output, committed_offset)
+
+    if args.output:
+        out = open(args.output, 'a' if resuming else 'w', encoding='utf-8')
+    else:
+        out = sys.stdout
+
+    started = time.perf_counter()
+    exported = 0
+    first_chunk = not resuming
+    try:
+        while True:
+            # Граница пачки выбирается по индексу первичного ключа
+            cur.execute(f"""
+                SELECT MAX(id), COUNT(*) FROM (
+                    SELECT t.id FROM {SCHEMA}.support_tickets t
+                    WHERE t.id > %(after_id)s AND {filters}
+                    ORDER BY t.id
+                    LIMIT %(chunk_size)s
+                ) chunk
+            """, {'after_id': after_id, 'chunk_size': args.chunk_size, **filter_params})
+            last_id, chunk_count = cur.fetchone()
+            if not chunk_count:
+                break
+
+            query = cur.mogrify(query_template, {'after_id': after_id, 'last_id': last_id, **filter_params}).decode()
+            if args.format == 'ndjson':
+                copy_sql = f'COPY ({query}) TO STDOUT WITH {NDJSON_COPY_OPTIONS}'
+            else:
+                header = 'true' if first_chunk else 'false'
+                copy_sql = f'COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER {header})'
+            cur.copy_expert(copy_sql, out)
+            conn.rollback()
+            out.flush()
+            # Курсор ссылается только на данные, уже лежащие на диске
+            offset = None
+            if out is not sys.stdout:
+                os.fsync(out.fileno())
+                offset = os.fstat(out.fileno()).st_size
+
+            after_id = last_id
+            exported += chunk_count
+            first_chunk = False
+            write_cursor(args.cursor_file, after_id, offset)
+
+            elapsed = time.perf_counter() - started
+            print(f'exported {exported} tickets, last id {after_id}, {exported / elapsed:.0f} tickets/s',
+                  file=sys.stderr)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+        conn.close()
+
+    print(f'done: {exported} tickets in {time.perf_counter() - started:.1f}s', file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
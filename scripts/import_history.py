@@ -0,0 +1,424 @@
+"""
+Массовый импорт пользователей, заявок и сообщений из старой системы поддержки.
+
+Дампы в формате NDJSON (*.ndjson, *.jsonl) или CSV (*.csv) с заголовком:
+  users:    id, username, email, role, station, avatar_url, created_at, password_hash
+  tickets:  id, user_id, title, status, priority, category, created_at, updated_at,
+            closed_at, assigned_moderator_id
+  messages: id, ticket_id, sender_id, content, message_type, attachment_url, created_at
+
+Строки проверяются на ограничения схемы (длина сообщения до 1000 символов,
+допустимые статусы, приоритеты, роли и типы сообщений), отклонённые пишутся
+в файл --rejects. Корректные строки пачками грузятся через COPY в
+промежуточные таблицы import_*, затем переносятся в рабочие таблицы пачками
+по legacy id с выдачей новых id из последовательностей. Соответствие старых и
+новых id сохраняется в import_id_map в той же транзакции, что и строка,
+поэтому прерванный импорт можно просто запустить ещё раз.
+
+Пользователи, совпадающие с существующими по логину или email (без учёта
+регистра), не создаются заново, а сопоставляются с существующими.
+
+Запуск:
+  DATABASE_URL=... python scripts/import_history.py --users users.ndjson \\
+      --tickets tickets.csv --messages messages.ndjson [--rejects rejects.ndjson]
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import psycopg2
+
+SCHEMA = 't_p7304060_coldfire_authenticat'
+
+MAX_MESSAGE_LENGTH = 1000
+TICKET_STATUSES = {'open', 'in_progress', 'closed', 'archived'}
+TICKET_PRIORITIES = {'low', 'medium', 'high', 'urgent'}
+USER_ROLES = {'user', 'moderator', 'admin'}
+MESSAGE_TYPES = {'text', 'image', 'file'}
+
+COPY_CHUNK_ROWS = 50000
+MERGE_CHUNK_ROWS = 5000
+
+
+def read_rows(path: str) -> Iterator[Dict[str, Any]]:
+    '''Построчно читает NDJSON или CSV дамп'''
+    with open(path, encoding='utf-8', newline='') as f:
+        if path.endswith('.csv'):
+            for row in csv.DictReader(f):
+                yield {key: (value if value != '' else None) for key, value in row.items()}
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def required_int(row: Dict[str, Any], field: str) -> int:
+    value = row.get(field)
+    if value is None:
+        raise ValueError(f'{field} is required')
+    return int(value)
+
+
+def optional_int(row: Dict[str, Any], field: str) -> Optional[int]:
+    value = row.get(field)
+    return int(value) if value not in (None, '') else None
+
+
+def optional_timestamp(row: Dict[str, Any], field: str) -> Optional[str]:
+    value = row.get(field)
+    if value in (None, ''):
+        return None
+    return datetime.fromisoformat(str(value).replace('Z', '+00:00')).isoformat()
+
+
+def required_text(row: Dict[str, Any], field: str, max_length: int) -> str:
+    value = (row.get(field) or '').strip()
+    if not value:
+        raise ValueError(f'{field} is required')
+    if len(value) > max_length:
+        raise ValueError(f'{field} longer than {max_length} characters')
+    return value
+
+
+def choice(row: Dict[str, Any], field: str, allowed: set, default: str) -> str:
+    value = row.get(field) or default
+    if value not in allowed:
+        raise ValueError(f'{field} must be one of {sorted(allowed)}')
+    return value
+
+
+class UserValidator:
+    '''Проверяет пользователей и отсекает дубли логинов и email внутри дампа'''
+    columns = ['legacy_id', 'username', 'email', 'password_hash', 'role', 'station', 'avatar_url', 'created_at']
+
+    def __init__(self) -> None:
+        self.usernames = set()
+        self.emails = set()
+
+    def __call__(self, row: Dict[str, Any]) -> tuple:
+        username = required_text(row, 'username', 50)
+        email = required_text(row, 'email', 100).lower()
+        if username in self.usernames or email in self.emails:
+            raise ValueError('duplicate username or email in dump')
+        self.usernames.add(username)
+        self.emails.add(email)
+        return (
+            required_int(row, 'id'), username, email, row.get('password_hash'),
+            choice(row, 'role', USER_ROLES, 'user'), row.get('station'), row.get('avatar_url'),
+            optional_timestamp(row, 'created_at'),
+        )
+
+
+def validate_ticket(row: Dict[str, Any]) -> tuple:
+    category = (row.get('category') or 'general').strip()
+    if len(category) > 50:
+        raise ValueError('category longer than 50 characters')
+    return (
+        required_int(row, 'id'), required_int(row, 'user_id'), optional_int(row, 'assigned_moderator_id'),
+        required_text(row, 'title', 200), choice(row, 'status', TICKET_STATUSES, 'open'),
+        choice(row, 'priority', TICKET_PRIORITIES, 'medium'), category,
+        optional_timestamp(row, 'created_at'), optional_timestamp(row, 'updated_at'),
+        optional_timestamp(row, 'closed_at'),
+    )
+
+
+validate_ticket.columns = ['legacy_id', 'legacy_user_id', 'legacy_moderator_id', 'title', 'status',
+                           'priority', 'category', 'created_at', 'updated_at', 'closed_at']
+
+
+def validate_message(row: Dict[str, Any]) -> tuple:
+    return (
+        required_int(row, 'id'), required_int(row, 'ticket_id'), required_int(row, 'sender_id'),
+        required_text(row, 'content', MAX_MESSAGE_LENGTH), choice(row, 'message_type', MESSAGE_TYPES, 'text'),
+        row.get('attachment_url'), optional_timestamp(row, 'created_at'),
+    )
+
+
+validate_message.columns = ['legacy_id', 'legacy_ticket_id', 'legacy_sender_id', 'content',
+                            'message_type', 'attachment_url', 'created_at']
+
+
+# Перенос из промежуточных таблиц: пачка по legacy_id, новые id из
+# последовательности, вставка и запись соответствия в одном запросе
+MERGE_SQL = {
+    'user': f"""
+        WITH pending AS (
+            SELECT DISTINCT ON (s.legacy_id) s.*, existing.id AS existing_id
+            FROM {SCHEMA}.import_users s
+            LEFT JOIN LATERAL (
+                SELECT u.id FROM {SCHEMA}.users u
+                WHERE u.username = s.username OR lower(u.email) = s.email
+                LIMIT 1
+            ) existing ON TRUE
+            WHERE s.legacy_id > %(after_id)s AND s.legacy_id <= %(last_id)s
+              AND NOT EXISTS (
+                  SELECT 1 FROM {SCHEMA}.import_id_map im
+                  WHERE im.entity = 'user' AND im.legacy_id = s.legacy_id
+              )
+            ORDER BY s.legacy_id
+        ),
+        allocated AS (
+            SELECT p.*, COALESCE(p.existing_id, nextval('{SCHEMA}.users_id_seq')) AS new_id
+            FROM pending p
+        ),
+        inserted AS (
+            INSERT INTO {SCHEMA}.users (id, username, email, password_hash, role, station, avatar_url, created_at)
+            SELECT new_id, username, email, COALESCE(password_hash, '!imported'), role, station, avatar_url,
+                   COALESCE(created_at, NOW())
+            FROM allocated
+            WHERE existing_id IS NULL
+        )
+        INSERT INTO {SCHEMA}.import_id_map (entity, legacy_id, new_id)
+        SELECT 'user', legacy_id, new_id FROM allocated
+    """,
+    'ticket': f"""
+        WITH pending AS (
+            SELECT DISTINCT ON (s.legacy_id) s.*, owner.new_id AS user_id, moderator.new_id AS moderator_id
+            FROM {SCHEMA}.import_tickets s
+            JOIN {SCHEMA}.import_id_map owner
+                ON owner.entity = 'user' AND owner.legacy_id = s.legacy_user_id
+            LEFT JOIN {SCHEMA}.import_id_map moderator
+                ON moderator.entity = 'user' AND moderator.legacy_id = s.legacy_moderator_id
+            WHERE s.legacy_id > %(after_id)s AND s.legacy_id <= %(last_id)s
+              AND NOT EXISTS (
+                  SELECT 1 FROM {SCHEMA}.import_id_map im
+                  WHERE im.entity = 'ticket' AND im.legacy_id = s.legacy_id
+              )
+            ORDER BY s.legacy_id
+        ),
+        allocated AS (
+            SELECT p.*, nextval('{SCHEMA}.support_tickets_id_seq') AS new_id FROM pending p
+        ),
+        inserted AS (
+            INSERT INTO {SCHEMA}.support_tickets
+            (id, title, user_id, assigned_moderator_id, status, priority, category, created_at, updated_at, closed_at)
+            SELECT new_id, title, user_id, moderator_id, status, priority, category,
+                   COALESCE(created_at, NOW()), COALESCE(updated_at, created_at, NOW()),
+                   CASE WHEN status IN ('closed', 'archived') THEN COALESCE(closed_at, updated_at, created_at) END
+            FROM allocated
+        )
+        INSERT INTO {SCHEMA}.import_id_map (entity, legacy_id, new_id)
+        SELECT 'ticket', legacy_id, new_id FROM allocated
+    """,
+    'message': f"""
+        WITH pending AS (
+            SELECT DISTINCT ON (s.legacy_id) s.*, ticket.new_id AS ticket_id, sender.new_id AS sender_id
+            FROM {SCHEMA}.import_messages s
+            JOIN {SCHEMA}.import_id_map ticket
+                ON ticket.entity = 'ticket' AND ticket.legacy_id = s.legacy_ticket_id
+            JOIN {SCHEMA}.import_id_map sender
+                ON sender.entity = 'user' AND sender.legacy_id = s.legacy_sender_id
+            WHERE s.legacy_id > %(after_id)s AND s.legacy_id <= %(last_id)s
+              AND NOT EXISTS (
+                  SELECT 1 FROM {SCHEMA}.import_id_map im
+                  WHERE im.entity = 'message' AND im.legacy_id = s.legacy_id
+              )
+            ORDER BY s.legacy_id
+        ),
+        allocated AS (
+            SELECT p.*, nextval('{SCHEMA}.messages_id_seq') AS new_id FROM pending p
+        ),
+        inserted AS (
+            INSERT INTO {SCHEMA}.messages (id, ticket_id, sender_id, content, message_type, attachment_url, created_at)
+            SELECT new_id, ticket_id, sender_id, content, message_type, attachment_url, COALESCE(created_at, NOW())
+            FROM allocated
+        )
+        INSERT INTO {SCHEMA}.import_id_map (entity, legacy_id, new_id)
+        SELECT 'message', legacy_id, new_id FROM allocated
+    """,
+}
+
+# Сущность -> (промежуточная таблица, поле связи с родителем для подсчёта сирот)
+STAGES = [
+    ('user', 'import_users', None),
+    ('ticket', 'import_tickets', ('legacy_user_id', 'user')),
+    ('message', 'import_messages', ('legacy_ticket_id', 'ticket')),
+]
+
+
+class Progress:
+    '''Печатает прогресс этапа в stderr'''
+
+    def __init__(self, stage: str) -> None:
+        self.stage = stage
+        self.started = time.perf_counter()
+
+    def report(self, done: int, what: str) -> None:
+        elapsed = max(time.perf_counter() - self.started, 1e-9)
+        print(f'[{self.stage}] {what} {done} rows, {done / elapsed:.0f} rows/s', file=sys.stderr)
+
+
+def copy_chunk(cur, table: str, columns: List[str], rows: List[tuple]) -> None:
+    '''Отправляет пачку строк в промежуточную таблицу через COPY'''
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow(['' if value is None else value for value in row])
+    buffer.seek(0)
+    cur.copy_expert(
+        f"COPY {SCHEMA}.{table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)",
+        buffer
+    )
+
+
+def load_staging(conn, path: str, table: str, validate: Callable, rejects) -> Tuple[int, int]:
+    '''Проверяет дамп и загружает корректные строки в промежуточную таблицу'''
+    cur = conn.cursor()
+    cur.execute(f'TRUNCATE {SCHEMA}.{table}')
+    progress = Progress(table)
+    loaded = rejected = 0
+    chunk: List[tuple] = []
+
+    for line_number, row in enumerate(read_rows(path), start=1):
+        try:
+            values = validate(row)
+        except (ValueError, TypeError) as e:
+            rejected += 1
+            if rejects:
+                rejects.write(json.dumps({'file': path, 'line': line_number, 'error': str(e), 'row': row},
+                                         ensure_ascii=False, default=str) + '\n')
+            continue
+
+        chunk.append(values)
+        if len(chunk) >= COPY_CHUNK_ROWS:
+            copy_chunk(cur, table, validate.columns, chunk)
+            loaded += len(chunk)
+            chunk = []
+            progress.report(loaded, 'staged')
+
+    if chunk:
+        copy_chunk(cur, table, validate.columns, chunk)
+        loaded += len(chunk)
+    conn.commit()
+    progress.report(loaded, 'staged')
+    return loaded, rejected
+
+
+def merge_stage(conn, entity: str, table: str) -> int:
+    '''Переносит строки из промежуточной таблицы пачками с фиксацией каждой пачки'''
+    cur = conn.cursor()
+    progress = Progress(f'{entity} merge')
+    after_id = -1
+    merged = 0
+    while True:
+        cur.execute(f"""
+            SELECT MAX(legacy_id) FROM (
+                SELECT legacy_id FROM {SCHEMA}.{table}
+                WHERE legacy_id > %s
+                ORDER BY legacy_id
+                LIMIT %s
+            ) chunk
+        """, (after_id, MERGE_CHUNK_ROWS))
+        last_id = cur.fetchone()[0]
+        if last_id is None:
+            break
+
+        cur.execute(MERGE_SQL[entity], {'after_id': after_id, 'last_id': last_id})
+        merged += cur.rowcount
+        conn.commit()
+        after_id = last_id
+        progress.report(merged, 'merged')
+    return merged
+
+
+def ensure_message_partitions(conn) -> None:
+    '''Создаёт партиции messages для всех месяцев из промежуточной таблицы до переноса'''
+    # Без партиции месяца строки уходят в messages_default
+    cur = conn.cursor()
+    cur.execute(f"""
+        SELECT {SCHEMA}.ensure_messages_partition(month::date)
+        FROM (
+            SELECT DISTINCT date_trunc('month', COALESCE(created_at, NOW())) AS month
+            FROM {SCHEMA}.import_messages
+        ) months
+        ORDER BY month
+    """)
+    conn.commit()
+
+
+def count_orphans(conn, table: str, parent_field: str, parent_entity: str) -> int:
+    '''Строки, чей родитель не импортирован (они пропускаются при переносе)'''
+    cur = conn.cursor()
+    cur.execute(f"""
+        SELECT COUNT(*) FROM {SCHEMA}.{table} s
+        WHERE NOT EXISTS (
+            SELECT 1 FROM {SCHEMA}.import_id_map im
+            WHERE im.entity = %s AND im.legacy_id = s.{parent_field}
+        )
+    """, (parent_entity,))
+    return cur.fetchone()[0]
+
+
+def rewind_rollups(conn) -> None:
+    '''Сдвигает водяной знак дневных агрегатов на самую раннюю импортированную дату'''
+    cur = conn.cursor()
+    cur.execute(f"""
+        UPDATE {SCHEMA}.job_watermarks
+        SET watermark = LEAST(watermark, imported.earliest), updated_at = NOW()
+        FROM (
+            SELECT LEAST(
+                (SELECT MIN(created_at) FROM {SCHEMA}.import_tickets),
+                (SELECT MIN(created_at) FROM {SCHEMA}.import_messages)
+            ) AS earliest
+        ) imported
+        WHERE job_name = 'daily_ticket_rollups' AND imported.earliest IS NOT NULL
+    """)
+    conn.commit()
+
+
+def run_import(database_url: str, paths: Dict[str, Optional[str]], rejects_path: Optional[str] = None) -> Dict[str, Any]:
+    '''Выполняет импорт всех переданных дампов и возвращает сводку'''
+    validators = {'user': UserValidator(), 'ticket': validate_ticket, 'message': validate_message}
+    summary: Dict[str, Any] = {}
+    conn = psycopg2.connect(database_url)
+    rejects = open(rejects_path, 'w', encoding='utf-8') if rejects_path else None
+    started = time.perf_counter()
+    try:
+        for entity, table, parent in STAGES:
+            path = paths.get(entity)
+            if not path:
+                continue
+            staged, rejected = load_staging(conn, path, table, validators[entity], rejects)
+            if entity == 'message':
+                ensure_message_partitions(conn)
+            merged = merge_stage(conn, entity, table)
+            orphans = count_orphans(conn, table, *parent) if parent else 0
+            summary[entity] = {'staged': staged, 'rejected': rejected, 'merged': merged, 'orphans': orphans}
+        rewind_rollups(conn)
+    finally:
+        if rejects:
+            rejects.close()
+        conn.close()
+    summary['seconds'] = round(time.perf_counter() - started, 2)
+    return summary
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Bulk import of legacy support history')
+    parser.add_argument('--users')
+    parser.add_argument('--tickets')
+    parser.add_argument('--messages')
+    parser.add_argument('--rejects', help='NDJSON file for rows that failed validation')
+    args = parser.parse_args()
+
+    database_url = os.environ.get('DATABASE_URL')
+    if not database_url:
+        print('DATABASE_URL is required', file=sys.stderr)
+        return 2
+    if not (args.users or args.tickets or args.messages):
+        parser.error('at least one of --users, --tickets, --messages is required')
+
+    summary = run_import(database_url, {'user': args.users, 'ticket': args.tickets, 'message': args.messages},
+                         args.rejects)
+    print(json.dumps(summary, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
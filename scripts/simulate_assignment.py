@@ -0,0 +1,128 @@
+"""
+Симуляция автоматического назначения заявок модераторам.
+
+Моделирует поток заявок (пуассоновский, с долями приоритетов) и запуски задачи
+maintenance `assign` по таймеру. Выбор модератора делает та же функция
+pick_moderator, что и задача в БД. Модератор ведёт несколько заявок
+одновременно в пределах MODERATOR_MAX_LOAD; время обработки заявки растёт с
+приоритетом и падает с экспертизой в категории.
+
+Для каждой интенсивности потока выводит время ожидания назначения
+(от создания заявки до назначения) и среднюю загрузку модераторов.
+
+Запуск: python scripts/simulate_assignment.py [--moderators 8] [--rates 30,60,120,240,480] [--hours 8]
+"""
+import argparse
+import heapq
+import importlib.util
+import os
+import random
+import statistics
+import sys
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend')
+
+CATEGORIES = ['general', 'technical', 'billing', 'complaint']
+PRIORITY_SHARES = {'low': 0.3, 'medium': 0.45, 'high': 0.2, 'urgent': 0.05}
+
+
+def load_maintenance():
+    '''Импортирует index.py функции maintenance'''
+    path = os.path.join(BACKEND_DIR, 'maintenance', 'index.py')
+    spec = importlib.util.spec_from_file_location('maintenance_index', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def percentile(values: list, fraction: float) -> float:
+    '''Перцентиль по отсортированной выборке; 0 для пустой'''
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def simulate(maintenance, rate_per_hour: float, args: argparse.Namespace, rng: random.Random) -> dict:
+    '''Прогоняет одну интенсивность потока; время в минутах'''
+    weights = maintenance.PRIORITY_WEIGHTS
+    moderators = list(range(1, args.moderators + 1))
+    # Каждый модератор силён в одной категории и слаб в другой
+    expertise = {
+        m: {CATEGORIES[m % len(CATEGORIES)]: 2.0, CATEGORIES[(m + 1) % len(CATEGORIES)]: 0.5}
+        for m in moderators
+    }
+    loads = {m: 0 for m in moderators}
+    finishing = []  # куча (время окончания, модератор, вес)
+    queue = []      # (время создания, приоритет, категория)
+    waits = {p: [] for p in weights}
+    load_samples = []
+
+    duration = args.hours * 60
+    next_arrival = rng.expovariate(rate_per_hour / 60)
+    now = 0.0
+    while now < duration:
+        now += args.interval
+        while finishing and finishing[0][0] <= now:
+            _, moderator_id, weight = heapq.heappop(finishing)
+            loads[moderator_id] -= weight
+        while next_arrival <= now:
+            priority = rng.choices(list(PRIORITY_SHARES), weights=list(PRIORITY_SHARES.values()))[0]
+            queue.append((next_arrival, priority, rng.choice(CATEGORIES)))
+            next_arrival += rng.expovariate(rate_per_hour / 60)
+
+        # Один запуск задачи assign: куча строится заново из текущей нагрузки
+        heap = [(load, m) for m, load in loads.items()]
+        heapq.heapify(heap)
+        queue.sort(key=lambda t: (-list(weights).index(t[1]), t[0]))
+        remaining = []
+        for created_at, priority, category in queue:
+            weight = weights[priority]
+            moderator_id = maintenance.pick_moderator(heap, expertise, category, weight, args.max_load)
+            if moderator_id is None:
+                remaining.append((created_at, priority, category))
+                continue
+            loads[moderator_id] += weight
+            waits[priority].append(now - created_at)
+            skill = expertise[moderator_id].get(category, 1.0)
+            service = rng.expovariate(1 / (args.service_minutes * weight / skill))
+            heapq.heappush(finishing, (now + service, moderator_id, weight))
+        queue = remaining
+        load_samples.append(sum(loads.values()) / (args.max_load * len(moderators)))
+
+    all_waits = [w for values in waits.values() for w in values]
+    return {
+        'assigned': len(all_waits),
+        'backlog': len(queue),
+        'p50': percentile(all_waits, 0.5),
+        'p95': percentile(all_waits, 0.95),
+        'urgent_p95': percentile(waits['urgent'], 0.95),
+        'utilization': statistics.mean(load_samples) if load_samples else 0.0,
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Queue wait of automatic ticket assignment')
+    parser.add_argument('--moderators', type=int, default=8)
+    parser.add_argument('--rates', default='30,60,120,240,480', help='tickets per hour, comma separated')
+    parser.add_argument('--hours', type=float, default=8)
+    parser.add_argument('--interval', type=float, default=1.0, help='minutes between assign runs')
+    parser.add_argument('--service-minutes', type=float, default=15.0, help='handling time per unit of priority weight')
+    parser.add_argument('--max-load', type=int, default=None, help='default: MODERATOR_MAX_LOAD')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    maintenance = load_maintenance()
+    if args.max_load is None:
+        args.max_load = maintenance.MODERATOR_MAX_LOAD
+
+    print(f"{'rate/h':>7}{'assigned':>10}{'backlog':>9}{'p50 min':>9}{'p95 min':>9}{'urgent p95':>12}{'util':>7}")
+    for rate in [float(r) for r in args.rates.split(',')]:
+        result = simulate(maintenance, rate, args, random.Random(args.seed))
+        print(f"{rate:>7.0f}{result['assigned']:>10}{result['backlog']:>9}{result['p50']:>9.1f}"
+              f"{result['p95']:>9.1f}{result['urgent_p95']:>12.1f}{result['utilization'] * 100:>6.0f}%")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
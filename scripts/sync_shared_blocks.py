@@ -0,0 +1,79 @@
+"""
+Синхронизация общих блоков кода облачных функций.
+
+Платформа разворачивает каждую функцию из своего каталога backend/<name>/
+отдельно, и функция не может импортировать модули соседних каталогов. Поэтому
+общий слой доступа к БД копируется в index.py функций. Канонический текст
+блока лежит в shared/<файл>, копия в функции стоит между маркерами
+
+    # >>> shared/<файл> (копия, правится в shared/ и переносится этим скриптом)
+    ...
+    # <<< shared/<файл>
+
+Без аргументов скрипт переписывает копии из канона. С --check файлы не
+меняются, а расхождение копии с каноном завершает скрипт с кодом 1.
+
+Запуск: python scripts/sync_shared_blocks.py [--check]
+"""
+import argparse
+import glob
+import os
+import re
+import sys
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+BLOCK_PATTERN = re.compile(
+    r'^# >>> (shared/[\w.]+)[^\n]*\n(.*?)^# <<< \1\n',
+    re.S | re.M
+)
+
+
+def read_text(path: str) -> str:
+    with open(path, encoding='utf-8') as f:
+        return f.read()
+
+
+def sync_file(path: str, check: bool) -> list:
+    '''Сверяет или переписывает блоки одного файла; возвращает разошедшиеся блоки'''
+    source = read_text(path)
+    drifted = []
+
+    def replace(match: re.Match) -> str:
+        canonical = read_text(os.path.join(ROOT_DIR, match.group(1)))
+        if match.group(2) != canonical:
+            drifted.append(match.group(1))
+        start, end = match.start(2) - match.start(0), match.end(2) - match.start(0)
+        return match.group(0)[:start] + canonical + match.group(0)[end:]
+
+    updated = BLOCK_PATTERN.sub(replace, source)
+    if drifted and not check:
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(updated)
+    return drifted
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Sync shared code blocks into cloud functions')
+    parser.add_argument('--check', action='store_true', help='only report drifted copies')
+    args = parser.parse_args()
+
+    drifted_total = 0
+    for path in sorted(glob.glob(os.path.join(ROOT_DIR, 'backend', '*', 'index.py'))):
+        name = os.path.basename(os.path.dirname(path))
+        source = read_text(path)
+        if source.count('# >>> shared/') != source.count('# <<< shared/'):
+            print(f'{name}: unbalanced shared block markers')
+            drifted_total += 1
+            continue
+        for block in sync_file(path, args.check):
+            print(f"{name}: {block} {'differs from canonical copy' if args.check else 'updated'}")
+            drifted_total += 1
+
+    if args.check and drifted_total:
+        print('run: python scripts/sync_shared_blocks.py')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,68 @@
+# Повторы POST с тем же заголовком Idempotency-Key получают сохранённый ответ
+# и не доходят до вставки. Ключи живут IDEMPOTENCY_TTL_HOURS часов.
+IDEMPOTENCY_TTL_HOURS = int(os.environ.get('IDEMPOTENCY_TTL_HOURS', '24'))
+IDEMPOTENCY_KEY_MAX_LENGTH = 100
+
+# Запросы таблицы idempotency_keys добавляются в реестр функции
+STATEMENTS.update({
+    'idempotency_lookup': """
+        SELECT status_code, response_body
+        FROM idempotency_keys
+        WHERE user_id = $1 AND scope = $2 AND idempotency_key = $3
+          AND status_code IS NOT NULL AND created_at > NOW() - make_interval(hours => $4)
+    """,
+    'idempotency_claim': """
+        INSERT INTO idempotency_keys (user_id, scope, idempotency_key)
+        VALUES ($1, $2, $3)
+        ON CONFLICT (user_id, scope, idempotency_key) DO UPDATE
+        SET status_code = NULL, response_body = NULL, created_at = NOW()
+        WHERE idempotency_keys.created_at <= NOW() - make_interval(hours => $4)
+    """,
+    'idempotency_store': """
+        UPDATE idempotency_keys
+        SET status_code = $4, response_body = $5
+        WHERE user_id = $1 AND scope = $2 AND idempotency_key = $3
+    """,
+})
+
+def get_idempotency_key(headers: Dict[str, Any]) -> Optional[str]:
+    '''Достаёт Idempotency-Key из заголовков запроса'''
+    key = headers.get('Idempotency-Key') or headers.get('idempotency-key')
+    return key.strip()[:IDEMPOTENCY_KEY_MAX_LENGTH] if key and key.strip() else None
+
+def find_idempotent_response(cur, user_id: Any, scope: str, key: str) -> Optional[Dict[str, Any]]:
+    '''Возвращает сохранённый ответ на запрос с этим ключом, если он есть'''
+    execute_prepared(cur, 'idempotency_lookup', (user_id, scope, key, IDEMPOTENCY_TTL_HOURS))
+    row = cur.fetchone()
+    if not row:
+        return None
+    return {
+        'statusCode': row[0],
+        'headers': {'Access-Control-Allow-Origin': '*', 'Idempotent-Replayed': 'true'},
+        'body': row[1]
+    }
+
+def claim_idempotency_key(cur, user_id: Any, scope: str, key: str) -> bool:
+    '''Занимает ключ в текущей транзакции; параллельный повтор ждёт её завершения'''
+    execute_prepared(cur, 'idempotency_claim', (user_id, scope, key, IDEMPOTENCY_TTL_HOURS))
+    return cur.rowcount == 1
+
+def resolve_idempotency_key(cur, user_id: Any, scope: str, key: str) -> Optional[Dict[str, Any]]:
+    '''Возвращает готовый ответ для повтора или None, если запрос нужно выполнить'''
+    stored = find_idempotent_response(cur, user_id, scope, key)
+    if stored is not None or claim_idempotency_key(cur, user_id, scope, key):
+        return stored
+    # Ключ занял параллельный запрос, который уже зафиксировал свой ответ
+    stored = find_idempotent_response(cur, user_id, scope, key)
+    if stored is not None:
+        return stored
+    return {
+        'statusCode': 409,
+        'headers': {'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({'error': 'Request with this Idempotency-Key is already in progress'})
+    }
+
+def store_idempotent_response(cur, user_id: Any, scope: str, key: Optional[str], response: Dict[str, Any]) -> None:
+    '''Сохраняет ответ под ключом в той же транзакции, что и запись'''
+    if key:
+        execute_prepared(cur, 'idempotency_store', (user_id, scope, key, response['statusCode'], response['body']))
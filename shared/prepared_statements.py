@@ -0,0 +1,35 @@
+# Запросы берутся из реестра STATEMENTS, который функция определяет до
+# этого блока. Имена уже подготовленных запросов по соединениям:
+# id(conn) -> (conn, {name})
+_prepared: Dict[int, Any] = {}
+
+def execute_prepared(cur, name: str, params: tuple = ()) -> None:
+    '''Выполняет запрос из STATEMENTS, подготавливая его на соединении при первом обращении'''
+    import psycopg2.errors
+    import psycopg2.extensions
+    conn = cur.connection
+    entry = _prepared.get(id(conn))
+    if entry is None or entry[0] is not conn:
+        entry = (conn, set())
+        _prepared[id(conn)] = entry
+    names = entry[1]
+    
+    # Повтор после сброса безопасен, только если запрос открывает транзакцию
+    starts_transaction = conn.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_IDLE
+    placeholders = ' (' + ', '.join(['%s'] * len(params)) + ')' if params else ''
+    
+    for attempt in range(2):
+        try:
+            if name not in names:
+                cur.execute(f'PREPARE {name} AS {STATEMENTS[name]}')
+                names.add(name)
+            cur.execute(f'EXECUTE {name}{placeholders}', params)
+            return
+        except (psycopg2.errors.FeatureNotSupported, psycopg2.errors.InvalidSqlStatementName):
+            # Схема изменилась ("cached plan must not change result type")
+            # или подготовленный запрос пропал: сбрасываем реестр соединения
+            conn.rollback()
+            cur.execute('DEALLOCATE ALL')
+            names.clear()
+            if attempt or not starts_transaction:
+                raise
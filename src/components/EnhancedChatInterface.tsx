@@ -29,12 +29,16 @@ interface Message {
   created_at: string;
   edited_at?: string;
   is_flagged: boolean;
-  sender: {
-    username: string;
-    role: string;
-    station: string;
-    avatar_url: string;
-  };
+  sender_id: number;
+  sender: MessageSender;
+}
+
+interface MessageSender {
+  username: string;
+  role: string;
+  station: string;
+  avatar_url: string;
+  is_banned: boolean;
 }
 
 interface ChatTicket {
@@ -65,10 +69,14 @@ export default function EnhancedChatInterface({ user, token, onLogout }: Enhance
   const [tickets, setTickets] = useState<ChatTicket[]>([]);
   const [selectedTicket, setSelectedTicket] = useState<number | null>(null);
   const [messages, setMessages] = useState<Message[]>([]);
+  // Заявка, которой принадлежат загруженные messages: после смены заявки
+  // в messages до ответа сервера остаётся история предыдущей
+  const [messagesTicketId, setMessagesTicketId] = useState<number | null>(null);
   const [newMessage, setNewMessage] = useState('');
   const [loading, setLoading] = useState(false);
   const [ticketsLoading, setTicketsLoading] = useState(true);
   const [showModeratorPanel, setShowModeratorPanel] = useState(false);
+  const [unreadCounts, setUnreadCounts] = useState<Record<string, number>>({});
   const messagesEndRef = useRef<HTMLDivElement>(null);
   const { toast } = useToast();
 
@@ -81,10 +89,10 @@ export default function EnhancedChatInterface({ user, token, onLogout }: Enhance
     audio.play().catch(() => {});
   }, []);
 
-  const loadTickets = useCallback(async () => {
+  const loadTickets = useCallback(async (fresh = false) => {
     try {
       const response = await fetch(
-        `https://functions.poehali.dev/20a6993a-51e0-4297-99c3-b33e9397a495?role=${user.role}`,
+        `https://functions.poehali.dev/20a6993a-51e0-4297-99c3-b33e9397a495?role=${user.role}${fresh ? '&fresh=1' : ''}`,
         {
           headers: {
             'X-User-Id': user.id.toString(),
@@ -114,10 +122,10 @@ export default function EnhancedChatInterface({ user, token, onLogout }: Enhance
     }
   }, [user.id, user.role, token, toast]);
 
-  const loadMessages = useCallback(async (ticketId: number) => {
+  const loadMessages = useCallback(async (ticketId: number, fresh = false) => {
     try {
       const response = await fetch(
-        `https://functions.poehali.dev/5fec0027-eeb9-465f-9d7f-78bc52bfd905?ticket_id=${ticketId}`,
+        `https://functions.poehali.dev/5fec0027-eeb9-465f-9d7f-78bc52bfd905?ticket_id=${ticketId}${fresh ? '&fresh=1' : ''}`,
         {
           headers: {
             'X-User-Id': user.id.toString(),
@@ -128,17 +136,83 @@ export default function EnhancedChatInterface({ user, token, onLogout }: Enhance
 
       if (response.ok) {
         const data = await response.json();
-        setMessages(data.messages || []);
+        // Профили отправителей приходят один раз в словаре senders
+        const senders: Record<string, MessageSender> = data.senders || {};
+        setMessages((data.messages || []).map((message: Omit<Message, 'sender'>) => ({
+          ...message,
+          sender: senders[message.sender_id],
+        })));
+        setMessagesTicketId(ticketId);
       }
     } catch (error) {
       console.error('Failed to load messages:', error);
     }
   }, [user.id, token]);
 
+  // Бейджи непрочитанного: один запрос за счётчиками вместо перезагрузки списков
+  const loadUnread = useCallback(async () => {
+    try {
+      const response = await fetch(
+        'https://functions.poehali.dev/5fec0027-eeb9-465f-9d7f-78bc52bfd905?action=unread',
+        {
+          headers: {
+            'X-User-Id': user.id.toString(),
+            'X-Auth-Token': token,
+          },
+        }
+      );
+
+      if (response.ok) {
+        const data = await response.json();
+        setUnreadCounts(data.unread || {});
+      }
+    } catch (error) {
+      console.error('Failed to load unread counts:', error);
+    }
+  }, [user.id, token]);
+
+  const markRead = useCallback(async (ticketId: number, messageId: number) => {
+    setUnreadCounts(prev => {
+      const next = { ...prev };
+      delete next[ticketId];
+      return next;
+    });
+    try {
+      await fetch('https://functions.poehali.dev/5fec0027-eeb9-465f-9d7f-78bc52bfd905', {
+        method: 'POST',
+        headers: {
+          'Content-Type': 'application/json',
+          'X-User-Id': user.id.toString(),
+          'X-Auth-Token': token,
+        },
+        body: JSON.stringify({ action: 'mark_read', ticket_id: ticketId, message_id: messageId }),
+      });
+    } catch (error) {
+      console.error('Failed to mark ticket as read:', error);
+    }
+  }, [user.id, token]);
+
   useEffect(() => {
     loadTickets();
   }, [loadTickets]);
 
+  useEffect(() => {
+    loadUnread();
+    const interval = setInterval(loadUnread, 15000);
+    return () => clearInterval(interval);
+  }, [loadUnread]);
+
+  useEffect(() => {
+    if (
+      selectedTicket &&
+      messagesTicketId === selectedTicket &&
+      unreadCounts[selectedTicket] > 0 &&
+      messages.length > 0
+    ) {
+      markRead(selectedTicket, messages[messages.length - 1].id);
+    }
+  }, [selectedTicket, messagesTicketId, messages, unreadCounts, markRead]);
+
   useEffect(() => {
     if (selectedTicket) {
       loadMessages(selectedTicket);
@@ -181,8 +255,8 @@ export default function EnhancedChatInterface({ user, token, onLogout }: Enhance
 
       if (response.ok) {
         setNewMessage('');
-        loadMessages(selectedTicket);
-        loadTickets();
+        loadMessages(selectedTicket, true);
+        loadTickets(true);
         playNotificationSound();
         toast({
           title: "Сообщение отправлено",
@@ -228,7 +302,7 @@ export default function EnhancedChatInterface({ user, token, onLogout }: Enhance
 
       if (response.ok) {
         const data = await response.json();
-        loadTickets();
+        loadTickets(true);
         setSelectedTicket(data.ticket.id);
         toast({
           title: "Заявка создана",
@@ -270,7 +344,7 @@ export default function EnhancedChatInterface({ user, token, onLogout }: Enhance
           title: "Жалоба отправлена",
           description: data.user_banned ? 'Пользователь заблокирован за нарушения' : 'Жалоба зарегистрирована',
         });
-        loadMessages(selectedTicket!);
+        loadMessages(selectedTicket!, true);
       }
     } catch (error) {
       toast({
@@ -466,6 +540,11 @@ export default function EnhancedChatInterface({ user, token, onLogout }: Enhance
                             name="AlertTriangle" 
                             className={`w-3 h-3 ${getPriorityColor(ticket.priority)}`}
                           />
+                          {unreadCounts[ticket.id] > 0 && (
+                            <Badge className="text-xs font-mono bg-coldfire-orange text-coldfire-black">
+                              {unreadCounts[ticket.id]}
+                            </Badge>
+                          )}
                         </div>
                         <span className="text-xs text-gray-400 font-mono">
                           {formatTime(ticket.created_at)}